@@ -1,4 +1,22 @@
+import json
+from typing import Optional
+from app.config.config import config
+from app.utils.chunking import chunk_text
+from app.utils.helper import clean_json_response
+from app.utils.json_constraint import OutputSchema
+from app.utils.logger import get_logger
+from app.utils.timing import stage
+
+logger = get_logger(__name__)
+
+# Input each agent is run on at startup (ModelLifecycle.warmup)
+WARMUP_NOTE = "Patient reports a mild headache since this morning. No fever. Plan: rest and fluids."
+
+
 class BaseAgent:
+    # JSON shape of the agent's output, used for constrained decoding
+    output_schema: Optional[OutputSchema] = None
+
     def __init__(self, name: str):
         self.name = name
 
@@ -6,4 +24,51 @@ class BaseAgent:
         raise NotImplementedError("Must override load_model()")
 
     def respond(self, *args, **kwargs):
-        raise NotImplementedError("Must override respond()")
\ No newline at end of file
+        raise NotImplementedError("Must override respond()")
+
+    def stream(self, *args, **kwargs):
+        raise NotImplementedError("Must override stream()")
+
+    def warmup(self):
+        """Run the agent's generation path once on `WARMUP_NOTE`, with WARMUP_MAX_TOKENS output tokens."""
+
+    def split_input(self, text: str, kind: str) -> list:
+        """
+        Chunks of a note ("note") or transcript ("transcript") too long for one pass,
+        or just [text] when it fits in CHUNK_MAX_TOKENS or chunking is off.
+        """
+        if not config.CHUNKING_ENABLED or not text:
+            return [text]
+        with stage("chunking"):
+            chunks = chunk_text(
+                text, kind, config.CHUNK_MAX_TOKENS, config.CHUNK_OVERLAP_TOKENS, self.backend.count_tokens
+            )
+        if len(chunks) > 1:
+            logger.info(f"{self.name} split a {kind} of {len(text)} chars into {len(chunks)} chunks")
+        return chunks
+
+    def try_parse(self, raw_result: str):
+        """`parse_result` for one chunk of a map/reduce run: a chunk that fails to parse is dropped."""
+        try:
+            return BaseAgent.parse_result(self, raw_result)
+        except Exception as e:
+            logger.error(f"{self.name} could not parse a chunk result: {e}")
+            return None
+
+    def generation_schema(self) -> Optional[OutputSchema]:
+        return self.output_schema if config.CONSTRAINED_DECODING else None
+
+    def parse_result(self, raw_result: str):
+        """
+        Parse the JSON the model generated. Constrained output parses as is; anything
+        else (unconstrained or cut off at the token cap) goes through the regex repair.
+        """
+        with stage("json_parse"):
+            try:
+                data = json.loads(raw_result)
+            except json.JSONDecodeError:
+                with stage("json_repair"):
+                    return json.loads(clean_json_response(raw_result))
+            if isinstance(data, list):
+                data = [entry for entry in data if not isinstance(entry, dict) or entry.get("description")]
+            return data
\ No newline at end of file
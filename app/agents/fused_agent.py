@@ -0,0 +1,87 @@
+from typing import Dict, Tuple
+
+from app.agents.base_agent import WARMUP_NOTE, BaseAgent
+from app.agents.router_agent import RouterAgent
+from app.backends import get_backend
+from app.config.config import config
+from app.graph.types import RequestPayload, State
+from app.utils.helper import StateSummary
+from app.utils.logger import get_logger
+from app.utils.prompt_builder import build_fused_prompt
+from app.utils.timing import stage
+from app.utils.tracing import traced
+
+logger = get_logger(__name__)
+
+
+def split_fused_output(text: str) -> Tuple[str, str]:
+    """
+    Split a fused generation into its task label and the JSON that follows it.
+    The label is everything before the first JSON bracket, so it does not matter
+    whether the model put a newline after it.
+    """
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    cut = min(starts) if starts else len(text)
+    label = text[:cut].strip().strip("\"'`.:").strip().lower()
+    return label, text[cut:]
+
+
+class FusedRouteAgent(BaseAgent):
+    """
+    Routes and answers in one generation. When the explicit and heuristic tiers
+    cannot decide, a single prompt asks for the task label followed by the task's
+    JSON, so the note is prefilled once instead of once by the router and again by
+    the task agent, whose `parse_result` then reads the JSON. Images, requests the
+    cheap tiers can route and notes long enough to be chunked go through the
+    regular router.
+    """
+
+    def __init__(self, router: RouterAgent, task_agents: Dict[str, BaseAgent]):
+        super().__init__(name="FusedRouteAgent")
+        self.router = router
+        # The ICD-10 and SOAP agents, which parse (and for ICD-10, resolve) the fused output
+        self.task_agents = task_agents
+        self.backend = get_backend()
+        self.backend.warm_prefix("fused")
+
+    def build_prompt(self, state: State) -> str:
+        with stage("prompt_build"):
+            return build_fused_prompt(state.payload.note or "")
+
+    @traced
+    def respond(self, state: State):
+        return self.backend.generate(
+            self.build_prompt(state), prefix_key="fused",
+            max_tokens=max(config.ICD10_MAX_TOKENS, config.SOAP_MAX_TOKENS) + config.ROUTER_MAX_TOKENS,
+        )
+
+    def warmup(self):
+        self.backend.generate(
+            self.build_prompt(State(payload=RequestPayload(note=WARMUP_NOTE))), prefix_key="fused",
+            max_tokens=config.WARMUP_MAX_TOKENS,
+        )
+
+    def needs_chunking(self, note: str) -> bool:
+        # The fused prompt takes the whole note; the task agents split long ones
+        return config.CHUNKING_ENABLED and self.backend.count_tokens(note) > config.CHUNK_MAX_TOKENS
+
+    def run(self, state: State) -> State:
+        logger.debug("Running %s: %s", self.name, StateSummary(state))
+        with stage("routing"):
+            _, task = self.router.decide(state)
+        if task is not None or state.payload.images or self.needs_chunking(state.payload.note or ""):
+            return self.router.run(state)
+
+        try:
+            raw_result = self.respond(state).text
+            logger.debug("FusedRouteAgent response: %s", raw_result)
+            label, body = split_fused_output(raw_result)
+            if label not in ("icd10", "soap"):
+                label = f"fused:{label}"  # reported by apply_route as an unknown route
+            routed = self.router.apply_route(state, "fused", label)
+            if not routed.error:
+                routed.result = self.task_agents[label].parse_result(body)
+            return routed
+        except Exception as e:
+            state.error = str(e)
+            return state
@@ -1,59 +1,134 @@
-from app.agents.base_agent import BaseAgent
-from app.utils.model_loader import load_medgemma_model
+import json
+from app.agents.base_agent import WARMUP_NOTE, BaseAgent
+from app.backends import get_backend
+from app.api.schemas import ICD10Code
+from app.config.config import config
+from app.utils.icd10_index import display_code, get_icd10_index, normalize_code
+from app.utils.icd10_retrieval import get_icd10_retriever
+from app.utils.chunking import combine_outputs, merge_icd10_codes
+from app.utils.json_constraint import OutputSchema
 from app.utils.prompt_builder import build_icd10_prompt
 from app.graph.types import State
+from app.utils.helper import StateSummary
 from app.utils.logger import get_logger
-from app.utils.helper import clean_json_response
-import json
-from PIL import Image
+from app.utils.timing import stage
 from typing import Optional
-from langsmith.run_helpers import traceable
-from mlx_vlm.prompt_utils import apply_chat_template
-from mlx_vlm import generate
-import numpy as np
+from app.utils.tracing import traced
 
 logger = get_logger(__name__)
 
+FULL_SCHEMA = OutputSchema.from_model(ICD10Code, array=True, exclude=("flag",))
+COMPACT_SCHEMA = OutputSchema.string_array("ICD10Codes")
+
 class ICD10Agent(BaseAgent):
     def __init__(self):
         super().__init__(name="ICD10Agent")
-        self.model, self.processor, self.config = load_medgemma_model()
+        self.backend = get_backend()
+        self.index = get_icd10_index()
+        self.compact = config.ICD10_COMPACT_OUTPUT
+        if self.compact and self.index is None:
+            raise ValueError(
+                f"ICD10_COMPACT_OUTPUT needs an ICD-10 index at ICD10_INDEX_PATH ({config.ICD10_INDEX_PATH})"
+            )
+        self.retriever = get_icd10_retriever() if config.ICD10_RETRIEVAL_ENABLED else None
+        self.prefix_key = "icd10_compact" if self.compact else "icd10"
+        self.output_schema = COMPACT_SCHEMA if self.compact else FULL_SCHEMA
+        self.backend.warm_prefix(self.prefix_key)
 
-    @traceable
+    def build_prompt(self, state: State) -> str:
+        clinical_note = state.payload.clinical_note
+        logger.debug("Generating ICD-10 codes for a note of %d chars", len(clinical_note or ""))
+        return self.prompt_for(clinical_note)
+
+    def prompt_for(self, clinical_note: str) -> str:
+        candidates = None
+        if self.retriever is not None and clinical_note:
+            with stage("retrieval"):
+                candidates = self.retriever.search(clinical_note, config.ICD10_RETRIEVAL_TOP_K)
+        with stage("prompt_build"):
+            return build_icd10_prompt(clinical_note, compact=self.compact, candidates=candidates)
+
+    @traced
     def respond(self, state: State) -> str:
+        logger.debug("Called respond: %s", StateSummary(state))
+        chunks = self.split_input(state.payload.clinical_note or "", "note")
+        if len(chunks) == 1:
+            # Coding is text-only: no image tokens, no vision tower
+            return self.generate(self.build_prompt(state))
 
-        logger.info(f"Called respond with state: {state}")
-        clinical_note = state.payload["clinical_note"] if "clinical_note" in state.payload else None
-        image = [state.payload["image"] if "image" in state.payload else  Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8))] 
+        # Long notes: code the chunks together as one batch, then merge the code lists
+        outputs = self.backend.generate_batch(
+            [self.prompt_for(chunk) for chunk in chunks], prefix_key=self.prefix_key,
+            max_tokens=config.ICD10_MAX_TOKENS, schema=self.generation_schema(),
+        )
+        merged = merge_icd10_codes([self.try_parse(output.text) for output in outputs])
+        return combine_outputs(outputs, json.dumps(merged))
 
-        prompt = build_icd10_prompt(clinical_note, image)
-        formatted_prompt = apply_chat_template(
-            self.processor, self.config, prompt, num_images=1
+    def generate(self, prompt: str):
+        return self.backend.generate(
+            prompt, prefix_key=self.prefix_key, max_tokens=config.ICD10_MAX_TOKENS, schema=self.generation_schema()
+        )
+
+    def warmup(self):
+        self.backend.generate(
+            self.prompt_for(WARMUP_NOTE), prefix_key=self.prefix_key, max_tokens=config.WARMUP_MAX_TOKENS,
+            schema=self.generation_schema(),
+        )
+
+    def stream(self, state: State):
+        """Yield the generated text incrementally."""
+        if len(self.split_input(state.payload.clinical_note or "", "note")) > 1:
+            # Chunked runs are merged before anything can be shown
+            yield self.respond(state).text
+            return
+        yield from self.backend.stream(
+            self.build_prompt(state), prefix_key=self.prefix_key, max_tokens=config.ICD10_MAX_TOKENS,
+            schema=self.generation_schema(),
         )
-        logger.info(f"Generating ICD-10 codes for clinical note: {clinical_note}")
-        return generate(self.model, self.processor, formatted_prompt, image)
     
 
+    def parse_result(self, raw_result: str):
+        """Parse the generated codes and resolve them against the ICD-10-CM table."""
+        return self.resolve_codes(super().parse_result(raw_result))
+
+    def resolve_codes(self, entries) -> list:
+        """
+        Turn the model's codes (bare strings in compact mode, code/description objects
+        otherwise) into code/description dicts. With a code table loaded, known codes
+        get their canonical dotted form and description, and unknown ones are kept
+        but flagged "not_in_code_table" instead of being passed off as valid.
+        """
+        if not isinstance(entries, list):
+            return []
+        resolved, seen = [], set()
+        for entry in entries:
+            code = entry if isinstance(entry, str) else (entry.get("code") if isinstance(entry, dict) else None)
+            if not code or normalize_code(code) in seen:
+                continue
+            seen.add(normalize_code(code))
+            generated = entry.get("description", "") if isinstance(entry, dict) else ""
+            if self.index is None:
+                resolved.append({"code": code, "description": generated})
+                continue
+            description = self.index.lookup(code)
+            if description is not None:
+                resolved.append({"code": display_code(code), "description": description})
+            else:
+                logger.warning(f"Generated code {code} is not in the ICD-10-CM table")
+                resolved.append({"code": code.strip().upper(), "description": generated, "flag": "not_in_code_table"})
+        return resolved
+
     def run(self, state: State) -> State:
-        logger.info("Running ICD10Agent with state: %s", state)
+        logger.debug("Running ICD10Agent: %s", StateSummary(state))
         try:
             raw_result = self.respond(state).text
-            logger.info("ICD10Agent response: %s", raw_result)
-            parsed_result = clean_json_response(raw_result)
-            cleaned_result = json.loads(parsed_result)
-            
-            logger.info("Returning from icd10 agent with : %s", cleaned_result)
-            return State(
-                type="icd10",
-                payload=state.payload,  # preserve existing payload
-                result=cleaned_result,             # add new result
-                error=None 
-            )
+            logger.debug("ICD10Agent response: %s", raw_result)
+            state.result = self.parse_result(raw_result)
+
+            logger.debug("Returning from icd10 agent with: %s", state.result)
         except Exception as e:
-            return {
-                "payload": state.payload,
-                "error": str(e),             # add error message if exception
-            }
+            state.error = str(e)
+        return state
         
 # if __name__ == "__main__":
 #     agent = ICD10Agent()
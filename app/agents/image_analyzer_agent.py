@@ -1,52 +1,74 @@
 from app.agents.base_agent import BaseAgent
-from app.utils.model_loader import load_medgemma_model
+import numpy as np
+from app.backends import get_backend
+from app.api.schemas import RadiologyReport
+from app.config.config import config
+from app.utils.json_constraint import OutputSchema
 from app.utils.prompt_builder import build_image_analyzer_prompt
-from PIL import Image
 from app.graph.types import State
-import requests
+from app.utils.helper import StateSummary
 from app.utils.logger import get_logger
-from app.utils.helper import clean_json_response
-import json
-from langsmith.run_helpers import traceable
-from mlx_vlm.prompt_utils import apply_chat_template
-from mlx_vlm import generate
+from app.utils.timing import stage
+from app.utils.tracing import traced
 
 logger = get_logger(__name__)
 
 class ImageAnalyzerAgent(BaseAgent):
+    output_schema = OutputSchema.from_model(RadiologyReport)
+
     def __init__(self):
         super().__init__(name="ImageAnalyzerAgent")
-        self.model, self.processor, self.config = load_medgemma_model()
+        self.backend = get_backend()
 
-    @traceable
+    def build_prompt(self, state: State):
+        """
+        The prompt and the images for it. The images are taken out of the payload, so
+        the request state stops holding the pixel arrays once they go to the encoder.
+        """
+        images = state.payload.images or []
+        state.payload.images = None
+        note = state.payload.clinical_note
+        logger.debug("Generating image analysis for %d image(s) and a note of %d chars", len(images), len(note or ""))
+        with stage("prompt_build"):
+            # All images go to the model in one call, so the vision tower encodes them as one batch
+            return build_image_analyzer_prompt(note, num_images=len(images)), images
+
+    @traced
     def respond(self, state: dict) -> str:
-        image = state.payload.get("image", None)
-        note = state.payload.get("note", None)
-        logger.info(f"Generating image analysis for image: {image} with note: {note}")
-        prompt = build_image_analyzer_prompt(image, note)
-        formatted_prompt = apply_chat_template(
-            self.processor, self.config, prompt, num_images=1
+        prompt, images = self.build_prompt(state)
+        return self.backend.generate(
+            prompt, images, max_tokens=config.IMAGE_ANALYSIS_MAX_TOKENS, schema=self.generation_schema()
+        )
+
+    def warmup(self):
+        """One blank encoder-sized image, so the vision tower is compiled too."""
+        if not self.backend.supports_images:
+            return
+        blank = np.zeros((config.IMAGE_INPUT_SIZE, config.IMAGE_INPUT_SIZE, 3), np.uint8)
+        self.backend.generate(
+            build_image_analyzer_prompt(None, num_images=1), [blank], max_tokens=config.WARMUP_MAX_TOKENS,
+            schema=self.generation_schema(),
+        )
+
+    def stream(self, state: State):
+        """Yield the generated text incrementally."""
+        prompt, images = self.build_prompt(state)
+        return self.backend.stream(
+            prompt, images, max_tokens=config.IMAGE_ANALYSIS_MAX_TOKENS, schema=self.generation_schema()
         )
-        return generate(self.model, self.processor, formatted_prompt, image)
     
     def run(self, state: State) -> State:
         """
         Run the agent with the provided image.
         """
-        logger.info(f"Running {self.name} with state: {state}")
+        logger.debug("Running %s: %s", self.name, StateSummary(state))
         raw_result = self.respond(state).text
 
-        logger.info("image analysis agent response: %s", raw_result)
-        parsed_result = clean_json_response(raw_result)
-        cleaned_result = json.loads(parsed_result)
-            
-        logger.info("Cleaned result: %s", cleaned_result)
-        return State(
-            type="image_analysis",
-            payload=state.payload,  # preserve existing payload
-            result=cleaned_result,   # add new result
-            error=None              # no error
-        )
+        logger.debug("image analysis agent response: %s", raw_result)
+        state.result = self.parse_result(raw_result)
+
+        logger.debug("Cleaned result: %s", state.result)
+        return state
     
 # if __name__ == "__main__":
 #     agent = ImageAnalyzerAgent()
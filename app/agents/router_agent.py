@@ -1,16 +1,14 @@
 # app/agents/router_agent.py
-from PIL import Image
-import base64
-import io
+from app.utils.helper import StateSummary
 from app.utils.logger import get_logger
-from app.graph.types import State
+from app.utils.timing import stage
+from app.graph.types import State, task_payload
 from app.utils.prompt_builder import build_router_prompt
-from langsmith.run_helpers import traceable
-from app.agents.base_agent import BaseAgent
-from app.utils.model_loader import load_medgemma_model
-from mlx_vlm.prompt_utils import apply_chat_template
-from mlx_vlm import generate
-import numpy as np
+from app.utils.tracing import traced
+from app.agents.base_agent import WARMUP_NOTE, BaseAgent
+from app.backends import get_backend
+from app.config.config import config
+from app.utils.route_classifier import classify_route, routing_stats, TASKS
 
 
 logger = get_logger(__name__)
@@ -18,52 +16,68 @@ logger = get_logger(__name__)
 class RouterAgent(BaseAgent):
     def __init__(self):
         super().__init__(name="RouterAgent")
-        self.model, self.processor, self.config = load_medgemma_model()
+        self.backend = get_backend()
+        self.backend.warm_prefix("router")
 
-    @traceable
+    @traced
     def respond(self, state: dict) -> str:
-        image = [state.payload["image"] if "image" in state.payload else  Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8))] 
-        note = state.payload.get("note", None)
-        logger.info(f"Identifying next agent for image: {image} with note: {note}")
-        prompt = build_router_prompt(note, image)
-        logger.info(f"RouterAgent prompt: {prompt}")
-        # Apply chat template
-        formatted_prompt = apply_chat_template(
-            self.processor, self.config, prompt, num_images=1
+        images = state.payload.images or []
+        note = state.payload.note
+        logger.debug("Identifying next agent for %d image(s) and a note of %d chars", len(images), len(note or ""))
+        prompt = build_router_prompt(note, has_image=bool(images))
+        logger.debug("RouterAgent prompt: %s", prompt)
+        # One image is enough to tell what kind of request this is
+        return self.backend.generate(
+            prompt, images[:1] or None, prefix_key="router", max_tokens=config.ROUTER_MAX_TOKENS
         )
-        logger.info(f"Formatted prompt for RouterAgent: {formatted_prompt}")
-        return generate(self.model, self.processor, formatted_prompt, image)
-    
-    
+
+    def warmup(self):
+        self.backend.generate(
+            build_router_prompt(WARMUP_NOTE), prefix_key="router", max_tokens=config.WARMUP_MAX_TOKENS
+        )
+
+    def decide(self, state: State):
+        """
+        Route without the model: an explicit task set by the caller, then the local
+        rule-based classifier. Returns (tier, task), with task None when neither applies.
+        """
+        if state.type in TASKS:
+            return "explicit", state.type
+        decision = classify_route(state.payload.note, bool(state.payload.images))
+        logger.info("RouterAgent features: %s", decision.features)
+        return decision.tier, decision.task
+
     def run(self, state: State) -> State:
         """
-        Run the agent with the provided image.
+        Route the request, trying the cheapest tier first: an explicit task set by the
+        caller, then the local rule-based classifier, and only then the LLM router.
         """
-        logger.info(f"Running {self.name} with state: {state}")
-        
-        response = self.respond(state).text.lower().strip()
-        logger.info("RouterAgent response: %s", response)
+        logger.debug("Running %s: %s", self.name, StateSummary(state))
 
-        if response == "icd10":
-            state.payload["clinical_note"] = state.payload.get("note", "")
-            state.type = "icd10"
-        elif response == "soap":
-            state.payload["transcript"] = state.payload.get("note", "")
-            state.type = "soap"
-        elif response == "image_analysis":
-            state.type = "image_analysis"
-            state.payload["image"] = state.payload.get("image", None)
-            state.payload["clinical_note"] = state.payload.get("note", "")
-        else:
+        with stage("routing"):
+            tier, response = self.decide(state)
+            if response is None:
+                tier = "llm"
+                response = self.respond(state).text.lower().strip()
+        return self.apply_route(state, tier, response)
+
+    def apply_route(self, state: State, tier: str, response: str) -> State:
+        """Record the decision and swap the request payload for the one the chosen agent reads."""
+        routing_stats.record(tier)
+        state.routing_tier = tier
+        logger.info("RouterAgent decision by %s tier: %s", tier, response)
+
+        payload = task_payload(response, state.payload)
+        if payload is None:
             logger.error(f"Unknown response from RouterAgent: {response}")
             state.error = f"Unknown response from RouterAgent: {response}"
             return state
-        return State(
-            type=state.type,
-            payload=state.payload,  # preserve existing payload
-            result=response,            # add this line (or appropriate value)
-            error=None              # no error
-        )
-
-    
-
+        # The state is updated in place: the note is referenced, not copied, and inputs
+        # the task does not read (e.g. images for a text task) are dropped with the request
+        # payload. The caller may still hold that payload, so its images are let go explicitly.
+        state.payload.images = None
+        state.type = response
+        state.payload = payload
+        state.result = response
+        state.error = None
+        return state
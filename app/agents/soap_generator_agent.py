@@ -1,56 +1,121 @@
-from app.agents.base_agent import BaseAgent
-from app.utils.model_loader import load_medgemma_model
+import json
+from app.agents.base_agent import WARMUP_NOTE, BaseAgent
+from app.backends import get_backend
+from app.backends.base import PromptSession
+from app.api.schemas import SOAPNote
+from app.config.config import config
+from app.utils.json_constraint import OutputSchema
+from app.utils.chunking import combine_outputs, merge_soap_sections
 from app.utils.prompt_builder import build_soap_generator_prompt
 from app.graph.types import State
-from PIL import Image
 from typing import Optional
+from app.utils.live_sessions import LiveSession
+from app.utils.helper import StateSummary
 from app.utils.logger import get_logger
-from app.utils.helper import clean_json_response
-import json
-from langsmith.run_helpers import traceable
-from mlx_vlm.prompt_utils import apply_chat_template
-from mlx_vlm import generate
-import numpy as np
+from app.utils.timing import stage
+from app.utils.tracing import traced
 
 logger = get_logger(__name__)
 
+# Stands in for the transcript when the SOAP prompt is split around it for live sessions
+TRANSCRIPT_MARKER = "<<TRANSCRIPT>>"
+
 class SoapGeneratorAgent(BaseAgent):
+    output_schema = OutputSchema.from_model(SOAPNote)
+
     def __init__(self):
         super().__init__(name="SoapGeneratorAgent")
-        self.model, self.processor, self.config = load_medgemma_model()
+        self.backend = get_backend()
+        self.backend.warm_prefix("soap")
+
+    def build_prompt(self, state: State) -> str:
+        transcript = state.payload.transcript
+        logger.debug("Generating SOAP note for a transcript of %d chars", len(transcript or ""))
+        return self.prompt_for(transcript)
+
+    def prompt_for(self, transcript: str) -> str:
+        with stage("prompt_build"):
+            return build_soap_generator_prompt(transcript)
 
     def respond(self, state: dict) -> str:
-        logger.info(f"Called respond with state: {state}")
-        print(f"State payload: {state.payload}")
-        print(f"Transcript: {state.payload.get('transcript', 'No transcript found')}")
-        transcript = state.payload["transcript"] if "transcript" in state.payload else ""
-        image = [state.payload["image"] if "image" in state.payload else  Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8))] 
-        logger.info(f"Generating SOAP note for transcript: {transcript}")
-        prompt = build_soap_generator_prompt(transcript, image)
-        formatted_prompt = apply_chat_template(
-            self.processor, self.config, prompt, num_images=1
+        logger.debug("Called respond: %s", StateSummary(state))
+        chunks = self.split_input(state.payload.transcript or "", "transcript")
+        if len(chunks) == 1:
+            # Transcripts are text-only: no image tokens, no vision tower
+            return self.generate(self.build_prompt(state))
+
+        # Long encounters: summarize runs of speaker turns together as one batch, then merge the sections
+        outputs = self.backend.generate_batch(
+            [self.prompt_for(chunk) for chunk in chunks], prefix_key="soap", max_tokens=config.SOAP_MAX_TOKENS,
+            schema=self.generation_schema(),
+        )
+        merged = merge_soap_sections([self.try_parse(output.text) for output in outputs], list(SOAPNote.model_fields))
+        return combine_outputs(outputs, json.dumps(merged))
+
+    def generate(self, prompt: str):
+        return self.backend.generate(
+            prompt, prefix_key="soap", max_tokens=config.SOAP_MAX_TOKENS, schema=self.generation_schema()
+        )
+
+    def warmup(self):
+        self.backend.generate(
+            self.prompt_for(WARMUP_NOTE), prefix_key="soap", max_tokens=config.WARMUP_MAX_TOKENS,
+            schema=self.generation_schema(),
+        )
+
+    def stream(self, state: State):
+        """Yield the generated text incrementally."""
+        if len(self.split_input(state.payload.transcript or "", "transcript")) > 1:
+            # Chunked runs are merged before anything can be shown
+            yield self.respond(state).text
+            return
+        yield from self.backend.stream(
+            self.build_prompt(state), prefix_key="soap", max_tokens=config.SOAP_MAX_TOKENS,
+            schema=self.generation_schema(),
         )
-        return generate(self.model, self.processor, formatted_prompt, image)
 
-    @traceable
+    def open_session(self) -> PromptSession:
+        """An appendable SOAP prompt, holding everything before the transcript."""
+        head, _ = build_soap_generator_prompt(TRANSCRIPT_MARKER).split(TRANSCRIPT_MARKER)
+        return self.backend.open_session(head, prefix_key="soap")
+
+    def append_transcript(self, session: LiveSession, text: str):
+        """Add a transcript segment to a live session, prefilling only the new text."""
+        with session.lock:
+            session.prompt.append(text if session.segments == 0 else "\n" + text)
+            session.segments += 1
+            session.transcript_chars += len(text)
+            session.dirty = True
+
+    def refresh(self, session: LiveSession) -> dict:
+        """
+        The session's SOAP note for the transcript so far. It is only regenerated
+        when transcript arrived since the last refresh, and then only the end of
+        the prompt is prefilled on top of the session's cache.
+        """
+        with session.lock:
+            if session.result is not None and not session.dirty:
+                return session.result
+            _, tail = build_soap_generator_prompt(TRANSCRIPT_MARKER).split(TRANSCRIPT_MARKER)
+            output = session.prompt.generate(tail, max_tokens=config.SOAP_MAX_TOKENS, schema=self.generation_schema())
+            session.result = self.parse_result(output.text)
+            session.dirty = False
+            session.refreshes += 1
+            return session.result
+
+    @traced
     def run(self, state: State) -> State:
         """
         Run the agent with the provided clinical note.
         """
-        logger.info(f"Running {self.name} with state: {state}")
+        logger.debug("Running %s: %s", self.name, StateSummary(state))
         raw_result = self.respond(state).text
 
-        logger.info("soap_generated agent response: %s", raw_result)
-        parsed_result = clean_json_response(raw_result)
-        cleaned_result = json.loads(parsed_result)
-            
-        logger.info("Cleaned result: %s", cleaned_result)
-        return State(
-            type="soap",
-            payload=state.payload,  # preserve existing payload
-            result=cleaned_result,   # add new result
-            error=None               # no error
-        )
+        logger.debug("soap_generated agent response: %s", raw_result)
+        state.result = self.parse_result(raw_result)
+
+        logger.debug("Cleaned result: %s", state.result)
+        return state
     
 # if __name__ == "__main__":
 #     agent = SoapGeneratorAgent()
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, UploadFile, File, Form
-from fastapi.responses import JSONResponse
-from PIL import Image
-import io
+from fastapi.responses import JSONResponse, StreamingResponse
+import asyncio
+import json
+import threading
+from typing import Callable, List, Optional
 
-from app.graph.graph_builder import build_graph
-from app.graph.types import State
-from app.utils.helper import convert_uploadfile_to_image  # helper function to handle image
+from app.graph.types import RequestPayload, State
+from app.utils.helper import StateSummary, compute_input_fingerprint
+from app.utils.image_ingest import ImageRejectedError, check_upload_size, ingest_images, select_study_images
 from app.api.schemas import (
     ICD10Response, 
     SOAPResponse, 
@@ -14,78 +16,445 @@ from app.api.schemas import (
     ICD10Code, 
     AnalyzeResponse, 
     SOAPNote,
-    RadiologyReport
+    RadiologyReport,
+    StudySummary
 )
-from app.utils.logger import get_logger
+from app.utils.logger import get_logger, logging_stats
+from app.utils.inference_executor import InferenceExecutor, QueueFullError, DeadlineExceededError
+from app.config.config import config
+from app.utils.route_classifier import TASKS, routing_stats
+from app.backends import loaded_backend
+from app.utils.stream_parser import IncrementalJSONParser
+from app.utils.result_cache import ResultCache, settings_version
+from app.utils.prompt_builder import PROMPT_VERSION
+from app.utils.single_flight import SingleFlight
+from app.utils.icd10_index import get_icd10_index
+from app.utils.icd10_retrieval import get_icd10_retriever
+from app.utils.live_sessions import LiveSessionStore, SessionLimitError
+from app.utils.metrics import registry
+from app.utils.tracing import tracing_stats
+from app.utils.lifecycle import NotReadyError, model_lifecycle
+from app.utils.timing import stage, tag
 
 logger = get_logger(__name__)
 
 router = APIRouter()
-graph = build_graph()
+# Agents and graph are built by model_lifecycle in the background; requests get them via require()
+inference_executor = InferenceExecutor(
+    workers=config.INFERENCE_WORKERS,
+    queue_depth=config.INFERENCE_QUEUE_DEPTH,
+    timeout_s=config.INFERENCE_TIMEOUT_S,
+)
+# Settings that change what the agents produce for the same input; with the prompt
+# version, the model and the ICD-10 data files they make up the result cache namespace
+RESULT_SETTINGS = (
+    "CONSTRAINED_DECODING", "CONSTRAINED_TOP_K", "ICD10_MAX_TOKENS", "SOAP_MAX_TOKENS", "IMAGE_ANALYSIS_MAX_TOKENS",
+    "ICD10_COMPACT_OUTPUT", "ICD10_RETRIEVAL_ENABLED", "ICD10_RETRIEVAL_TOP_K", "CHUNKING_ENABLED",
+    "CHUNK_MAX_TOKENS", "CHUNK_OVERLAP_TOKENS", "FUSED_ROUTING", "STUDY_MAX_IMAGES", "STUDY_DEDUP_THRESHOLD",
+)
 
-@router.post("/analyze")
-async def analyze(note: str = Form(None), image: UploadFile = File(None)):
-    if not note and not image:
+
+def result_cache_namespace() -> str:
+    version = settings_version({name: getattr(config, name) for name in RESULT_SETTINGS},
+                               (config.ICD10_INDEX_PATH, config.ICD10_RETRIEVAL_INDEX_PATH))
+    return f"{config.INFERENCE_BACKEND}:{config.MODEL_ID}:{PROMPT_VERSION}:{version}"
+
+
+result_cache = ResultCache(
+    namespace=result_cache_namespace(),
+    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+    ttl_s=config.RESULT_CACHE_TTL_S,
+    sqlite_path=config.RESULT_CACHE_DB,
+) if config.RESULT_CACHE_ENABLED else None
+single_flight = SingleFlight()
+live_sessions = LiveSessionStore(
+    max_sessions=config.LIVE_SESSION_MAX,
+    max_kv_bytes=int(config.LIVE_SESSION_MAX_KV_MB * (1 << 20)),
+    ttl_s=config.LIVE_SESSION_TTL_S,
+)
+registry.gauge("medgemma_inference_queued", "Requests admitted and waiting for an inference worker.",
+               lambda: inference_executor.stats()["queued"])
+registry.gauge("medgemma_inference_running", "Requests executing on an inference worker.",
+               lambda: inference_executor.stats()["running"])
+registry.gauge("medgemma_inference_rejected", "Requests rejected because the inference queue was full.",
+               lambda: inference_executor.rejected)
+registry.gauge("medgemma_live_sessions", "Open live SOAP sessions.", lambda: live_sessions.stats()["open"])
+
+def not_ready(e: NotReadyError):
+    return JSONResponse(status_code=503, content={"error": str(e)}, headers={"Retry-After": "10"})
+
+
+def collect_uploads(image: Optional[UploadFile], images: Optional[List[UploadFile]]) -> List[UploadFile]:
+    """The single `image` field and the `images` series, as one list in upload order."""
+    return [f for f in [image, *(images or [])] if f is not None and f.filename]
+
+
+async def build_initial_state(note: str, uploads: List[UploadFile], task: str) -> State:
+    logger.info("Received inputs - note: %d chars, images: %d", len(note or ""), len(uploads))
+    # An explicit task skips routing entirely
+    state = State(type=task or None, payload=RequestPayload(note=note or None))
+
+    if uploads:
+        # Reject oversized uploads from the declared size before reading them
+        for upload in uploads:
+            check_upload_size(getattr(upload, "size", None))
+        with stage("upload_read"):
+            contents = [await upload.read() for upload in uploads]
+        # Decoded in parallel off the event loop, straight to the encoder's input size; only the arrays are kept
+        images = await ingest_images(contents)
+        if len(images) > 1:
+            kept = select_study_images(images, config.STUDY_DEDUP_THRESHOLD, config.STUDY_MAX_IMAGES)
+            images = [images[i] for i in kept]
+            state.payload.study = {
+                "images_received": len(contents),
+                "images_analyzed": len(kept),
+                "analyzed_indices": kept,
+            }
+            logger.info(f"Study of {len(contents)} images, analyzing {len(kept)}: {kept}")
+        state.payload.images = images
+
+    logger.debug("Initial state: %s", StateSummary(state))
+    return state
+
+
+def build_response(raw_output):
+    with stage("response_build"):
+        response = _build_response(raw_output)
+    if isinstance(response, ErrorResponse):
+        tag("outcome", "error")
+    else:
+        tag("agent", response.agent)
+    return response
+
+
+def _build_response(raw_output):
+    # Ensure output is always a State
+    if isinstance(raw_output, dict):
+        output = State(**raw_output)
+    elif isinstance(raw_output, State):
+        output = raw_output
+    else:
+        return ErrorResponse(error="Unexpected output type from graph.")
+    
+    # Pick the correct model based on type
+    if output.error:
+        if output.type:
+            tag("agent", output.type)
+        return ErrorResponse(error=output.error)
+
+    if output.type == "icd10":
+        # Example output.result expected: [{"code": "...", "description": "..."}]
+        # codes = [ICD10Code(**c) for c in output.result]
+        codes = [ICD10Code(code=c["code"], description=c["description"], flag=c.get("flag")) for c in output.result]
+        return ICD10Response(agent="icd10", result=codes)
+
+    elif output.type == "soap":
+        # Example output.result expected: {"Subjective": "...", "Objective": "...", "Assessment": "...", "Plan": "..."}
+        soap_note = SOAPNote(
+            Subjective=output.result.get("Subjective", ""),
+            Objective=output.result.get("Objective", ""),
+            Assessment=output.result.get("Assessment", ""),
+            Plan=output.result.get("Plan", "")
+        )
+        return SOAPResponse(agent="soap", result=soap_note)
+
+    elif output.type == "image_analysis":
+        # Example output.result expected: {"technique": "...", "findings": "...", "impression": "...", "recommendations": "..."}
+        radiology_report = RadiologyReport(
+            technique=output.result.get("technique", ""),
+            findings=output.result.get("findings", ""),
+            impression=output.result.get("impression", ""),
+            recommendations=output.result.get("recommendations", ""),
+            answer_to_user_question=output.result.get("answer_to_user_question", None)
+        )
+        study = getattr(output.payload, "study", None)
+        return ImageAnalysisResponse(
+            agent="image_analysis",
+            result=output.result,
+            study=StudySummary(**study) if study else None,
+        )
+
+    else:
+        return ErrorResponse(error="Unknown analysis type.")
+
+
+def validate_inputs(note: str, uploads: List[UploadFile], task: str):
+    if not note and not uploads:
         return JSONResponse(status_code=400, content={"error": "No input provided."})
+    if task and task not in TASKS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown task '{task}'. Expected one of: {', '.join(TASKS)}."})
+    # An explicit task skips routing, so it must have the input it runs on
+    if task == "image_analysis" and not uploads:
+        return JSONResponse(status_code=400, content={"error": "Task 'image_analysis' needs at least one image."})
+    if task in ("icd10", "soap") and not note:
+        return JSONResponse(status_code=400, content={"error": f"Task '{task}' needs a note."})
+    return None
+
+
+async def run_graph(state: State, timeout_s: float = None):
+    graph = model_lifecycle.require().graph
+    # graph.invoke blocks for the whole generation, so it runs on the inference pool
+    raw_output = await inference_executor.run(graph.invoke, state, timeout_s=timeout_s)
+    return build_response(raw_output)
+
+
+@router.post("/analyze")
+async def analyze(note: str = Form(None), image: UploadFile = File(None), images: List[UploadFile] = File(None),
+                  task: str = Form(None)):
+    uploads = collect_uploads(image, images)
+    invalid = validate_inputs(note, uploads, task)
+    if invalid:
+        return invalid
 
     try:
-        logger.info(f"Recieved inputs - Note: {note}, Image: {image.filename if image else 'None'}")
-        state = State(type=None, payload={}, result=None, error=None)
-        logger.info(f"Initial state: {state}")
-
-        if note:
-            state.payload["note"] = note
-
-        if image and image.filename:
-            contents = await image.read()
-            pil_image = convert_uploadfile_to_image(contents)
-            state.payload["image"] = pil_image
-
-        logger.info(f"Initial state: {state}")
-
-        raw_output = graph.invoke(state)
-
-        # Ensure output is always a State
-        if isinstance(raw_output, dict):
-            output = State(**raw_output)
-        elif isinstance(raw_output, State):
-            output = raw_output
-        else:
-            return ErrorResponse(error="Unexpected output type from graph.")
-        
-        # Pick the correct model based on type
-        if output.error:
-            return ErrorResponse(error=output.error)
-
-        if output.type == "icd10":
-            # Example output.result expected: [{"code": "...", "description": "..."}]
-            # codes = [ICD10Code(**c) for c in output.result]
-            codes = [ICD10Code(code=c.code, description=c.description) for c in output.result]
-            return ICD10Response(agent="icd10", result=codes)
-
-        elif output.type == "soap":
-            # Example output.result expected: {"Subjective": "...", "Objective": "...", "Assessment": "...", "Plan": "..."}
-            soap_note = SOAPNote(
-                Subjective=output.result.get("Subjective", ""),
-                Objective=output.result.get("Objective", ""),
-                Assessment=output.result.get("Assessment", ""),
-                Plan=output.result.get("Plan", "")
-            )
-            return SOAPResponse(agent="soap", result=soap_note)
-
-        elif output.type == "image_analysis":
-            # Example output.result expected: {"technique": "...", "findings": "...", "impression": "...", "recommendations": "..."}
-            radiology_report = RadiologyReport(
-                technique=output.result.get("technique", ""),
-                findings=output.result.get("findings", ""),
-                impression=output.result.get("impression", ""),
-                recommendations=output.result.get("recommendations", ""),
-                answer_to_user_question=output.result.get("answer_to_user_question", None)
-            )
-            return ImageAnalysisResponse(agent="image_analysis", result=output.result)
-
-        else:
-            return ErrorResponse(error="Unknown analysis type.")
+        state = await build_initial_state(note, uploads, task)
 
+        fingerprint = compute_input_fingerprint(state.payload.note, state.payload.images, task)
+        cache_key = None
+        if result_cache is not None:
+            cache_key = result_cache.key(fingerprint)
+            # SQLite lookups stay off the event loop
+            cached = await asyncio.to_thread(result_cache.get, cache_key)
+            if cached is not None:
+                logger.info("Serving cached result")
+                return cached
+
+        # Identical requests already running share that run instead of starting another
+        try:
+            response = await single_flight.do(fingerprint, lambda: run_graph(state))
+        except NotReadyError as e:
+            return not_ready(e)
+        except QueueFullError as e:
+            logger.warning(f"Rejecting request: {e}")
+            return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "5"})
+        except DeadlineExceededError as e:
+            return JSONResponse(status_code=503, content={"error": str(e)})
+
+        if cache_key is not None and not isinstance(response, ErrorResponse):
+            await asyncio.to_thread(result_cache.put, cache_key, response.model_dump())
+        return response
+
+    except ImageRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
     except Exception as e:
+        tag("outcome", "error")
         return ErrorResponse(error=str(e))
+
+
+class StreamCancelled(Exception):
+    """Raised inside the worker when the client has gone away."""
+
+
+def run_streaming_pipeline(agents: dict, state: State, emit: Callable[[str, dict], None]):
+    """
+    Route the request, then stream the task agent's output, emitting events as soon
+    as each piece is known: the routing decision, raw tokens, each ICD-10 code or
+    report section once it closes, and finally the parsed response.
+    """
+    routed = agents["router"].run(state)
+    if routed.error:
+        tag("outcome", "error")
+        emit("error", {"error": routed.error})
+        return
+    emit("route", {"agent": routed.type, "tier": routed.routing_tier})
+
+    agent = agents[routed.type]
+    parser = IncrementalJSONParser()
+    chunks, items, emitted = [], [], 0
+    for chunk in agent.stream(routed):
+        chunks.append(chunk)
+        emit("token", {"text": chunk})
+        for kind, value in parser.feed(chunk):
+            if kind == "item":
+                if isinstance(value, dict) and not value.get("description"):
+                    continue  # dropped by parse_result as well
+                # Resolved like the final result (canonical code and description, flag, no duplicates)
+                items.append(value)
+                resolved = agent.resolve_codes(items)
+                for code in resolved[emitted:]:
+                    emit("code", code)
+                emitted = len(resolved)
+            else:
+                emit("section", {"name": value[0], "text": value[1]})
+
+    result = agent.parse_result("".join(chunks))
+    routed.result = result
+    response = build_response(routed)
+    emit("result", response.model_dump())
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/analyze/stream")
+async def analyze_stream(note: str = Form(None), image: UploadFile = File(None),
+                         images: List[UploadFile] = File(None), task: str = Form(None)):
+    """
+    Server-sent events version of /analyze. Events: `route`, `token`, `code`
+    (ICD-10) or `section` (SOAP / radiology fields), `result`, `error`, `done`.
+    """
+    uploads = collect_uploads(image, images)
+    invalid = validate_inputs(note, uploads, task)
+    if invalid:
+        return invalid
+    try:
+        agents = model_lifecycle.require().agents
+    except NotReadyError as e:
+        return not_ready(e)
+    try:
+        state = await build_initial_state(note, uploads, task)
+    except ImageRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def emit(event: str, data: dict):
+        if cancelled.is_set():
+            raise StreamCancelled()
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    try:
+        pending = asyncio.ensure_future(inference_executor.submit(run_streaming_pipeline, agents, state, emit))
+    except QueueFullError as e:
+        logger.warning(f"Rejecting stream request: {e}")
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "5"})
+    # Results reach the loop in order, so this sentinel lands after every emitted event
+    pending.add_done_callback(lambda _: events.put_nowait((None, None)))
+
+    async def event_source():
+        try:
+            while True:
+                event, data = await events.get()
+                if event is None:
+                    break
+                yield format_sse(event, data)
+            try:
+                await pending
+            except Exception as e:
+                tag("outcome", "error")
+                yield format_sse("error", {"error": str(e)})
+            yield format_sse("done", {})
+        finally:
+            # Stops the worker at its next emit if the client disconnected mid-stream
+            cancelled.set()
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def session_not_found(session_id: str):
+    return JSONResponse(status_code=404, content={"error": f"No live session '{session_id}'."})
+
+
+async def run_session_work(method: str, *args):
+    # Prefill and generation block, so they run on the inference pool like /analyze
+    try:
+        soap = model_lifecycle.require().agents["soap"]
+        return await inference_executor.run(getattr(soap, method), *args)
+    except NotReadyError as e:
+        return not_ready(e)
+    except QueueFullError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "5"})
+    except DeadlineExceededError as e:
+        return JSONResponse(status_code=503, content={"error": str(e)})
+    except Exception as e:
+        tag("outcome", "error")
+        logger.error(f"Live session work failed: {e}")
+        return ErrorResponse(error=str(e))
+    finally:
+        live_sessions.enforce_memory()
+
+
+@router.post("/sessions")
+async def create_session():
+    """Open a live encounter whose SOAP note is kept up to date as transcript is appended."""
+    try:
+        session = live_sessions.create(model_lifecycle.require().agents["soap"].open_session())
+    except NotReadyError as e:
+        return not_ready(e)
+    except SessionLimitError as e:
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "30"})
+    return session.info()
+
+
+@router.post("/sessions/{session_id}/transcript")
+async def append_transcript(session_id: str, text: str = Form(...)):
+    """Append a transcript segment; only the new text is prefilled."""
+    session = live_sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+    failed = await run_session_work("append_transcript", session, text)
+    return failed or session.info()
+
+
+@router.get("/sessions/{session_id}/soap")
+async def get_session_soap(session_id: str):
+    """The SOAP note for the transcript so far, regenerated only if transcript arrived since the last call."""
+    session = live_sessions.get(session_id)
+    if session is None:
+        return session_not_found(session_id)
+    if session.segments == 0:
+        return JSONResponse(status_code=409, content={"error": "The session has no transcript yet."})
+    result = await run_session_work("refresh", session)
+    if isinstance(result, (JSONResponse, ErrorResponse)):
+        return result
+    return build_response(State(type="soap", result=result))
+
+
+@router.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    session = live_sessions.get(session_id)
+    return session.info() if session is not None else session_not_found(session_id)
+
+
+@router.delete("/sessions/{session_id}")
+def close_session(session_id: str):
+    if not live_sessions.close(session_id):
+        return session_not_found(session_id)
+    return {"closed": session_id}
+
+
+@router.get("/stats")
+def stats():
+    # Imported here: app.api.jobs builds on this module
+    from app.api.jobs import jobs_stats
+
+    return {
+        "inference": inference_executor.stats(),
+        "routing": routing_stats.stats(),
+        "backend": {"name": loaded_backend().name, **loaded_backend().stats()} if loaded_backend() else {},
+        "lifecycle": model_lifecycle.status(),
+        "result_cache": result_cache.stats() if result_cache is not None else {},
+        "single_flight": single_flight.stats(),
+        "icd10_index": get_icd10_index().stats() if get_icd10_index() is not None else {},
+        "icd10_retrieval": get_icd10_retriever().stats() if get_icd10_retriever() is not None else {},
+        "live_sessions": live_sessions.stats(),
+        "jobs": jobs_stats(),
+        "tracing": tracing_stats(),
+        "logging": logging_stats(),
+    }
+
+
+@router.get("/icd10/search")
+def search_icd10(prefix: str, limit: int = 20):
+    """Look up ICD-10-CM codes by prefix (dotted or not) in the local code table."""
+    index = get_icd10_index()
+    if index is None:
+        return JSONResponse(status_code=404, content={"error": "No ICD-10 code table is loaded."})
+    matches = index.search_prefix(prefix, limit=min(max(limit, 1), 200))
+    return {"results": [{"code": code, "description": description} for code, description in matches]}
+
+
+@router.delete("/cache")
+def invalidate_cache():
+    """Drop all cached analysis results, e.g. after a coding guideline change."""
+    dropped = result_cache.invalidate() if result_cache is not None else 0
+    return {"invalidated": dropped}
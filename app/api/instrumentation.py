@@ -0,0 +1,50 @@
+import time
+
+from app.utils.metrics import observe_request, server_timing_header
+from app.utils.timing import collect_timings
+from app.utils.tracing import trace_span
+
+
+class InstrumentationMiddleware:
+    """
+    Pure ASGI middleware that collects the stage timings of every request, reports
+    them in a `Server-Timing` header and folds them into the Prometheus registry
+    once the response is complete. Each request is also the root span of its trace,
+    where the sampling decision is made.
+
+    The header goes out with the response start, so for streamed responses it only
+    covers what ran before the first byte (upload read, image decode); the metrics
+    are recorded after the body, and include the generation.
+    """
+
+    def __init__(self, app, exclude=("/metrics",)):
+        self.app = app
+        self.exclude = set(exclude)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                header = server_timing_header(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        with collect_timings() as timings, trace_span(f"{scope['method']} {scope['path']}") as span:
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                # The router records the matched route in the scope; templated paths keep label cardinality bounded
+                route = getattr(scope.get("route"), "path", "unmatched")
+                elapsed_s = time.perf_counter() - start
+                observe_request(route, scope["method"], status, elapsed_s, timings)
+                if span is not None:
+                    span.attributes.update(route=route, status=status, **timings.tags)
+                    span.outputs = {"stages_ms": {name: 1000 * sum(s) for name, s in timings.stages.items()}}
@@ -0,0 +1,260 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, File, Form, UploadFile
+from fastapi.responses import JSONResponse
+
+from app.api.analyze import build_initial_state, collect_uploads, result_cache, run_graph, validate_inputs
+from app.api.schemas import ErrorResponse
+from app.config.config import config
+from app.graph.types import RequestPayload, State
+from app.utils.helper import compute_input_fingerprint
+from app.utils.image_ingest import ImageRejectedError
+from app.utils.inference_executor import QueueFullError
+from app.utils.job_queue import FINISHED, PRIORITIES, Job, JobQueue, JobQueueFullError
+from app.utils.lifecycle import NotReadyError, model_lifecycle
+from app.utils.logger import get_logger
+from app.utils.metrics import observe_job, registry
+from app.utils.timing import collect_timings
+from app.utils.tracing import trace_span
+
+logger = get_logger(__name__)
+
+router = APIRouter()
+
+# How often idle workers look for runnable jobs (retries coming out of backoff, jobs
+# submitted by another process); jobs submitted here wake them immediately
+POLL_INTERVAL_S = 1.0
+PURGE_INTERVAL_S = 60.0
+
+
+class JobWorkers:
+    """
+    Workers consuming the job queue on the event loop.
+
+    Each worker claims a job, rebuilds the request state from its stored inputs and
+    runs it through the same path as /analyze (result cache, then the graph on the
+    inference pool), so jobs and interactive requests share the model's capacity.
+    When the inference queue is full the job goes back without counting an attempt.
+    Exceptions and deadline expiry are retried; an error reported by the pipeline
+    itself (e.g. output that could not be parsed) fails the job. Workers only claim
+    jobs once the model is ready, so jobs can be submitted during startup.
+    """
+
+    def __init__(self, queue: JobQueue, workers: int = 1):
+        self.queue = queue
+        self.workers = max(1, workers)
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        # Replaced every time a job finishes, so long-polls can wait for the next one
+        self._finished = asyncio.Event()
+        self._last_purge = 0.0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._loop(), name=f"job-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers, e.g. after a submission."""
+        self._wake.set()
+
+    async def wait_finished(self, timeout_s: float):
+        """Return when any job finishes on this process, or after `timeout_s`."""
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout_s)
+        except asyncio.TimeoutError:
+            pass
+
+    def _signal_finished(self):
+        self._finished.set()
+        self._finished = asyncio.Event()
+
+    async def _loop(self):
+        while True:
+            if time.monotonic() - self._last_purge > PURGE_INTERVAL_S:
+                self._last_purge = time.monotonic()
+                purged = await asyncio.to_thread(self.queue.purge)
+                if purged:
+                    logger.info(f"Deleted {purged} expired jobs")
+            # SQLite I/O (and decoding stored images) stays off the event loop
+            job = await asyncio.to_thread(self.queue.claim) if model_lifecycle.ready else None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL_S)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _execute(self, job: Job):
+        """The job's response as a dict, or the ErrorResponse the pipeline produced."""
+        fingerprint = compute_input_fingerprint(job.note, job.images, job.task)
+        cache_key = result_cache.key(fingerprint) if result_cache is not None else None
+        if cache_key is not None:
+            cached = await asyncio.to_thread(result_cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        state = State(type=job.task, payload=RequestPayload(note=job.note, images=job.images, study=job.study))
+        job.images = None
+        response = await run_graph(state, timeout_s=config.JOB_TIMEOUT_S)
+        if isinstance(response, ErrorResponse):
+            return response
+        result = response.model_dump()
+        if cache_key is not None:
+            await asyncio.to_thread(result_cache.put, cache_key, result)
+        return result
+
+    async def _process(self, job: Job):
+        start = time.monotonic()
+        queue_wait_s = time.time() - job.created_at
+        outcome = None
+        with collect_timings() as timings, \
+                trace_span("job", {"job_id": job.id}, priority=job.priority, attempt=job.attempts) as span:
+            try:
+                result = await self._execute(job)
+            except (QueueFullError, NotReadyError) as e:
+                # Saturated by interactive traffic (or reloading): not the job's fault
+                logger.info(f"Requeueing job {job.id}: {e}")
+                await asyncio.to_thread(self.queue.release, job.id, POLL_INTERVAL_S)
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.queue.release, job.id)
+                raise
+            except Exception as e:
+                status = await asyncio.to_thread(self.queue.fail, job.id, f"{type(e).__name__}: {e}", True)
+                outcome = "retried" if status == "queued" else "failed"
+                logger.warning(f"Job {job.id} attempt {job.attempts} failed ({outcome}): {e}")
+            else:
+                if isinstance(result, ErrorResponse):
+                    await asyncio.to_thread(self.queue.fail, job.id, result.error, False)
+                    outcome = "failed"
+                else:
+                    await asyncio.to_thread(self.queue.complete, job.id, result)
+                    outcome = "succeeded"
+            if span is not None:
+                span.outputs = {"outcome": outcome or "requeued"}
+        if outcome is None:
+            return
+        observe_job(job.priority, outcome, job.attempts, queue_wait_s, time.monotonic() - start, timings)
+        if outcome != "retried":
+            self._signal_finished()
+
+
+# Opened by start_jobs() from the app lifespan, so importing this module creates no database file
+job_queue: Optional[JobQueue] = None
+job_workers: Optional[JobWorkers] = None
+
+
+def start_jobs():
+    """Open the job queue and start its workers (JOBS_ENABLED). Calling it again does nothing."""
+    global job_queue, job_workers
+    if not config.JOBS_ENABLED or job_queue is not None:
+        return
+    job_queue = JobQueue(
+        config.JOB_DB,
+        max_queued=config.JOB_MAX_QUEUED,
+        max_attempts=config.JOB_MAX_ATTEMPTS,
+        retry_backoff_s=config.JOB_RETRY_BACKOFF_S,
+        # A worker that has not finished well after its deadline is presumed gone
+        lease_s=config.JOB_TIMEOUT_S + 60,
+        result_ttl_s=config.JOB_RESULT_TTL_S,
+    )
+    registry.gauge("medgemma_jobs_queued", "Jobs waiting for a worker, including retries in backoff.",
+                   lambda: {(p,): d["queued"] for p, d in job_queue.depth().items()}, ("priority",))
+    registry.gauge("medgemma_jobs_running", "Jobs claimed by a worker.",
+                   lambda: {(p,): d["running"] for p, d in job_queue.depth().items()}, ("priority",))
+    registry.gauge("medgemma_jobs_oldest_queued_age_seconds", "Age of the oldest waiting job (0 when none).",
+                   lambda: {(p,): d["oldest_queued_age_s"] for p, d in job_queue.depth().items()}, ("priority",))
+    job_workers = JobWorkers(job_queue, config.JOB_WORKERS)
+    job_workers.start()
+
+
+async def stop_jobs():
+    """Stop the workers; jobs still running go back to the queue and are picked up after restart."""
+    if job_workers is not None:
+        await job_workers.stop()
+
+
+def jobs_stats() -> dict:
+    return job_queue.stats() if job_queue is not None else {}
+
+
+def jobs_disabled():
+    return JSONResponse(status_code=404, content={"error": "Jobs are disabled (JOBS_ENABLED=false)."})
+
+
+def job_not_found(job_id: str):
+    return JSONResponse(status_code=404, content={"error": f"No job '{job_id}' (unknown or expired)."})
+
+
+@router.post("/jobs")
+async def submit_job(note: str = Form(None), image: UploadFile = File(None), images: List[UploadFile] = File(None),
+                     task: str = Form(None), priority: str = Form("interactive")):
+    """
+    Queue an analysis with the same inputs as /analyze and return its job ID right
+    away. Poll GET /jobs/{id} (optionally with `wait`) for the result.
+    """
+    if job_queue is None:
+        return jobs_disabled()
+    uploads = collect_uploads(image, images)
+    invalid = validate_inputs(note, uploads, task)
+    if invalid:
+        return invalid
+    if priority not in PRIORITIES:
+        return JSONResponse(status_code=400, content={
+            "error": f"Unknown priority '{priority}'. Expected one of: {', '.join(PRIORITIES)}."})
+
+    try:
+        # Images are decoded and validated now, so a bad upload fails the submission, not the job
+        state = await build_initial_state(note, uploads, task)
+        job_id = await asyncio.to_thread(job_queue.submit, task or None, state.payload.note,
+                                         state.payload.images, state.payload.study, priority)
+    except ImageRejectedError as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+    except JobQueueFullError as e:
+        logger.warning(f"Rejecting job: {e}")
+        return JSONResponse(status_code=429, content={"error": str(e)}, headers={"Retry-After": "30"})
+    job_workers.notify()
+    return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "priority": priority},
+                        headers={"Location": f"/api/jobs/{job_id}"})
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Status of a job, with its result once it succeeded. With `wait` (seconds, capped
+    at JOB_MAX_WAIT_S), the call is held until the job finishes or the time is up.
+    """
+    if job_queue is None:
+        return jobs_disabled()
+    deadline = time.monotonic() + min(max(wait, 0), config.JOB_MAX_WAIT_S)
+    while True:
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job is None:
+            return job_not_found(job_id)
+        remaining = deadline - time.monotonic()
+        if job["status"] in FINISHED or remaining <= 0:
+            return job
+        # Re-read at least every poll interval: the job may run in another process
+        await job_workers.wait_finished(min(remaining, POLL_INTERVAL_S))
+
+
+@router.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """Cancel a job that has not started yet."""
+    if job_queue is None:
+        return jobs_disabled()
+    if job_queue.cancel(job_id):
+        return {"cancelled": job_id}
+    job = job_queue.get(job_id)
+    if job is None:
+        return job_not_found(job_id)
+    return JSONResponse(status_code=409, content={
+        "error": f"Job '{job_id}' is {job['status']}; only queued jobs can be cancelled."})
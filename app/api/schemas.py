@@ -4,6 +4,8 @@ from typing import List, Optional, Literal, Union, TypeAlias
 class ICD10Code(BaseModel):
     code: str
     description: str
+    # Set by the service, e.g. "not_in_code_table" for codes missing from the ICD-10-CM table
+    flag: Optional[str] = None
 
 class ICD10Response(BaseModel):
     agent: Literal["icd10"]
@@ -27,9 +29,16 @@ class RadiologyReport(BaseModel):
     recommendations: str
     answer_to_user_question: Optional[str] = None
 
+class StudySummary(BaseModel):
+    images_received: int
+    images_analyzed: int
+    # Positions, in upload order, of the images sent to the model
+    analyzed_indices: List[int]
+
 class ImageAnalysisResponse(BaseModel):
     agent: str = "image_analysis"
     result: "RadiologyReport"
+    study: Optional[StudySummary] = None
 
 class ErrorResponse(BaseModel):
     error: str
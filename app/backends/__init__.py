@@ -0,0 +1,42 @@
+import threading
+from typing import Optional
+
+from app.backends.base import InferenceBackend
+from app.config.config import config
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_backend = None
+_lock = threading.Lock()
+
+
+def create_backend(name: str) -> InferenceBackend:
+    # Imported lazily so only the selected runtime's dependencies need to be installed
+    if name == "mlx":
+        from app.backends.mlx_backend import MLXBackend
+        return MLXBackend()
+    if name == "llamacpp":
+        from app.backends.llamacpp_backend import LlamaCppBackend
+        return LlamaCppBackend()
+    if name == "stub":
+        from app.backends.stub_backend import StubBackend
+        return StubBackend()
+    raise ValueError(f"Unknown INFERENCE_BACKEND '{name}'. Expected one of: mlx, llamacpp, stub.")
+
+
+def get_backend() -> InferenceBackend:
+    """Return the process-wide inference backend selected by `config.INFERENCE_BACKEND`, loading it once."""
+    global _backend
+    with _lock:
+        if _backend is None:
+            backend = create_backend(config.INFERENCE_BACKEND)
+            logger.info(f"Loading '{backend.name}' inference backend")
+            backend.load()
+            _backend = backend
+    return _backend
+
+
+def loaded_backend() -> Optional[InferenceBackend]:
+    """The inference backend if it has been loaded already, without loading it (None otherwise)."""
+    return _backend
@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+from PIL import Image
+
+from app.utils.json_constraint import OutputSchema
+
+# Same default as mlx_vlm.generate
+DEFAULT_MAX_TOKENS = 256
+
+
+@dataclass
+class GenerationOutput:
+    text: str
+    prompt_tokens: int
+    generation_tokens: int
+    prompt_tps: float
+    generation_tps: float
+    # Prompt tokens served from a prefix cache instead of being prefilled
+    cached_tokens: int = 0
+
+
+class PromptSession:
+    """
+    A prompt that grows by appended text and is completed again and again, as in a
+    live encounter whose transcript arrives a few sentences at a time.
+
+    This base version only keeps the text and sends the whole prompt on every
+    `generate`; backends that can hold a KV cache per session override it so that
+    `append` prefills just the new text and `generate` only the suffix.
+    """
+
+    def __init__(self, backend: "InferenceBackend", prompt: str, prefix_key: Optional[str] = None):
+        self.backend = backend
+        self.prompt = prompt
+        self.prefix_key = prefix_key
+
+    def append(self, text: str):
+        self.prompt += text
+
+    def generate(self, suffix: str, max_tokens: int = DEFAULT_MAX_TOKENS,
+                 schema: Optional[OutputSchema] = None) -> GenerationOutput:
+        """Complete `prompt + suffix`; the suffix is not kept in the session."""
+        return self.backend.generate(self.prompt + suffix, prefix_key=self.prefix_key, max_tokens=max_tokens,
+                                     schema=schema)
+
+    @property
+    def kv_bytes(self) -> int:
+        """Bytes of KV cache held for this session."""
+        return 0
+
+    def release(self):
+        """Drop the session's KV cache; the next call rebuilds it from the text."""
+
+
+class InferenceBackend:
+    """
+    Everything the agents need from a model runtime.
+
+    Prompts are passed as plain text; each backend applies its own chat template.
+    `prefix_key` names the prompt's fixed instruction block (a key of
+    `prompt_builder.PROMPT_PREFIXES`) so backends that can reuse its KV cache do so.
+    `schema` asks for output constrained to that JSON shape, ending when the value closes.
+    """
+
+    name = "base"
+    supports_images = False
+
+    def load(self):
+        raise NotImplementedError("Must override load()")
+
+    def format_prompt(self, prompt: str, num_images: int = 0) -> str:
+        raise NotImplementedError("Must override format_prompt()")
+
+    def count_tokens(self, text: str) -> int:
+        raise NotImplementedError("Must override count_tokens()")
+
+    def generate(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> GenerationOutput:
+        raise NotImplementedError("Must override generate()")
+
+    def generate_batch(self, prompts: List[str], prefix_key: Optional[str] = None, max_tokens: int = DEFAULT_MAX_TOKENS,
+                       schema: Optional[OutputSchema] = None) -> List[GenerationOutput]:
+        """
+        Complete several related text-only prompts, results in order. This base
+        version runs them one after another; backends that can decode several
+        sequences at once override it.
+        """
+        return [self.generate(prompt, prefix_key=prefix_key, max_tokens=max_tokens, schema=schema)
+                for prompt in prompts]
+
+    def stream(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+               max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> Iterator[str]:
+        raise NotImplementedError("Must override stream()")
+
+    def open_session(self, prompt: str, prefix_key: Optional[str] = None) -> PromptSession:
+        """Start an appendable prompt session (see `PromptSession`)."""
+        return PromptSession(self, prompt, prefix_key)
+
+    def warm_prefix(self, name: str):
+        """Precompute whatever can be reused for prompt prefix `name`. Optional."""
+
+    def stats(self) -> dict:
+        return {}
+
+    def _check_images(self, images):
+        if images and not self.supports_images:
+            raise ValueError(f"The '{self.name}' inference backend does not support image inputs.")
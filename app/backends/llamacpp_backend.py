@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from PIL import Image
+
+from app.backends.base import DEFAULT_MAX_TOKENS, GenerationOutput, InferenceBackend
+from app.utils.json_constraint import OutputSchema
+from app.config.config import config
+from app.utils.logger import get_logger
+from app.utils.timing import record_count, record_stage, stage
+
+logger = get_logger(__name__)
+
+# Gemma 3 chat template, applied by hand so prompts match what the MLX path sends
+CHAT_TEMPLATE = "<start_of_turn>user\n{prompt}<end_of_turn>\n<start_of_turn>model\n"
+STOP_SEQUENCES = ["<end_of_turn>"]
+
+
+class LlamaCppBackend(InferenceBackend):
+    """
+    Text-only MedGemma from a quantized GGUF file through llama-cpp-python, for
+    CPU hosts without Apple silicon.
+
+    llama.cpp keeps the KV cache of the previous prompt and only evaluates the
+    part of a new prompt after the longest common prefix. A `LlamaRAMCache`
+    additionally keeps the states of recent prompts, so agents taking turns still
+    find their instruction block already evaluated.
+    """
+
+    name = "llamacpp"
+    supports_images = False
+
+    def __init__(self):
+        self.llm = None
+        self._grammars = {}
+        # A llama.cpp context is not safe to use from several threads at once
+        self._lock = threading.Lock()
+
+    def load(self):
+        from llama_cpp import Llama, LlamaRAMCache
+
+        if not config.GGUF_MODEL_PATH:
+            raise ValueError("INFERENCE_BACKEND=llamacpp requires GGUF_MODEL_PATH")
+        logger.info(f"Loading GGUF model {config.GGUF_MODEL_PATH}...")
+        self.llm = Llama(
+            model_path=config.GGUF_MODEL_PATH,
+            n_ctx=config.LLAMACPP_N_CTX,
+            n_threads=config.LLAMACPP_N_THREADS,
+            # Map the GGUF file instead of reading it: loading returns before the weights are paged in
+            use_mmap=True,
+            verbose=False,
+        )
+        if config.PREFIX_CACHE_ENABLED:
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=config.LLAMACPP_CACHE_BYTES))
+
+    def format_prompt(self, prompt: str, num_images: int = 0) -> str:
+        with stage("template"):
+            return CHAT_TEMPLATE.format(prompt=prompt)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True))
+
+    def _grammar(self, schema: Optional[OutputSchema]):
+        # llama.cpp enforces the schema itself through a GBNF grammar; build each one once
+        if schema is None:
+            return None
+        key = (schema.name, schema.array)
+        if key not in self._grammars:
+            from llama_cpp import LlamaGrammar
+
+            self._grammars[key] = LlamaGrammar.from_json_schema(json.dumps(schema.json_schema()), verbose=False)
+        return self._grammars[key]
+
+    def _completion(self, formatted_prompt: str, max_tokens: int, schema: Optional[OutputSchema] = None):
+        return self.llm.create_completion(
+            formatted_prompt, max_tokens=max_tokens, temperature=0.0, stop=STOP_SEQUENCES, stream=True,
+            grammar=self._grammar(schema),
+        )
+
+    def generate(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> GenerationOutput:
+        self._check_images(images)
+        formatted_prompt = self.format_prompt(prompt)
+        chunks = []
+        with self._lock:
+            prompt_tokens = self.count_tokens(formatted_prompt)
+            start = time.perf_counter()
+            first_token_at = None
+            for chunk in self._completion(formatted_prompt, max_tokens, schema):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks.append(chunk["choices"][0]["text"])
+            end = time.perf_counter()
+        text = "".join(chunks)
+
+        # llama-cpp-python does not report stage timings, so split at the first token
+        first_token_at = first_token_at or end
+        prefill_s, decode_s = first_token_at - start, end - first_token_at
+        generation_tokens = self.count_tokens(text) if text else 0
+        record_stage("prefill", prefill_s)
+        record_stage("decode", decode_s)
+        record_count("prompt_tokens", prompt_tokens)
+        record_count("generation_tokens", generation_tokens)
+        logger.info(f"Generated {generation_tokens} tokens from {prompt_tokens} prompt tokens")
+        return GenerationOutput(
+            text=text,
+            prompt_tokens=prompt_tokens,
+            generation_tokens=generation_tokens,
+            prompt_tps=prompt_tokens / prefill_s if prefill_s else 0.0,
+            generation_tps=generation_tokens / decode_s if decode_s else 0.0,
+        )
+
+    def stream(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+               max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> Iterator[str]:
+        self._check_images(images)
+        formatted_prompt = self.format_prompt(prompt)
+        with self._lock:
+            for chunk in self._completion(formatted_prompt, max_tokens, schema):
+                text = chunk["choices"][0]["text"]
+                if text:
+                    yield text
+
+    def stats(self) -> dict:
+        cache = self.llm.cache if self.llm is not None else None
+        return {
+            "model_path": config.GGUF_MODEL_PATH,
+            "n_ctx": config.LLAMACPP_N_CTX,
+            "prefix_cache_bytes": cache.cache_size if cache is not None else 0,
+        }
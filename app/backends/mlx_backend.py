@@ -0,0 +1,71 @@
+from typing import Iterator, List, Optional
+
+from PIL import Image
+
+from app.backends.base import DEFAULT_MAX_TOKENS, GenerationOutput, InferenceBackend, PromptSession
+from app.utils.json_constraint import OutputSchema
+from app.utils import predictor
+from app.config.config import config
+from app.utils.model_loader import load_medgemma_model
+from app.utils.vision_cache import install_vision_cache
+
+
+class MLXBackend(InferenceBackend):
+    """MedGemma on Apple silicon through mlx_vlm, with prefix caching and optional micro-batching."""
+
+    name = "mlx"
+    supports_images = True
+
+    def __init__(self):
+        self.model = None
+        self.processor = None
+        self.config = None
+        self.vision_cache = None
+
+    def load(self):
+        self.model, self.processor, self.config = load_medgemma_model()
+        if config.VISION_CACHE_ENABLED:
+            self.vision_cache = install_vision_cache(self.model, int(config.VISION_CACHE_MAX_MB * (1 << 20)))
+
+    def format_prompt(self, prompt: str, num_images: int = 0) -> str:
+        return predictor.format_prompt(self.processor, self.config, prompt, num_images)
+
+    def count_tokens(self, text: str) -> int:
+        return len(predictor.encode_prompt(self.processor, text))
+
+    def warm_prefix(self, name: str):
+        predictor.warm_prefix(self.model, self.processor, self.config, name)
+
+    def open_session(self, prompt: str, prefix_key: Optional[str] = None) -> PromptSession:
+        return predictor.KVPromptSession(self.model, self.processor, self.config, prompt, prefix_key)
+
+    def generate(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> GenerationOutput:
+        return predictor.generate_response(
+            self.model, self.processor, self.config, prompt, images, prefix_key=prefix_key, max_tokens=max_tokens,
+            schema=schema,
+        )
+
+    def generate_batch(self, prompts: List[str], prefix_key: Optional[str] = None, max_tokens: int = DEFAULT_MAX_TOKENS,
+                       schema: Optional[OutputSchema] = None) -> List[GenerationOutput]:
+        return predictor.generate_responses(
+            self.model, self.processor, self.config, prompts, prefix_key=prefix_key, schema=schema,
+            max_tokens=max_tokens,
+        )
+
+    def stream(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+               max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> Iterator[str]:
+        return predictor.stream_response(
+            self.model, self.processor, self.config, prompt, images, prefix_key=prefix_key, max_tokens=max_tokens,
+            schema=schema,
+        )
+
+    def stats(self) -> dict:
+        from app.utils.generation_scheduler import scheduler_stats
+        from app.utils.prefix_cache import prefix_cache
+
+        return {
+            "prefix_cache": prefix_cache.stats(),
+            "generation_scheduler": scheduler_stats(),
+            "vision_cache": self.vision_cache.stats() if self.vision_cache is not None else {},
+        }
@@ -0,0 +1,93 @@
+import json
+import time
+from typing import Iterator, List, Optional
+
+from PIL import Image
+
+from app.backends.base import DEFAULT_MAX_TOKENS, GenerationOutput, InferenceBackend
+from app.utils.json_constraint import OutputSchema
+from app.config.config import config
+from app.utils.chunking import approx_token_count
+from app.utils.timing import record_count, record_stage, stage
+
+# Canned replies per prompt prefix, shaped like what the real agents expect to parse
+ICD10_OUTPUT = json.dumps([{"code": "R69", "description": "Illness, unspecified"}])
+STUB_OUTPUTS = {
+    "router": "icd10",
+    "icd10": ICD10_OUTPUT,
+    "icd10_compact": json.dumps(["R69"]),
+    "fused": "icd10\n" + ICD10_OUTPUT,
+    "soap": json.dumps({
+        "Subjective": "Stub subjective.",
+        "Objective": "Stub objective.",
+        "Assessment": "Stub assessment.",
+        "Plan": "Stub plan.",
+    }),
+    "image_analysis": json.dumps({
+        "technique": "Stub technique.",
+        "findings": "Stub findings.",
+        "impression": "Stub impression.",
+        "recommendations": "Stub recommendations.",
+        "answer_to_user_question": None,
+    }),
+}
+
+
+class StubBackend(InferenceBackend):
+    """
+    Model-free backend for tests and load experiments. Returns a fixed, valid reply
+    for each prompt prefix and sleeps for a latency proportional to the approximate
+    prompt and output token counts (`STUB_PREFILL_MS_PER_TOKEN`, `STUB_DECODE_MS_PER_TOKEN`).
+    """
+
+    name = "stub"
+    supports_images = True
+
+    def load(self):
+        pass
+
+    def format_prompt(self, prompt: str, num_images: int = 0) -> str:
+        with stage("template"):
+            return prompt
+
+    def count_tokens(self, text: str) -> int:
+        return approx_token_count(text)
+
+    def _reply(self, prefix_key: Optional[str], images) -> str:
+        if prefix_key in STUB_OUTPUTS:
+            return STUB_OUTPUTS[prefix_key]
+        return STUB_OUTPUTS["image_analysis"] if images else STUB_OUTPUTS["icd10"]
+
+    def _prefill(self, prompt: str) -> int:
+        prompt_tokens = self.count_tokens(self.format_prompt(prompt))
+        prefill_s = prompt_tokens * config.STUB_PREFILL_MS_PER_TOKEN / 1000
+        time.sleep(prefill_s)
+        record_stage("prefill", prefill_s)
+        return prompt_tokens
+
+    def generate(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> GenerationOutput:
+        prompt_tokens = self._prefill(prompt)
+        text = self._reply(prefix_key, images)
+        generation_tokens = min(approx_token_count(text), max_tokens)
+        decode_s = generation_tokens * config.STUB_DECODE_MS_PER_TOKEN / 1000
+        time.sleep(decode_s)
+        record_stage("decode", decode_s)
+        record_count("prompt_tokens", prompt_tokens)
+        record_count("generation_tokens", generation_tokens)
+        return GenerationOutput(
+            text=text,
+            prompt_tokens=prompt_tokens,
+            generation_tokens=generation_tokens,
+            prompt_tps=1000 / config.STUB_PREFILL_MS_PER_TOKEN if config.STUB_PREFILL_MS_PER_TOKEN else 0.0,
+            generation_tps=1000 / config.STUB_DECODE_MS_PER_TOKEN if config.STUB_DECODE_MS_PER_TOKEN else 0.0,
+        )
+
+    def stream(self, prompt: str, images: Optional[List[Image.Image]] = None, prefix_key: Optional[str] = None,
+               max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> Iterator[str]:
+        self._prefill(prompt)
+        text = self._reply(prefix_key, images)
+        # One "token" per four characters, matching approx_token_count
+        for i in range(0, min(len(text), 4 * max_tokens), 4):
+            time.sleep(config.STUB_DECODE_MS_PER_TOKEN / 1000)
+            yield text[i:i + 4]
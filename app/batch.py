@@ -0,0 +1,227 @@
+"""
+Offline bulk ICD-10 coding.
+
+Streams notes from a JSONL file (one object per line) or a JSON array file such as
+evaluations/synthetic_icd10_dataset.json, runs each through ICD10Agent directly
+(no routing), and appends one JSON line per note to the output file. Progress is
+checkpointed after every note, so rerunning the same command after a crash picks
+up where the previous run stopped.
+
+Usage:
+    python -m app.batch --input notes.jsonl --output codes.jsonl
+    python -m app.batch --input evaluations/synthetic_icd10_dataset.json --output codes.jsonl --limit 10
+"""
+import argparse
+import json
+import os
+import time
+from typing import Iterator, TextIO
+
+from app.agents.icd10_agent import ICD10Agent
+from app.graph.types import ICD10Payload, State
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+READ_CHUNK_SIZE = 1 << 16
+
+
+def iter_json_array(f: TextIO) -> Iterator:
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buffer, started, eof = "", False, False
+    while True:
+        if not eof:
+            chunk = f.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                break  # element continues in the next chunk
+            yield item
+        buffer = buffer[pos:]
+        if eof and not buffer.strip():
+            return
+
+
+def iter_jsonl(f: TextIO) -> Iterator:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def iter_records(path: str) -> Iterator:
+    """Yield input records from a JSONL or JSON array file, detected from the first character."""
+    with open(path, encoding="utf-8") as f:
+        first = ""
+        while True:
+            ch = f.read(1)
+            if not ch or not ch.isspace():
+                first = ch
+                break
+        f.seek(0)
+        yield from (iter_json_array(f) if first == "[" else iter_jsonl(f))
+
+
+class Checkpoint:
+    """
+    Progress of a batch run: how many input records are done and how many bytes of
+    the output file they account for. Written atomically after every record.
+    """
+
+    def __init__(self, path: str, input_path: str):
+        self.path = path
+        self.input_path = input_path
+        self.next_index = 0
+        self.output_offset = 0
+        self.prompt_tokens = 0
+        self.generation_tokens = 0
+
+    def load(self) -> bool:
+        """Read the checkpoint if there is one. Returns whether one was found."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("input_path") != self.input_path:
+            raise ValueError(
+                f"Checkpoint {self.path} belongs to input {data.get('input_path')}; "
+                "remove it or choose another --checkpoint"
+            )
+        self.next_index = data["next_index"]
+        self.output_offset = data["output_offset"]
+        self.prompt_tokens = data.get("prompt_tokens", 0)
+        self.generation_tokens = data.get("generation_tokens", 0)
+        return True
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "input_path": self.input_path,
+                "next_index": self.next_index,
+                "output_offset": self.output_offset,
+                "prompt_tokens": self.prompt_tokens,
+                "generation_tokens": self.generation_tokens,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def code_note(agent, note: str) -> dict:
+    state = State(type="icd10", payload=ICD10Payload(clinical_note=note))
+    response = agent.respond(state)
+    return {
+        "codes": agent.parse_result(response.text),
+        "prompt_tokens": response.prompt_tokens,
+        "generation_tokens": response.generation_tokens,
+    }
+
+
+def run_batch(input_path: str, output_path: str, checkpoint_path: str, note_field: str = "note",
+              id_field: str = "id", limit: int = None, log_every: int = 10) -> dict:
+    checkpoint = Checkpoint(checkpoint_path, os.path.abspath(input_path))
+    resuming = checkpoint.load()
+    if checkpoint.next_index:
+        logger.info(f"Resuming at record {checkpoint.next_index}")
+
+    agent = ICD10Agent()
+    processed, prompt_tokens, generation_tokens = 0, 0, 0
+    start = time.perf_counter()
+
+    with open(output_path, "a+b") as out:
+        if resuming:
+            # Drop anything written after the last checkpoint (a record whose checkpoint never landed)
+            out.truncate(checkpoint.output_offset)
+        else:
+            # A fresh run appends to whatever the output file already holds
+            checkpoint.output_offset = out.seek(0, os.SEEK_END)
+        out.seek(checkpoint.output_offset)
+
+        for index, record in enumerate(iter_records(input_path)):
+            if index < checkpoint.next_index:
+                continue
+            if limit is not None and index >= limit:
+                break
+
+            note = record.get(note_field) if isinstance(record, dict) else record
+            row = {"index": index, "id": record.get(id_field, index) if isinstance(record, dict) else index}
+            note_start = time.perf_counter()
+            try:
+                row.update(code_note(agent, note))
+                row["error"] = None
+            except Exception as e:
+                logger.error(f"Record {index} failed: {e}")
+                row.update({"codes": [], "error": str(e), "prompt_tokens": 0, "generation_tokens": 0})
+            row["latency_s"] = round(time.perf_counter() - note_start, 3)
+
+            out.write((json.dumps(row, ensure_ascii=False) + "\n").encode("utf-8"))
+            out.flush()
+            os.fsync(out.fileno())
+
+            processed += 1
+            prompt_tokens += row["prompt_tokens"]
+            generation_tokens += row["generation_tokens"]
+            checkpoint.next_index = index + 1
+            checkpoint.output_offset = out.tell()
+            checkpoint.prompt_tokens += row["prompt_tokens"]
+            checkpoint.generation_tokens += row["generation_tokens"]
+            checkpoint.save()
+
+            if processed % log_every == 0:
+                elapsed = time.perf_counter() - start
+                logger.info(
+                    f"{checkpoint.next_index} notes done, {processed / elapsed:.2f} notes/s, "
+                    f"{generation_tokens / elapsed:.1f} generated tokens/s"
+                )
+
+    elapsed = time.perf_counter() - start
+    report = {
+        "processed": processed,
+        "total_done": checkpoint.next_index,
+        "elapsed_s": round(elapsed, 2),
+        "notes_per_s": processed / elapsed if elapsed else 0.0,
+        "prompt_tokens_per_s": prompt_tokens / elapsed if elapsed else 0.0,
+        "generation_tokens_per_s": generation_tokens / elapsed if elapsed else 0.0,
+    }
+    logger.info(f"Batch finished: {report}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="JSONL or JSON array file of notes")
+    parser.add_argument("--output", required=True, help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint path (default: <output>.checkpoint)")
+    parser.add_argument("--note-field", default="note", help="Field holding the note text")
+    parser.add_argument("--id-field", default="id", help="Field copied to the output as the record id")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many input records")
+    args = parser.parse_args()
+
+    report = run_batch(
+        args.input, args.output, args.checkpoint or args.output + ".checkpoint",
+        note_field=args.note_field, id_field=args.id_field, limit=args.limit,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
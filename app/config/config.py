@@ -1,10 +1,138 @@
-import mlx.core as mx
-from mlx_lm import load, generate 
+import os
 
 class Config:
     MODEL_ID = "mlx-community/medgemma-4b-it-4bit"
+
+    # Model runtime behind the agents: "mlx" (Apple silicon), "llamacpp" (GGUF on CPU) or "stub" (no model)
+    INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "mlx").lower()
+    # llama.cpp backend
+    GGUF_MODEL_PATH = os.getenv("GGUF_MODEL_PATH")
+    LLAMACPP_N_CTX = int(os.getenv("LLAMACPP_N_CTX", "8192"))
+    LLAMACPP_N_THREADS = int(os.getenv("LLAMACPP_N_THREADS", str(os.cpu_count() or 4)))
+    # Memory kept for KV states of recent prompts, so agents' instruction prefixes are not re-evaluated
+    LLAMACPP_CACHE_BYTES = int(os.getenv("LLAMACPP_CACHE_BYTES", str(2 << 30)))
+    # Stub backend: simulated latency per (approximate) prompt and output token
+    STUB_PREFILL_MS_PER_TOKEN = float(os.getenv("STUB_PREFILL_MS_PER_TOKEN", "0.2"))
+    STUB_DECODE_MS_PER_TOKEN = float(os.getenv("STUB_DECODE_MS_PER_TOKEN", "5"))
     # MAX_NEW_TOKENS = 1024
     # TORCH_DTYPE = torch.float32 if torch.backends.mps.is_available() else torch.bfloat16
     # DEVICE_MAP = "auto"
 
-config = Config()
\ No newline at end of file
+    # Inference executor: graph runs happen on these worker threads, never on the event loop
+    INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+    # Requests allowed to wait for a free worker before new ones are rejected with 429
+    INFERENCE_QUEUE_DEPTH = int(os.getenv("INFERENCE_QUEUE_DEPTH", "8"))
+    # Per-request deadline (seconds), covering queue wait and execution
+    INFERENCE_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "120"))
+
+    # Image uploads: limits checked before decoding, the vision encoder's square input size
+    # (896 for MedGemma's SigLIP tower) that images are decoded straight to, and decode threads
+    IMAGE_MAX_UPLOAD_MB = float(os.getenv("IMAGE_MAX_UPLOAD_MB", "25"))
+    IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "64000000"))
+    IMAGE_INPUT_SIZE = int(os.getenv("IMAGE_INPUT_SIZE", "896"))
+    IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "2"))
+
+    # Multi-image studies: most images sent to the model per study, and the thumbnail
+    # difference (mean absolute intensity, 0-1) below which a slice counts as a near-duplicate
+    STUDY_MAX_IMAGES = int(os.getenv("STUDY_MAX_IMAGES", "8"))
+    STUDY_DEDUP_THRESHOLD = float(os.getenv("STUDY_DEDUP_THRESHOLD", "0.01"))
+
+    # Keep vision tower outputs of recent images (keyed by pixel hash), so asking about
+    # the same image again skips the vision encoder; bounded by memory, LRU eviction
+    VISION_CACHE_ENABLED = os.getenv("VISION_CACHE_ENABLED", "true").lower() == "true"
+    VISION_CACHE_MAX_MB = float(os.getenv("VISION_CACHE_MAX_MB", "512"))
+
+    # Reuse the precomputed KV cache of each agent's fixed instruction block
+    PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "true").lower() == "true"
+
+    # Micro-batch concurrent text-only generations (useful with INFERENCE_WORKERS > 1)
+    GENERATION_BATCHING = os.getenv("GENERATION_BATCHING", "false").lower() == "true"
+    BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "4"))
+    BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+    # Constrain agent outputs to their JSON schema and stop as soon as the value closes
+    CONSTRAINED_DECODING = os.getenv("CONSTRAINED_DECODING", "true").lower() == "true"
+    # Candidates checked per step, in logit order, before falling back to a full vocabulary scan
+    CONSTRAINED_TOP_K = int(os.getenv("CONSTRAINED_TOP_K", "32"))
+    # Per-agent generation caps (tokens)
+    ROUTER_MAX_TOKENS = int(os.getenv("ROUTER_MAX_TOKENS", "8"))
+    ICD10_MAX_TOKENS = int(os.getenv("ICD10_MAX_TOKENS", "384"))
+    SOAP_MAX_TOKENS = int(os.getenv("SOAP_MAX_TOKENS", "768"))
+    IMAGE_ANALYSIS_MAX_TOKENS = int(os.getenv("IMAGE_ANALYSIS_MAX_TOKENS", "512"))
+
+    # Memory-mapped ICD-10-CM table (built with `python -m app.utils.icd10_index`) used to
+    # validate codes and, in compact mode, to fill in their descriptions
+    ICD10_INDEX_PATH = os.getenv("ICD10_INDEX_PATH", "artifacts/icd10cm.idx")
+    # Have the model emit only code identifiers; descriptions come from the table
+    ICD10_COMPACT_OUTPUT = os.getenv("ICD10_COMPACT_OUTPUT", "false").lower() == "true"
+
+    # BM25 index over the code table (built with `python -m app.utils.icd10_retrieval`);
+    # when present, the top-k candidate codes for a note are listed in the ICD-10 prompt
+    ICD10_RETRIEVAL_INDEX_PATH = os.getenv("ICD10_RETRIEVAL_INDEX_PATH", "artifacts/icd10cm_bm25.npz")
+    ICD10_RETRIEVAL_ENABLED = os.getenv("ICD10_RETRIEVAL_ENABLED", "true").lower() == "true"
+    ICD10_RETRIEVAL_TOP_K = int(os.getenv("ICD10_RETRIEVAL_TOP_K", "20"))
+
+    # Notes/transcripts longer than CHUNK_MAX_TOKENS are split on section headers or
+    # speaker turns, processed one after another, and the results merged
+    CHUNKING_ENABLED = os.getenv("CHUNKING_ENABLED", "true").lower() == "true"
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "2048"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "128"))
+
+    # Live SOAP sessions (/api/sessions): open sessions allowed at once, memory their KV
+    # caches may hold together before the least recently used are released, and idle lifetime
+    LIVE_SESSION_MAX = int(os.getenv("LIVE_SESSION_MAX", "16"))
+    LIVE_SESSION_MAX_KV_MB = float(os.getenv("LIVE_SESSION_MAX_KV_MB", "2048"))
+    LIVE_SESSION_TTL_S = float(os.getenv("LIVE_SESSION_TTL_S", "1800"))
+
+    # Let one generation both route and answer when the LLM router would be needed,
+    # instead of a routing pass followed by a second prefill in the task agent
+    FUSED_ROUTING = os.getenv("FUSED_ROUTING", "false").lower() == "true"
+
+    # Logging goes through a bounded queue to a writer thread; records beyond LOG_QUEUE_SIZE are dropped
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_FILE = os.getenv("LOG_FILE")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+    # Startup: after loading, run each agent once on a tiny input with this many output
+    # tokens, so kernel compilation happens before /readyz reports ready
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_MAX_TOKENS = int(os.getenv("WARMUP_MAX_TOKENS", "4"))
+
+    # Tracing: spans are exported in batches from a background thread to "langsmith",
+    # "file" (JSON lines at TRACE_FILE), "stdout" or nowhere ("none"). Only
+    # TRACE_SAMPLE_RATE of requests are traced; note and transcript text is replaced
+    # by its length unless TRACE_REDACT_TEXT is off, and other strings are truncated
+    TRACE_EXPORTER = os.getenv(
+        "TRACE_EXPORTER", "langsmith" if os.getenv("LANGCHAIN_TRACING_V2", "false").lower() == "true" else "none"
+    ).lower()
+    TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+    TRACE_REDACT_TEXT = os.getenv("TRACE_REDACT_TEXT", "true").lower() == "true"
+    TRACE_MAX_FIELD_CHARS = int(os.getenv("TRACE_MAX_FIELD_CHARS", "512"))
+    TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+    TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "64"))
+    TRACE_FLUSH_INTERVAL_S = float(os.getenv("TRACE_FLUSH_INTERVAL_S", "2"))
+
+    # Result cache keyed on normalized input, model ID and prompt version
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+    RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", "86400"))
+    # Optional SQLite file for a persistent second level; in-memory only when unset
+    RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB")
+
+    # Asynchronous jobs (/api/jobs): a SQLite queue consumed by JOB_WORKERS workers that
+    # share the inference pool with /analyze. Failed attempts are retried with
+    # exponential backoff; finished jobs are kept for JOB_RESULT_TTL_S.
+    JOBS_ENABLED = os.getenv("JOBS_ENABLED", "true").lower() == "true"
+    JOB_DB = os.getenv("JOB_DB", "jobs.db")
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+    JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RETRY_BACKOFF_S = float(os.getenv("JOB_RETRY_BACKOFF_S", "5"))
+    # Deadline of one attempt; replaces INFERENCE_TIMEOUT_S for jobs
+    JOB_TIMEOUT_S = float(os.getenv("JOB_TIMEOUT_S", "900"))
+    JOB_RESULT_TTL_S = float(os.getenv("JOB_RESULT_TTL_S", "86400"))
+    # Longest a GET /api/jobs/{id}?wait= long-poll is held open
+    JOB_MAX_WAIT_S = float(os.getenv("JOB_MAX_WAIT_S", "60"))
+
+config = Config()
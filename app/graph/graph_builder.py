@@ -5,22 +5,53 @@ from app.agents.icd10_agent import ICD10Agent
 from app.agents.soap_generator_agent import SoapGeneratorAgent
 from app.agents.image_analyzer_agent import ImageAnalyzerAgent
 from app.agents.router_agent import RouterAgent
+from app.agents.fused_agent import FusedRouteAgent
+from app.config.config import config
 from langgraph.graph import START, END, StateGraph
 
-def build_graph():
+def build_agents(fused: bool = None):
+    fused = config.FUSED_ROUTING if fused is None else fused
+    router = RouterAgent()
+    agents = {
+        "router": router,
+        "icd10": ICD10Agent(),
+        "soap": SoapGeneratorAgent(),
+        "image_analysis": ImageAnalyzerAgent(),
+    }
+    if fused:
+        agents["fused"] = FusedRouteAgent(router, {"icd10": agents["icd10"], "soap": agents["soap"]})
+    return agents
+
+def route_after_router(state: State):
+    # A fused pass already produced the result (or failed); nothing left to run
+    if state.routing_tier == "fused" or state.error:
+        return END
+    return state.type
+
+def build_graph(agents: dict = None):
+    """
+    Build the routing graph. When `agents` includes a "fused" agent (FUSED_ROUTING),
+    it takes the router's place: requests it answers in a single pass go straight
+    to END, everything else continues to the task agent as before.
+    """
+    agents = agents or build_agents()
     graph = StateGraph(State)
 
-    graph.add_node("router", RouterAgent().run)
-    graph.add_node("icd10", ICD10Agent().run)
-    graph.add_node("soap", SoapGeneratorAgent().run)
-    graph.add_node("image_analysis", ImageAnalyzerAgent().run)
+    if "fused" in agents:
+        graph.add_node("router", agents["fused"].run)
+    else:
+        graph.add_node("router", agents["router"].run)
+    graph.add_node("icd10", agents["icd10"].run)
+    graph.add_node("soap", agents["soap"].run)
+    graph.add_node("image_analysis", agents["image_analysis"].run)
 
     graph.add_edge(START, "router")
 
-    graph.add_conditional_edges("router", lambda s: s.type, {
+    graph.add_conditional_edges("router", route_after_router, {
         "icd10": "icd10",
         "soap": "soap",
-        "image_analysis": "image_analysis"
+        "image_analysis": "image_analysis",
+        END: END,
     })
 
     graph.add_edge("icd10", END)
@@ -1,23 +1,63 @@
 # app/graph/types.py
 
-from typing import TypedDict, Literal, Union, Optional, List
-from PIL import Image as PILImage
-from pydantic import BaseModel
-from app.api.schemas import ICD10Code
+from dataclasses import dataclass
+from typing import Literal, Union, Optional, List
+import numpy as np
 
+TaskType = Literal["icd10", "soap", "image_analysis"]
 
-class ICD10Payload(TypedDict):
+
+# Payloads are slotted dataclasses holding references to the request's inputs: the
+# note text is the string that was uploaded, never a copy, and each task's payload
+# only keeps what that task reads, so e.g. images do not outlive routing to a text task.
+
+@dataclass(slots=True)
+class RequestPayload:
+    """The inputs as received, before routing."""
+    note: Optional[str] = None
+    # One or more uint8 HxWx3 arrays at the vision encoder's input size (app/utils/image_ingest.py)
+    images: Optional[List[np.ndarray]] = None
+    # Images received/analyzed for multi-image studies (StudySummary fields)
+    study: Optional[dict] = None
+
+
+@dataclass(slots=True)
+class ICD10Payload:
     clinical_note: str
 
-class SOAPPayload(TypedDict):
+
+@dataclass(slots=True)
+class SOAPPayload:
     transcript: str
 
-class ImageAnalysisPayload(TypedDict):
-    image: PILImage.Image
-    clinical_note: Optional[str]
 
-class State(BaseModel):
-    type: Optional[Literal["icd10", "soap", "image_analysis"]]
-    payload: dict  
-    result: Optional[Union[str, List[ICD10Code], dict]]  # accept str or list or dict
-    error: Optional[str]
\ No newline at end of file
+@dataclass(slots=True)
+class ImageAnalysisPayload:
+    # Set to None by the image agent once the arrays are handed to the vision encoder
+    images: Optional[List[np.ndarray]]
+    clinical_note: Optional[str] = None
+    study: Optional[dict] = None
+
+
+Payload = Union[RequestPayload, ICD10Payload, SOAPPayload, ImageAnalysisPayload]
+
+
+def task_payload(task: str, request: RequestPayload) -> Optional[Payload]:
+    """The payload `task` runs on, built from the request's inputs; None for an unknown task."""
+    if task == "icd10":
+        return ICD10Payload(clinical_note=request.note or "")
+    if task == "soap":
+        return SOAPPayload(transcript=request.note or "")
+    if task == "image_analysis":
+        return ImageAnalysisPayload(images=request.images or [], clinical_note=request.note, study=request.study)
+    return None
+
+
+@dataclass(slots=True)
+class State:
+    type: Optional[TaskType] = None
+    payload: Optional[Payload] = None
+    result: Optional[Union[str, list, dict]] = None
+    error: Optional[str] = None
+    # How the task was chosen ("explicit", "heuristic", "llm" or "fused"), set by the router
+    routing_tier: Optional[str] = None
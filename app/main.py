@@ -1,23 +1,37 @@
-from fastapi import FastAPI
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from app.api.analyze import router as analyze_router
 import os
-from langsmith import Client
-from langsmith.run_helpers import traceable
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before anything reads the config (LANGCHAIN_* and
+# TRACE_* are picked up by app.utils.tracing; nothing connects to LangSmith here)
 load_dotenv()
-# Access LangSmith environment variables
-LANGCHAIN_TRACING_V2 = os.getenv("LANGCHAIN_TRACING_V2")
-LANGCHAIN_ENDPOINT = os.getenv("LANGCHAIN_ENDPOINT")
-LANGCHAIN_API_KEY = os.getenv("LANGCHAIN_API_KEY")
-LANGCHAIN_PROJECT = os.getenv("LANGCHAIN_PROJECT")
-
-app = FastAPI()
-langsmith_client = Client()
+
+# Imported first so the lifecycle's clock starts as early as possible
+from app.utils.lifecycle import model_lifecycle
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from app.api.analyze import inference_executor, router as analyze_router
+from app.api.jobs import router as jobs_router, start_jobs, stop_jobs
+from app.api.instrumentation import InstrumentationMiddleware
+from app.utils.metrics import registry
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load and warm up the model in the background; the server accepts connections meanwhile
+    model_lifecycle.start()
+    start_jobs()
+    yield
+    await stop_jobs()
+    inference_executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(analyze_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+app.add_middleware(InstrumentationMiddleware, exclude=("/metrics", "/healthz", "/readyz"))
 
 # Serve static HTML
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -25,3 +39,22 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 @app.get("/")
 def serve_ui():
     return FileResponse(os.path.join("app/static", "index.html"))
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/healthz")
+def healthz():
+    """Liveness: the process is up. Fails only if the model could not be loaded at all."""
+    status = model_lifecycle.status()
+    return JSONResponse(status_code=500 if status["state"] == "failed" else 200, content=status)
+
+
+@app.get("/readyz")
+def readyz():
+    """Readiness: the model is loaded and warmed up, so requests will be served."""
+    return JSONResponse(status_code=200 if model_lifecycle.ready else 503, content=model_lifecycle.status())
@@ -0,0 +1,137 @@
+import re
+from typing import Callable, Dict, List, Optional, Sequence
+
+from app.backends.base import GenerationOutput
+from app.utils.logger import get_logger
+from app.utils.route_classifier import SECTION_HEADER_RE, SPEAKER_TURN_RE
+
+logger = get_logger(__name__)
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def approx_token_count(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _split_at(text: str, pattern: re.Pattern) -> List[str]:
+    starts = sorted({m.start() for m in pattern.finditer(text)} | {0})
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)]) if text[a:b].strip()]
+
+
+def split_units(text: str, kind: str) -> List[str]:
+    """
+    Break a note into the smallest pieces a chunk boundary may fall between:
+    speaker turns for transcripts, section headers for clinical notes, and
+    paragraphs when neither is present.
+    """
+    pattern = SPEAKER_TURN_RE if kind == "transcript" else SECTION_HEADER_RE
+    if pattern.search(text):
+        return _split_at(text, pattern)
+    return [p for p in _PARAGRAPH_RE.split(text) if p.strip()]
+
+
+def _split_oversized(unit: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Split a single section/turn longer than a chunk at sentence, then word, boundaries."""
+    pieces, current = [], ""
+    for sentence in _SENTENCE_RE.split(unit):
+        parts = [sentence] if count_tokens(sentence) <= max_tokens else sentence.split(" ")
+        for part in parts:
+            candidate = f"{current} {part}" if current else part
+            if current and count_tokens(candidate) > max_tokens:
+                pieces.append(current)
+                candidate = part
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_text(text: str, kind: str, max_tokens: int, overlap_tokens: int = 0,
+               count_tokens: Callable[[str], int] = approx_token_count) -> List[str]:
+    """
+    Pack whole sections (notes) or speaker turns (transcripts) into chunks of at
+    most `max_tokens`. Each chunk after the first starts with the trailing units of
+    the previous one, up to `overlap_tokens`, so findings that straddle a boundary
+    keep their context.
+
+    Args:
+        text (str): The note or transcript.
+        kind (str): "note" or "transcript".
+        max_tokens (int): Token budget of one chunk.
+        overlap_tokens (int): Token budget of the context repeated from the previous chunk.
+        count_tokens (Callable[[str], int]): Token counter, ideally the model tokenizer's.
+
+    Returns:
+        List[str]: The chunks, in order. A text that fits is returned as one chunk.
+    """
+    if count_tokens(text) <= max_tokens:
+        return [text]
+
+    units = []
+    for unit in split_units(text, kind):
+        if count_tokens(unit) > max_tokens:
+            units.extend(_split_oversized(unit, max_tokens, count_tokens))
+        else:
+            units.append(unit)
+    sizes = [count_tokens(u) for u in units]
+
+    chunks, start = [], 0
+    while start < len(units):
+        end, used = start, 0
+        while end < len(units) and (end == start or used + sizes[end] <= max_tokens):
+            used += sizes[end]
+            end += 1
+        chunks.append("\n".join(u.strip("\n") for u in units[start:end]))
+        if end >= len(units):
+            break
+        # Step back over trailing units that fit in the overlap budget, always moving forward
+        next_start, carried = end, 0
+        while next_start - 1 > start and carried + sizes[next_start - 1] <= overlap_tokens:
+            next_start -= 1
+            carried += sizes[next_start]
+        start = next_start
+    return chunks
+
+
+def merge_icd10_codes(results: Sequence[Optional[list]]) -> list:
+    """Concatenate per-chunk code lists, keeping the first occurrence of each code."""
+    merged, seen = [], set()
+    for codes in results:
+        for entry in codes or []:
+            code = entry if isinstance(entry, str) else entry.get("code", "")
+            key = code.strip().upper().replace(".", "")
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(entry)
+    return merged
+
+
+def merge_soap_sections(results: Sequence[Optional[dict]], fields: Sequence[str]) -> Dict[str, str]:
+    """Join each SOAP section across chunks line by line, dropping lines already present."""
+    merged = {}
+    for field in fields:
+        lines, seen = [], set()
+        for result in results:
+            for line in str((result or {}).get(field) or "").splitlines():
+                key = line.strip().lstrip("-•* ").lower()
+                if key and key not in seen:
+                    seen.add(key)
+                    lines.append(line.strip())
+        merged[field] = "\n".join(lines)
+    return merged
+
+
+def combine_outputs(outputs: Sequence[GenerationOutput], text: str) -> GenerationOutput:
+    """One GenerationOutput for a chunked run: merged text and summed token counts."""
+    prompt_tokens = sum(o.prompt_tokens for o in outputs)
+    generation_tokens = sum(o.generation_tokens for o in outputs)
+    return GenerationOutput(
+        text=text,
+        prompt_tokens=prompt_tokens,
+        generation_tokens=generation_tokens,
+        prompt_tps=sum(o.prompt_tps for o in outputs) / len(outputs) if outputs else 0.0,
+        generation_tps=sum(o.generation_tps for o in outputs) / len(outputs) if outputs else 0.0,
+        cached_tokens=sum(o.cached_tokens for o in outputs),
+    )
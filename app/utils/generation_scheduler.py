@@ -0,0 +1,317 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import mlx.core as mx
+from mlx_vlm.models.cache import make_prompt_cache
+
+from app.utils.json_constraint import OutputSchema, TokenConstraint
+from app.utils.logger import get_logger
+from app.utils.prefix_cache import prefix_cache
+from app.utils.predictor import (
+    GenerationOutput, generate_text, make_constraint, _logits, _stop_token_ids, _tokenizer
+)
+
+logger = get_logger(__name__)
+
+# Longer prompts are prefilled in chunks by the single-sequence path instead of batched
+MAX_PROMPT_TOKENS = 2048
+
+
+@dataclass
+class GenerationRequest:
+    input_ids: List[int]
+    max_tokens: int
+    prefix_key: Optional[str] = None
+    schema: Optional[OutputSchema] = None
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def sliding_window(language_model) -> Optional[int]:
+    """
+    Keys kept by the model's sliding-window attention layers, or None if every layer
+    attends to the full context. Gemma 3's local layers use a RotatingKVCache capped
+    at the window, which the shared padding mask does not fit once it grows past it.
+    """
+    sizes = [cache.max_size for cache in make_prompt_cache(language_model) if getattr(cache, "max_size", None)]
+    return min(sizes) if sizes else None
+
+
+def split_batch(batch: List[GenerationRequest], max_prompt_tokens: int,
+                window: Optional[int] = None) -> Tuple[List[GenerationRequest], List[GenerationRequest]]:
+    """
+    Split a collected batch into requests to generate together and requests for the
+    single-sequence path: prompts over `max_prompt_tokens`, and as many of the
+    longest as needed for the padded prompt plus the longest generation to fit in
+    the sliding `window`. A lone batchable request runs on its own as well.
+    """
+    batchable = sorted((r for r in batch if len(r.input_ids) <= max_prompt_tokens),
+                       key=lambda r: len(r.input_ids) + r.max_tokens)
+    singles = [r for r in batch if len(r.input_ids) > max_prompt_tokens]
+    if window is not None:
+        while batchable and (max(len(r.input_ids) for r in batchable)
+                             + max(r.max_tokens for r in batchable)) > window:
+            singles.append(batchable.pop())
+    if len(batchable) == 1:
+        singles, batchable = singles + batchable, []
+    return batchable, singles
+
+
+def _padding_masks(pad_lens: List[int], length: int) -> mx.array:
+    """
+    Boolean attention mask for a left-padded prefill of shape (B, 1, L, L).
+
+    Real tokens attend causally to real tokens only. Padding positions attend to
+    themselves so their rows never go all-masked (which would produce NaNs that
+    leak into later layers through the values).
+    """
+    positions = mx.arange(length)
+    causal = positions[:, None] >= positions[None, :]
+    real_keys = positions[None, :] >= mx.array(pad_lens)[:, None]
+    mask = causal[None] & real_keys[:, None, :]
+    mask = mask | mx.eye(length, dtype=mx.bool_)[None]
+    return mask[:, None]
+
+
+def _decode_mask(pad_lens: List[int], total_length: int) -> mx.array:
+    """Boolean mask of shape (B, 1, 1, T) hiding each sequence's left padding."""
+    positions = mx.arange(total_length)
+    return (positions[None, :] >= mx.array(pad_lens)[:, None])[:, None, None, :]
+
+
+def _select_tokens(logits, constraints: List[Optional[TokenConstraint]], done: List[bool]) -> List[Optional[int]]:
+    """Greedy next token per sequence; constrained sequences pick from their valid tokens."""
+    token_ids = mx.argmax(logits, axis=-1).tolist()
+    for i, constraint in enumerate(constraints):
+        if constraint is not None and not done[i]:
+            token_ids[i] = constraint.select(logits[i])
+    return token_ids
+
+
+def generate_batch(model, processor, requests: List[GenerationRequest]):
+    """
+    Greedy generation for several text-only prompts at once.
+
+    Prompts are left-padded to a common length and prefilled together; decode
+    steps then run for the whole batch with per-sequence stopping, so a finished
+    sequence just stops collecting tokens while the others continue.
+
+    Returns:
+        List[GenerationOutput]: One result per request, in order.
+    """
+    tokenizer = _tokenizer(processor)
+    language_model = model.language_model
+    pad_id = getattr(tokenizer, "pad_token_id", None) or 0
+    length = max(len(r.input_ids) for r in requests)
+    pad_lens = [length - len(r.input_ids) for r in requests]
+    inputs = mx.array([[pad_id] * pad + r.input_ids for pad, r in zip(pad_lens, requests)])
+
+    prompt_cache = make_prompt_cache(language_model)
+    start = time.perf_counter()
+    logits = _logits(language_model(inputs, cache=prompt_cache, mask=_padding_masks(pad_lens, length)))[:, -1, :]
+    constraints = [make_constraint(processor, r.schema) for r in requests]
+    done = [False] * len(requests)
+    token_ids = _select_tokens(logits, constraints, done)
+    prefill_s = time.perf_counter() - start
+
+    stop_ids = _stop_token_ids(processor)
+    outputs = [[] for _ in requests]
+    total_length = length
+    start = time.perf_counter()
+    while True:
+        for i, token_id in enumerate(token_ids):
+            if done[i]:
+                continue
+            if token_id is None or token_id in stop_ids or len(outputs[i]) >= requests[i].max_tokens:
+                done[i] = True
+            else:
+                outputs[i].append(token_id)
+                done[i] = len(outputs[i]) >= requests[i].max_tokens or (
+                    constraints[i] is not None and constraints[i].complete
+                )
+        if all(done):
+            break
+        total_length += 1
+        # Finished sequences keep stepping with a filler token; their output is no longer collected
+        step = [pad_id if token_id is None else token_id for token_id in token_ids]
+        logits = _logits(language_model(
+            mx.array(step)[:, None], cache=prompt_cache, mask=_decode_mask(pad_lens, total_length)
+        ))[:, -1, :]
+        token_ids = _select_tokens(logits, constraints, done)
+    decode_s = time.perf_counter() - start
+
+    prompt_tokens = sum(len(r.input_ids) for r in requests)
+    return [
+        GenerationOutput(
+            text=tokenizer.decode(tokens_out),
+            prompt_tokens=len(r.input_ids),
+            generation_tokens=len(tokens_out),
+            # Throughput is shared by the whole batch
+            prompt_tps=prompt_tokens / prefill_s if prefill_s else 0.0,
+            generation_tps=sum(len(o) for o in outputs) / decode_s if decode_s else 0.0,
+        )
+        for r, tokens_out in zip(requests, outputs)
+    ]
+
+
+def _fail(requests: List[GenerationRequest], error: Exception):
+    """Fail the requests that have no result yet."""
+    for request in requests:
+        if not request.future.done():
+            request.future.set_exception(error)
+
+
+def generate_single(model, processor, request: GenerationRequest) -> GenerationOutput:
+    """The single-sequence path for one request, reusing its prompt prefix's KV cache."""
+    prompt_cache, cached_tokens = prefix_cache.lookup(request.prefix_key, request.input_ids)
+    return generate_text(
+        model, processor, request.input_ids, prompt_cache, cached_tokens, request.max_tokens, schema=request.schema,
+    )
+
+
+def run_batch(model, processor, batch: List[GenerationRequest], max_prompt_tokens: int = MAX_PROMPT_TOKENS,
+              window: Optional[int] = None):
+    """
+    Generate a collected batch and resolve each request's future: the requests
+    `split_batch` allows together in one `generate_batch` call, the others one
+    at a time on the single-sequence path.
+    """
+    batchable, singles = split_batch(batch, max_prompt_tokens, window)
+    if batchable:
+        try:
+            for request, output in zip(batchable, generate_batch(model, processor, batchable)):
+                request.future.set_result(output)
+        except Exception as e:
+            logger.error(f"Batched generation failed for {len(batchable)} sequences: {e}")
+            _fail(batchable, e)
+    for request in singles:
+        try:
+            request.future.set_result(generate_single(model, processor, request))
+        except Exception as e:
+            _fail([request], e)
+
+
+def generate_together(model, processor, requests: List[GenerationRequest],
+                      max_batch_size: int) -> List[GenerationOutput]:
+    """
+    Run related requests (e.g. the chunks of one long note) on the calling thread,
+    up to `max_batch_size` per batch. For callers that already hold an inference
+    worker when no scheduler thread owns the model. Raises the first failure.
+    """
+    window = sliding_window(model.language_model)
+    for start in range(0, len(requests), max(1, max_batch_size)):
+        run_batch(model, processor, requests[start:start + max_batch_size], window=window)
+    return [request.future.result() for request in requests]
+
+
+class GenerationScheduler:
+    """
+    Dynamic micro-batching for text-only generation.
+
+    Callers on any thread submit a tokenized prompt and block for its result. A
+    single scheduler thread owns the model: it takes the first waiting request,
+    keeps collecting for up to `max_wait_ms` or until `max_batch_size` requests
+    are waiting, and runs them as one batch. A batch of one goes through the
+    regular single-sequence path so it still benefits from the prefix cache.
+    """
+
+    def __init__(self, model, processor, max_batch_size: int = 4, max_wait_ms: float = 5.0,
+                 max_prompt_tokens: int = MAX_PROMPT_TOKENS):
+        self.model = model
+        self.processor = processor
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max_wait_ms / 1000
+        self.max_prompt_tokens = max_prompt_tokens
+        self.window = sliding_window(model.language_model)
+        self._queue: "queue.Queue[GenerationRequest]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.sequences = 0
+        self.queue_wait_s_total = 0.0
+        self.queue_wait_s_max = 0.0
+        self.batch_size_counts = {}
+        self._thread = threading.Thread(target=self._loop, name="generation-scheduler", daemon=True)
+        self._thread.start()
+
+    def submit(self, input_ids: List[int], max_tokens: int, prefix_key: Optional[str] = None,
+               schema: Optional[OutputSchema] = None):
+        request = GenerationRequest(input_ids=input_ids, max_tokens=max_tokens, prefix_key=prefix_key, schema=schema)
+        return self.submit_many([request])[0]
+
+    def submit_many(self, requests: List[GenerationRequest]) -> List[GenerationOutput]:
+        """Queue related requests together, so they are collected into the same batches, and wait for all."""
+        for request in requests:
+            self._queue.put(request)
+        return [request.future.result() for request in requests]
+
+    def _collect(self, batch: List[GenerationRequest]):
+        """Fill `batch` in place, so requests already taken are known if anything fails."""
+        batch.append(self._queue.get())
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+    def _record(self, batch: List[GenerationRequest]):
+        now = time.perf_counter()
+        waits = [now - r.enqueued_at for r in batch]
+        with self._lock:
+            self.batches += 1
+            self.sequences += len(batch)
+            self.queue_wait_s_total += sum(waits)
+            self.queue_wait_s_max = max(self.queue_wait_s_max, *waits)
+            self.batch_size_counts[len(batch)] = self.batch_size_counts.get(len(batch), 0) + 1
+
+    def _loop(self):
+        while True:
+            batch: List[GenerationRequest] = []
+            try:
+                self._collect(batch)
+                self._record(batch)
+                run_batch(self.model, self.processor, batch, self.max_prompt_tokens, self.window)
+            except Exception as e:
+                # The thread must outlive any one batch, or every caller would block forever
+                logger.error(f"Generation scheduler failed on a batch of {len(batch)} requests: {e}")
+                _fail(batch, e)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_s * 1000,
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "sequences": self.sequences,
+                "mean_batch_occupancy": (
+                    self.sequences / (self.batches * self.max_batch_size) if self.batches else 0.0
+                ),
+                "batch_sizes": dict(self.batch_size_counts),
+                "mean_queue_wait_ms": 1000 * self.queue_wait_s_total / self.sequences if self.sequences else 0.0,
+                "max_queue_wait_ms": 1000 * self.queue_wait_s_max,
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_generation_scheduler(model, processor, max_batch_size: int, max_wait_ms: float) -> GenerationScheduler:
+    """Return the process-wide scheduler, creating it on first use. The model is a singleton too."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GenerationScheduler(model, processor, max_batch_size, max_wait_ms)
+    return _scheduler
+
+
+def scheduler_stats() -> dict:
+    return _scheduler.stats() if _scheduler is not None else {}
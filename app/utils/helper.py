@@ -1,40 +1,86 @@
 from PIL import Image
 import base64
 from io import BytesIO
-import io
+import hashlib
 import re
+import unicodedata
+from typing import Optional, Sequence, Union
+import numpy as np
 from app.utils.logger import get_logger
 import json
 
 logger = get_logger(__name__)
 
-def convert_uploadfile_to_image(file_bytes: bytes) -> Image.Image:
-    try:
-        return Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    except Exception as e:
-        raise ValueError("Invalid image uploaded.") from e
-    
+def normalize_note(note: Optional[str]) -> str:
+    """Normalize note text for hashing: unicode NFC, collapsed whitespace, trimmed."""
+    if not note:
+        return ""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", note)).strip()
+
+
+def image_pixel_hash(image: Optional[Union[np.ndarray, Image.Image]]) -> str:
+    """Hash of the decoded pixels, so re-encoded uploads of the same image match."""
+    if image is None:
+        return ""
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(image, np.ndarray):
+        # Ingested images are hashed at encoder resolution, which is all the model sees
+        digest.update(f"{image.dtype}:{'x'.join(map(str, image.shape))}:".encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def compute_input_fingerprint(note: Optional[str], images: Optional[Sequence[Union[np.ndarray, Image.Image]]],
+                              task: Optional[str] = None) -> str:
+    """
+    Content hash identifying a request's inputs: normalized note text, the pixels
+    of each image in order, and the explicitly requested task, if any.
+    """
+    digest = hashlib.sha256()
+    pixels = ",".join(image_pixel_hash(image) for image in images or [])
+    for part in (normalize_note(note), pixels, task or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
     
+def _keep_entry(entry) -> bool:
+    # Code objects need a description; bare code strings (compact output) are kept as is
+    return not isinstance(entry, dict) or bool(entry.get("description"))
+
+
+def _recover_code_strings(cleaned: str) -> list:
+    """Complete string elements of a (possibly cut off) array of codes, e.g. `["K35.80", "R10.9", "R1`."""
+    start = cleaned.find("[")
+    if start == -1 or not cleaned[start + 1:].lstrip().startswith('"'):
+        return []
+    return re.findall(r'"([^"\\]*)"\s*(?=,|\]|$)', cleaned[start:])
+
+
 def clean_json_response(response: str) -> str:
     # Replace single quotes with double quotes
     response = re.sub(r"'", '"', response)
     # Remove markdown triple backticks and optional language specifier
-    cleaned = re.sub(r"^```json\s*|```$", "", response.strip(), flags=re.MULTILINE)
+    cleaned = re.sub(r"^```(?:json)?\s*|```$", "", response.strip(), flags=re.MULTILINE)
     try:
         data = json.loads(cleaned)
-        logger.info(f"Parsed JSON response: {data}")
+        logger.debug("Parsed JSON response: %s", data)
         # If data is a list, remove entries with empty 'description'
         if isinstance(data, list):
-            data = [entry for entry in data if entry.get("description")]
+            data = [entry for entry in data if _keep_entry(entry)]
         # If data is a dict with a list under a key (e.g., 'results'), clean that list
         elif isinstance(data, dict):
             for key, value in data.items():
                 if isinstance(value, list):
-                    data[key] = [entry for entry in value if entry.get("description")]
-        logger.info(f"Cleaned JSON response: {data}")
+                    data[key] = [entry for entry in value if _keep_entry(entry)]
+        logger.debug("Cleaned JSON response: %s", data)
         return json.dumps(data)
     except Exception as e:
-        logger.error(f"JSON parsing failed: {e}\nRaw response: {cleaned}")
+        logger.warning("JSON parsing failed, recovering complete objects: %s", e)
+        logger.debug("Raw response: %s", cleaned)
         # Try to recover valid objects from incomplete JSON
         # This regex matches objects like {"code": "...", "description": "..."}
         matches = re.findall(r'\{[^{}]*"code"\s*:\s*"[^"]*",\s*"description"\s*:\s*"[^"]*"\s*\}', cleaned)
@@ -46,5 +92,30 @@ def clean_json_response(response: str) -> str:
                     recovered.append(obj)
             except Exception:
                 continue
-        logger.info(f"Recovered partial JSON objects: {recovered}")
+        if not recovered:
+            # Compact output is an array of bare code strings
+            recovered = _recover_code_strings(cleaned)
+        logger.info("Recovered %d partial JSON objects", len(recovered))
         return json.dumps(recovered)
+
+
+class StateSummary:
+    """
+    Log argument describing a State without its content: the task, the sizes of the
+    text fields and the number of images. Rendered only if the record is emitted.
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def __str__(self) -> str:
+        payload = self.state.payload
+        parts = [f"type={self.state.type}"]
+        for field in ("note", "clinical_note", "transcript"):
+            if getattr(payload, field, None):
+                parts.append(f"{field}={len(getattr(payload, field))} chars")
+        if getattr(payload, "images", None):
+            parts.append(f"images={len(payload.images)}")
+        if self.state.error:
+            parts.append(f"error={self.state.error}")
+        return ", ".join(parts)
@@ -0,0 +1,210 @@
+"""
+Memory-mapped ICD-10-CM code table.
+
+The index file is built once from the CMS code list (`icd10cm_codes_<year>.txt`,
+one `CODE  Description` per line, codes without the dot) and then mapped read-only
+at startup, so loading costs a header read rather than a parse. Layout
+(little-endian):
+
+    header      magic, version, count, hash slots, description blob size
+    codes       count x 8 bytes, ASCII, dotless, sorted (for prefix search)
+    offsets     (count + 1) x uint32 into the description blob
+    hash        slots x int32, open addressing over the codes (-1 = empty)
+    blob        UTF-8 descriptions
+
+Usage:
+    python -m app.utils.icd10_index --input icd10cm_codes_2025.txt --output artifacts/icd10cm.idx
+"""
+import argparse
+import os
+import struct
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.config.config import config
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+MAGIC = b"ICD10IDX"
+VERSION = 1
+HEADER = struct.Struct("<8sIIII")
+HEADER_SIZE = 32
+CODE_WIDTH = 8
+_FNV_OFFSET = 0x811C9DC5
+_FNV_PRIME = 0x01000193
+
+
+def normalize_code(code: str) -> str:
+    """Dotless upper-case form used as the table key ("k35.80 " -> "K3580")."""
+    return code.strip().upper().replace(".", "")
+
+
+def display_code(code: str) -> str:
+    """Canonical dotted form ("K3580" -> "K35.80")."""
+    code = normalize_code(code)
+    return f"{code[:3]}.{code[3:]}" if len(code) > 3 else code
+
+
+def _hash(key: bytes) -> int:
+    h = _FNV_OFFSET
+    for byte in key:
+        h = ((h ^ byte) * _FNV_PRIME) & 0xFFFFFFFF
+    return h
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def build_index(entries: List[Tuple[str, str]], output_path: str) -> int:
+    """Write an index file for (code, description) pairs. Returns the number of codes."""
+    table = {}
+    for code, description in entries:
+        key = normalize_code(code)
+        if not key or len(key) > CODE_WIDTH:
+            raise ValueError(f"Invalid ICD-10 code: {code!r}")
+        table[key] = description.strip()
+    keys = sorted(table)
+
+    codes = np.array([k.encode("ascii") for k in keys], dtype=f"S{CODE_WIDTH}")
+    blob = bytearray()
+    offsets = np.zeros(len(keys) + 1, dtype="<u4")
+    for i, key in enumerate(keys):
+        blob += table[key].encode("utf-8")
+        offsets[i + 1] = len(blob)
+
+    slots = 1
+    while slots < 2 * max(len(keys), 1):
+        slots <<= 1
+    hash_table = np.full(slots, -1, dtype="<i4")
+    for i, key in enumerate(keys):
+        slot = _hash(key.encode("ascii")) & (slots - 1)
+        while hash_table[slot] != -1:
+            slot = (slot + 1) & (slots - 1)
+        hash_table[slot] = i
+
+    with open(output_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(keys), slots, len(blob)).ljust(HEADER_SIZE, b"\0"))
+        for array in (codes, offsets, hash_table):
+            data = array.tobytes()
+            f.write(data + b"\0" * (_align(len(data)) - len(data)))
+        f.write(bytes(blob))
+    return len(keys)
+
+
+def read_cms_codes(path: str) -> List[Tuple[str, str]]:
+    """Parse the CMS `icd10cm_codes_<year>.txt` format: code, whitespace, description."""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.strip().split(None, 1)
+            if len(parts) == 2:
+                entries.append((parts[0], parts[1]))
+    return entries
+
+
+class ICD10Index:
+    """
+    Read-only view over an index file. Exact lookups are O(1) through the hash
+    table, prefix searches are two binary searches over the sorted codes, and
+    descriptions are only decoded for the codes actually returned.
+    """
+
+    def __init__(self, path: str):
+        start = time.perf_counter()
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, count, slots, blob_size = HEADER.unpack_from(self._data[:HEADER.size].tobytes())
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not an ICD-10 index (version {VERSION})")
+
+        offset = HEADER_SIZE
+        self.codes = np.frombuffer(self._data, dtype=f"S{CODE_WIDTH}", count=count, offset=offset)
+        offset = _align(offset + count * CODE_WIDTH)
+        self.offsets = np.frombuffer(self._data, dtype="<u4", count=count + 1, offset=offset)
+        offset = _align(offset + (count + 1) * 4)
+        self.hash_table = np.frombuffer(self._data, dtype="<i4", count=slots, offset=offset)
+        offset = _align(offset + slots * 4)
+        self._blob_offset = offset
+        self._mask = slots - 1
+        self.count = count
+        self.load_ms = 1000 * (time.perf_counter() - start)
+        logger.info(f"Mapped ICD-10 index {path}: {count} codes in {self.load_ms:.1f} ms")
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _description(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self._data[self._blob_offset + start:self._blob_offset + end].tobytes().decode("utf-8")
+
+    def entry(self, i: int) -> Tuple[str, str]:
+        """(dotted code, description) of row `i` in code order."""
+        return display_code(self.codes[i].decode("ascii")), self._description(i)
+
+    def _find(self, code: str) -> int:
+        key = normalize_code(code).encode("ascii", "ignore")
+        if not key or len(key) > CODE_WIDTH:
+            return -1
+        slot = _hash(key) & self._mask
+        while True:
+            i = int(self.hash_table[slot])
+            if i == -1 or self.codes[i] == key:
+                return i
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, code: str) -> bool:
+        return self._find(code) != -1
+
+    def lookup(self, code: str) -> Optional[str]:
+        """Canonical description of `code` (dotted or not), or None if it is not in the table."""
+        i = self._find(code)
+        return self._description(i) if i != -1 else None
+
+    def search_prefix(self, prefix: str, limit: int = 20) -> List[Tuple[str, str]]:
+        """Codes starting with `prefix`, in code order, as (dotted code, description) pairs."""
+        key = normalize_code(prefix).encode("ascii", "ignore")
+        lo = int(np.searchsorted(self.codes, key, side="left"))
+        hi = int(np.searchsorted(self.codes, key + b"\xff", side="left"))
+        return [self.entry(i) for i in range(lo, min(hi, lo + limit))]
+
+    def stats(self) -> dict:
+        return {"path": self.path, "codes": self.count, "load_ms": self.load_ms}
+
+
+_index = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_icd10_index() -> Optional[ICD10Index]:
+    """The index at `config.ICD10_INDEX_PATH`, mapped on first use; None if no file is configured."""
+    global _index, _index_loaded
+    with _index_lock:
+        if not _index_loaded:
+            _index_loaded = True
+            path = config.ICD10_INDEX_PATH
+            if path and os.path.exists(path):
+                _index = ICD10Index(path)
+            else:
+                logger.warning(f"No ICD-10 index at {path}; codes will not be validated")
+    return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", required=True, help="CMS icd10cm_codes_<year>.txt file")
+    parser.add_argument("--output", default=config.ICD10_INDEX_PATH, help="Index file to write")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = build_index(read_cms_codes(args.input), args.output)
+    print(f"Wrote {count} codes to {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
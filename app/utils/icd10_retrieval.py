@@ -0,0 +1,185 @@
+"""
+BM25 candidate retrieval over ICD-10-CM descriptions.
+
+Each code of the ICD-10-CM table (app/utils/icd10_index.py) is a document made of
+its description plus any synonyms supplied at build time. BM25 weights are
+precomputed into a term-major sparse matrix (CSC-style `indptr`/`doc_ids`/`weights`
+arrays), so scoring a note is one gather over the postings of its terms and a
+`bincount`; no Python loop runs per document. Document i is row i of the code
+table, so codes and descriptions are read from there.
+
+Usage:
+    python -m app.utils.icd10_retrieval --synonyms synonyms.tsv
+    python -m app.utils.icd10_retrieval --query "right lower quadrant pain, nausea, fever"
+"""
+import argparse
+import re
+import threading
+import time
+import zipfile
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config.config import config
+from app.utils.icd10_index import ICD10Index, get_icd10_index, normalize_code
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it of on or that the to was were with without "
+    "patient patients reports denies noted presents".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def read_synonyms(path: str) -> Dict[str, List[str]]:
+    """Tab-separated `code<TAB>synonym` lines; a code may appear on several lines."""
+    synonyms: Dict[str, List[str]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            code, _, text = line.rstrip("\n").partition("\t")
+            if code and text:
+                synonyms.setdefault(normalize_code(code), []).append(text)
+    return synonyms
+
+
+def build_retrieval_index(table: ICD10Index, output_path: str, synonyms: Optional[Dict[str, List[str]]] = None) -> int:
+    """Precompute BM25 postings for every code in `table`. Returns the vocabulary size."""
+    synonyms = synonyms or {}
+    doc_terms = []
+    for i in range(len(table)):
+        code, description = table.entry(i)
+        doc_terms.append(Counter(tokenize(" ".join([description] + synonyms.get(normalize_code(code), [])))))
+
+    doc_lengths = np.array([sum(terms.values()) for terms in doc_terms], dtype=np.float32)
+    avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    for doc_id, terms in enumerate(doc_terms):
+        for term, tf in terms.items():
+            postings.setdefault(term, []).append((doc_id, tf))
+
+    vocab = sorted(postings)
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    doc_ids, weights = [], []
+    n_docs = len(doc_terms)
+    for t, term in enumerate(vocab):
+        docs = np.array([d for d, _ in postings[term]], dtype=np.int32)
+        tf = np.array([tf for _, tf in postings[term]], dtype=np.float32)
+        idf = np.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[docs] / avg_length)
+        doc_ids.append(docs)
+        weights.append((idf * tf * (BM25_K1 + 1) / (tf + norm)).astype(np.float32))
+        indptr[t + 1] = indptr[t] + len(docs)
+
+    np.savez(
+        output_path,
+        vocab=np.array(vocab),
+        indptr=indptr,
+        doc_ids=np.concatenate(doc_ids) if doc_ids else np.zeros(0, dtype=np.int32),
+        weights=np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+        n_docs=np.array([n_docs]),
+    )
+    return len(vocab)
+
+
+class ICD10Retriever:
+    """Top-k ICD-10 candidates for a note from the precomputed BM25 postings."""
+
+    def __init__(self, path: str, table: ICD10Index):
+        start = time.perf_counter()
+        with np.load(path) as data:
+            self.indptr = data["indptr"]
+            self.doc_ids = data["doc_ids"]
+            self.weights = data["weights"]
+            n_docs = int(data["n_docs"][0])
+            self.vocab = {term: i for i, term in enumerate(data["vocab"].tolist())}
+        if n_docs != len(table):
+            raise ValueError(f"{path} was built for {n_docs} codes but the code table has {len(table)}; rebuild it")
+        self.table = table
+        self.n_docs = n_docs
+        self.path = path
+        self.load_ms = 1000 * (time.perf_counter() - start)
+        logger.info(f"Loaded ICD-10 retrieval index {path}: {len(self.vocab)} terms in {self.load_ms:.1f} ms")
+
+    def search(self, text: str, k: int = 20) -> List[Tuple[str, str]]:
+        """The `k` best-scoring codes for `text`, as (dotted code, description) pairs."""
+        term_ids = {self.vocab[t] for t in tokenize(text) if t in self.vocab}
+        if not term_ids:
+            return []
+        spans = [np.arange(self.indptr[t], self.indptr[t + 1]) for t in term_ids]
+        positions = np.concatenate(spans)
+        scores = np.bincount(self.doc_ids[positions], weights=self.weights[positions], minlength=self.n_docs)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [self.table.entry(int(i)) for i in top]
+
+    def stats(self) -> dict:
+        return {"path": self.path, "terms": len(self.vocab), "load_ms": self.load_ms}
+
+
+_retriever = None
+_retriever_loaded = False
+_retriever_lock = threading.Lock()
+
+
+def get_icd10_retriever() -> Optional[ICD10Retriever]:
+    """The retriever at `config.ICD10_RETRIEVAL_INDEX_PATH`, loaded once; None if unavailable."""
+    global _retriever, _retriever_loaded
+    with _retriever_lock:
+        if not _retriever_loaded:
+            _retriever_loaded = True
+            table = get_icd10_index()
+            path = config.ICD10_RETRIEVAL_INDEX_PATH
+            try:
+                if table is not None:
+                    _retriever = ICD10Retriever(path, table)
+            except FileNotFoundError:
+                logger.warning(f"No ICD-10 retrieval index at {path}; prompts will carry no candidate codes")
+            except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile) as e:
+                # Stale (built for another code table) or corrupt: run without candidates rather than fail loading
+                logger.error(f"Could not load the ICD-10 retrieval index at {path} ({type(e).__name__}: {e}); "
+                             "prompts will carry no candidate codes")
+    return _retriever
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=config.ICD10_RETRIEVAL_INDEX_PATH, help="Retrieval index to write or read")
+    parser.add_argument("--synonyms", default=None, help="Optional code<TAB>synonym file")
+    parser.add_argument("--query", default=None, help="Search an existing index instead of building one")
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    table = get_icd10_index()
+    if table is None:
+        parser.error(f"No ICD-10 code table at {config.ICD10_INDEX_PATH}; build it with app.utils.icd10_index first")
+
+    if args.query:
+        retriever = ICD10Retriever(args.output, table)
+        start = time.perf_counter()
+        results = retriever.search(args.query, args.k)
+        print(f"{1000 * (time.perf_counter() - start):.2f} ms")
+        for code, description in results:
+            print(f"{code}\t{description}")
+        return
+
+    start = time.perf_counter()
+    synonyms = read_synonyms(args.synonyms) if args.synonyms else None
+    terms = build_retrieval_index(table, args.output, synonyms)
+    print(f"Indexed {len(table)} codes, {terms} terms into {args.output} in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Image ingestion: turn uploaded bytes into the array the vision encoder consumes.
+
+Uploads are checked against size limits from the file header alone, before any
+pixel is decoded. Decoding then goes straight to the encoder's input resolution:
+JPEG files use draft mode, so libjpeg decodes at 1/2, 1/4 or 1/8 scale, and other
+formats are shrunk with `Image.reduce` before the final resize. Grayscale images,
+which most radiographs are, stay single-channel until they are at the final size.
+The result is a uint8 HxWx3 array of a few MB, and that array is all the request
+state keeps of the upload. The work runs on a small thread pool; Pillow releases
+the GIL while decoding and resizing, so the event loop is not blocked.
+"""
+import asyncio
+import contextvars
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+
+from app.config.config import config
+from app.utils.logger import get_logger
+from app.utils.timing import record_stage
+
+logger = get_logger(__name__)
+
+# Modes that are resized as they are and only expanded to RGB at the final size
+_RESIZABLE_MODES = ("L", "RGB")
+# Side of the grayscale thumbnails compared to find near-duplicate slices
+_SIGNATURE_SIZE = 32
+
+
+class ImageRejectedError(ValueError):
+    """Raised for uploads over the configured byte or pixel limits."""
+
+
+def check_upload_size(num_bytes: Optional[int]):
+    limit = int(config.IMAGE_MAX_UPLOAD_MB * (1 << 20))
+    if num_bytes is not None and num_bytes > limit:
+        raise ImageRejectedError(f"Image is {num_bytes / (1 << 20):.1f} MB; the limit is {config.IMAGE_MAX_UPLOAD_MB:g} MB.")
+
+
+def open_image(file_bytes: bytes) -> Image.Image:
+    """Parse the header only and enforce the limits; no pixel data is decoded yet."""
+    check_upload_size(len(file_bytes))
+    try:
+        image = Image.open(io.BytesIO(file_bytes))
+    except Exception as e:
+        raise ValueError("Invalid image uploaded.") from e
+    width, height = image.size
+    if width * height > config.IMAGE_MAX_PIXELS:
+        raise ImageRejectedError(
+            f"Image is {width}x{height} ({width * height / 1e6:.1f} MP); the limit is {config.IMAGE_MAX_PIXELS / 1e6:.1f} MP."
+        )
+    return image
+
+
+def preprocess_image(file_bytes: bytes, size: Optional[int] = None) -> np.ndarray:
+    """
+    Decode an upload directly at the vision encoder's input resolution.
+
+    Args:
+        file_bytes (bytes): The uploaded file.
+        size (Optional[int]): Side of the square encoder input; defaults to `config.IMAGE_INPUT_SIZE`.
+
+    Returns:
+        np.ndarray: uint8 array of shape (size, size, 3).
+    """
+    size = size or config.IMAGE_INPUT_SIZE
+    start = time.perf_counter()
+    image = open_image(file_bytes)
+    try:
+        if image.format == "JPEG":
+            # Let libjpeg decode at the smallest scale that is still at least `size`
+            image.draft(image.mode if image.mode in _RESIZABLE_MODES else "RGB", (size, size))
+        image.load()
+        if image.mode not in _RESIZABLE_MODES:
+            image = image.convert("RGB")
+        # Cheap integer-factor box reduction first, so the filtered resize works on a small image
+        factor = min(image.size[0] // size, image.size[1] // size)
+        if factor >= 2:
+            image = image.reduce(factor)
+        if image.size != (size, size):
+            image = image.resize((size, size), Image.BICUBIC)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        array = np.asarray(image)
+    except Exception as e:
+        raise ValueError("Invalid image uploaded.") from e
+    record_stage("image_decode", time.perf_counter() - start)
+    return array
+
+
+def as_pil_image(image) -> Image.Image:
+    """Backends hand images to runtimes that expect PIL; arrays from ingestion are wrapped here."""
+    return Image.fromarray(image) if isinstance(image, np.ndarray) else image
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=config.IMAGE_PREPROCESS_WORKERS, thread_name_prefix="image")
+    return _pool
+
+
+async def ingest_image(file_bytes: bytes) -> np.ndarray:
+    """`preprocess_image` on the image thread pool, awaited from the event loop."""
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the request context so stage timings are still collected
+    return await loop.run_in_executor(_get_pool(), contextvars.copy_context().run, preprocess_image, file_bytes)
+
+
+async def ingest_images(uploads: Sequence[bytes]) -> List[np.ndarray]:
+    """Preprocess the images of a study in parallel, returning them in upload order."""
+    start = time.perf_counter()
+    images = await asyncio.gather(*(ingest_image(data) for data in uploads))
+    if len(uploads) > 1:
+        elapsed_ms = 1000 * (time.perf_counter() - start)
+        logger.info(f"Preprocessed {len(uploads)} images in {elapsed_ms:.1f} ms ({elapsed_ms / len(uploads):.1f} ms/image)")
+    return list(images)
+
+
+def _signature(image: np.ndarray) -> np.ndarray:
+    """Block-averaged grayscale thumbnail in [0, 1]."""
+    block = min(image.shape[0], image.shape[1]) // _SIGNATURE_SIZE
+    gray = image[: block * _SIGNATURE_SIZE, : block * _SIGNATURE_SIZE].mean(axis=2) / 255.0
+    return gray.reshape(_SIGNATURE_SIZE, block, _SIGNATURE_SIZE, block).mean(axis=(1, 3))
+
+
+def select_study_images(images: Sequence[np.ndarray], dedup_threshold: float, max_images: int) -> List[int]:
+    """
+    Indices of the images of a study worth sending to the model, in order.
+
+    An image whose thumbnail differs from the last kept one by less than
+    `dedup_threshold` (mean absolute intensity, 0-1) is skipped as a near-duplicate
+    slice; 0 keeps everything. If more than `max_images` remain they are subsampled
+    evenly across the series, keeping the first and last.
+    """
+    if not images:
+        return []
+    kept = [0]
+    if dedup_threshold > 0:
+        last = _signature(images[0])
+        for i in range(1, len(images)):
+            signature = _signature(images[i])
+            if np.abs(signature - last).mean() >= dedup_threshold:
+                kept.append(i)
+                last = signature
+    else:
+        kept = list(range(len(images)))
+    if len(kept) > max_images:
+        step = (len(kept) - 1) / max(max_images - 1, 1)
+        kept = [kept[round(j * step)] for j in range(max_images)]
+    return kept
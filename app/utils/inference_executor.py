@@ -0,0 +1,141 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable
+
+from app.utils.logger import get_logger
+from app.utils.timing import record_stage
+
+logger = get_logger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the executor already holds as many requests as it can admit."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a request did not finish before its deadline."""
+
+
+class InferenceExecutor:
+    """
+    Runs blocking model inference on a dedicated thread pool so the event loop
+    stays responsive, with admission control in front of it.
+
+    At most `workers` calls execute at once and at most `queue_depth` more may
+    wait for a worker. Anything beyond that is rejected immediately with
+    QueueFullError instead of piling up. Every call has a deadline covering both
+    queue wait and execution; calls whose deadline passed while still queued are
+    dropped without running.
+    """
+
+    def __init__(self, workers: int = 1, queue_depth: int = 8, timeout_s: float = 120.0):
+        self.workers = max(1, workers)
+        self.queue_depth = max(0, queue_depth)
+        self.timeout_s = timeout_s
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self._running = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.queue_depth
+
+    @property
+    def queued(self) -> int:
+        with self._lock:
+            return self._admitted - self._running
+
+    def _admit(self):
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"Inference queue is full ({self._admitted}/{self.capacity} requests admitted)."
+                )
+            self._admitted += 1
+
+    def _release(self):
+        with self._lock:
+            self._admitted -= 1
+
+    def _run(self, submitted: float, deadline: float, fn: Callable, args, kwargs):
+        now = time.monotonic()
+        record_stage("queue_wait", now - submitted)
+        if now >= deadline:
+            raise DeadlineExceededError("Request expired while waiting for an inference worker.")
+        with self._lock:
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def submit(self, fn: Callable, *args, timeout_s: float = None, **kwargs) -> Awaitable:
+        """
+        Admit `fn(*args, **kwargs)` and schedule it on an inference worker.
+
+        Admission happens immediately, so callers can reject a request before
+        committing to a response (e.g. before opening an event stream).
+
+        Returns:
+            Awaitable: Resolves to the call's result.
+
+        Raises:
+            QueueFullError: If the executor is at capacity.
+        """
+        self._admit()
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        submitted = time.monotonic()
+        deadline = submitted + timeout_s
+        try:
+            # Run in a copy of the caller's context so request-scoped state (stage timings) follows the work
+            context = contextvars.copy_context()
+            future = self._pool.submit(context.run, self._run, submitted, deadline, fn, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+        # The admission slot is held until the work actually finishes, even if the
+        # caller gave up waiting, so abandoned generations still count against capacity.
+        future.add_done_callback(lambda _: self._release())
+        return self._wait(future, timeout_s)
+
+    async def _wait(self, future: Future, timeout_s: float) -> Any:
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout_s)
+        except asyncio.TimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timed_out += 1
+            logger.warning(f"Inference call exceeded its {timeout_s:.1f}s deadline")
+            raise DeadlineExceededError(f"Inference did not finish within {timeout_s:.1f}s.")
+
+    async def run(self, fn: Callable, *args, timeout_s: float = None, **kwargs) -> Any:
+        """
+        Run `fn(*args, **kwargs)` on an inference worker and await its result.
+
+        Raises:
+            QueueFullError: If the executor is at capacity.
+            DeadlineExceededError: If the call does not finish within the deadline.
+        """
+        return await self.submit(fn, *args, timeout_s=timeout_s, **kwargs)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "running": self._running,
+                "queued": self._admitted - self._running,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
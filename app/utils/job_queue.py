@@ -0,0 +1,271 @@
+import io
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Lower runs first; interactive jobs are claimed before any queued backfill
+PRIORITIES = {"interactive": 0, "backfill": 1}
+PRIORITY_NAMES = {value: name for name, value in PRIORITIES.items()}
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue already holds its maximum of waiting jobs."""
+
+
+def encode_images(images: Optional[List[np.ndarray]]) -> Optional[bytes]:
+    if not images:
+        return None
+    buffer = io.BytesIO()
+    np.savez(buffer, *images)
+    return buffer.getvalue()
+
+
+def decode_images(blob: Optional[bytes]) -> Optional[List[np.ndarray]]:
+    if blob is None:
+        return None
+    with np.load(io.BytesIO(blob), allow_pickle=False) as arrays:
+        return [arrays[f"arr_{i}"] for i in range(len(arrays.files))]
+
+
+@dataclass(slots=True)
+class Job:
+    """A claimed job: its id, attempt number and the inputs to run it on."""
+    id: str
+    priority: str
+    task: Optional[str]
+    note: Optional[str]
+    images: Optional[List[np.ndarray]]
+    study: Optional[dict]
+    attempts: int
+    created_at: float
+
+
+class JobQueue:
+    """
+    Durable queue of analysis jobs in a SQLite file.
+
+    Jobs are claimed in priority order, then oldest first. A claimed job holds a
+    lease of `lease_s`; if its worker dies, the job goes back to the queue once the
+    lease runs out (or fails, if that was its last attempt), so nothing is lost
+    across restarts. Failed attempts are retried up to `max_attempts` times with
+    exponential backoff. Finished jobs and their results are kept for
+    `result_ttl_s`, then deleted. Several processes may share one file; claims run
+    in an immediate transaction, so a job is only ever handed to one worker.
+    """
+
+    def __init__(self, path: str, max_queued: int = 1000, max_attempts: int = 3, retry_backoff_s: float = 5.0,
+                 lease_s: float = 960.0, result_ttl_s: float = 86400.0):
+        self.path = path
+        self.max_queued = max_queued
+        self.max_attempts = max(1, max_attempts)
+        self.retry_backoff_s = retry_backoff_s
+        self.lease_s = lease_s
+        self.result_ttl_s = result_ttl_s
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.retried = 0
+        self.lease_expired = 0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, priority INTEGER NOT NULL, status TEXT NOT NULL, task TEXT, note TEXT,"
+            " images BLOB, study TEXT, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL,"
+            " run_after REAL NOT NULL, started_at REAL, lease_expires_at REAL, finished_at REAL,"
+            " expires_at REAL, result TEXT, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority, created_at)")
+        counts = dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        purged = self.purge()
+        logger.info(f"Opened job queue at {path} ({counts.get('queued', 0)} queued, "
+                    f"{counts.get('running', 0)} running, purged {purged} expired)")
+
+    def submit(self, task: Optional[str], note: Optional[str], images: Optional[List[np.ndarray]] = None,
+               study: Optional[dict] = None, priority: str = "interactive") -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        images_blob = encode_images(images)
+        with self._lock:
+            queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                self.rejected += 1
+                raise JobQueueFullError(f"Job queue is full ({queued}/{self.max_queued} jobs waiting).")
+            self._db.execute(
+                "INSERT INTO jobs (id, priority, status, task, note, images, study, created_at, run_after)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, PRIORITIES[priority], task, note, images_blob,
+                 json.dumps(study) if study else None, now, now),
+            )
+            self.submitted += 1
+        return job_id
+
+    def claim(self) -> Optional[Job]:
+        """Take the next runnable job, or None when there is none."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._reclaim_expired(now)
+                row = self._db.execute(
+                    "SELECT id, priority, task, note, images, study, attempts, created_at FROM jobs"
+                    " WHERE status = 'queued' AND run_after <= ? ORDER BY priority, created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1,"
+                        " started_at = COALESCE(started_at, ?), lease_expires_at = ? WHERE id = ?",
+                        (now, now + self.lease_s, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        job_id, priority, task, note, images, study, attempts, created_at = row
+        return Job(id=job_id, priority=PRIORITY_NAMES[priority], task=task, note=note,
+                   images=decode_images(images), study=json.loads(study) if study else None,
+                   attempts=attempts + 1, created_at=created_at)
+
+    def _reclaim_expired(self, now: float):
+        # Jobs whose worker went away: retried like any failed attempt
+        expired = self._db.execute(
+            "SELECT id, attempts FROM jobs WHERE status = 'running' AND lease_expires_at < ?", (now,)
+        ).fetchall()
+        for job_id, attempts in expired:
+            self.lease_expired += 1
+            logger.warning(f"Lease of job {job_id} expired on attempt {attempts}")
+            self._finish_attempt(job_id, attempts, "Worker stopped before finishing the job.", retry=True, now=now)
+
+    def complete(self, job_id: str, result: dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'succeeded', result = ?, error = NULL, images = NULL,"
+                " lease_expires_at = NULL, finished_at = ?, expires_at = ? WHERE id = ? AND status = 'running'",
+                (json.dumps(result), now, now + self.result_ttl_s, job_id),
+            )
+
+    def fail(self, job_id: str, error: str, retry: bool) -> str:
+        """Record a failed attempt; retried later if `retry` and attempts remain. Returns the job's new status."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT attempts FROM jobs WHERE id = ? AND status = 'running'",
+                                   (job_id,)).fetchone()
+            if row is None:
+                return "unknown"
+            return self._finish_attempt(job_id, row[0], error, retry, now)
+
+    def _finish_attempt(self, job_id: str, attempts: int, error: str, retry: bool, now: float) -> str:
+        if retry and attempts < self.max_attempts:
+            self.retried += 1
+            delay = self.retry_backoff_s * 2 ** (attempts - 1)
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', error = ?, lease_expires_at = NULL, run_after = ? WHERE id = ?",
+                (error, now + delay, job_id),
+            )
+            return "queued"
+        self._db.execute(
+            "UPDATE jobs SET status = 'failed', error = ?, images = NULL, lease_expires_at = NULL,"
+            " finished_at = ?, expires_at = ? WHERE id = ?",
+            (error, now, now + self.result_ttl_s, job_id),
+        )
+        return "failed"
+
+    def release(self, job_id: str, delay_s: float = 0.0):
+        """Put a claimed job back without counting the attempt, e.g. when inference is saturated or shutting down."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, lease_expires_at = NULL, run_after = ?"
+                " WHERE id = ? AND status = 'running'",
+                (time.time() + delay_s, job_id),
+            )
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started running. Returns whether it was cancelled."""
+        now = time.time()
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', images = NULL, finished_at = ?, expires_at = ?"
+                " WHERE id = ? AND status = 'queued'",
+                (now, now + self.result_ttl_s, job_id),
+            ).rowcount > 0
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Status of a job, with its result once it succeeded; None if unknown or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, priority, status, task, attempts, created_at, started_at, finished_at, expires_at,"
+                " result, error FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None or (row[8] is not None and row[8] < now):
+            return None
+        job_id, priority, status, task, attempts, created_at, started_at, finished_at, expires_at, result, error = row
+        return {
+            "job_id": job_id,
+            "status": status,
+            "priority": PRIORITY_NAMES[priority],
+            "task": task,
+            "attempts": attempts,
+            "max_attempts": self.max_attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "expires_at": expires_at,
+            "age_s": now - created_at,
+            "queue_wait_s": (started_at or now) - created_at,
+            "error": error,
+            "result": json.loads(result) if result else None,
+        }
+
+    def purge(self) -> int:
+        """Delete finished jobs whose results expired. Returns how many were deleted."""
+        with self._lock:
+            return self._db.execute("DELETE FROM jobs WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def depth(self) -> Dict[str, dict]:
+        """Per priority: jobs waiting (including backoff before a retry), running, and age of the oldest waiting."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT priority, status, COUNT(*), MIN(created_at) FROM jobs"
+                " WHERE status IN ('queued', 'running') GROUP BY priority, status"
+            ).fetchall()
+        depth = {name: {"queued": 0, "running": 0, "oldest_queued_age_s": 0.0} for name in PRIORITIES}
+        for priority, status, count, oldest in rows:
+            entry = depth[PRIORITY_NAMES[priority]]
+            entry[status] = count
+            if status == "queued":
+                entry["oldest_queued_age_s"] = now - oldest
+        return depth
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled')"
+                " GROUP BY status"
+            ).fetchall())
+        return {
+            "depth": self.depth(),
+            "finished": {status: finished.get(status, 0) for status in FINISHED},
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "retried": self.retried,
+            "lease_expired": self.lease_expired,
+        }
@@ -0,0 +1,340 @@
+import re
+import typing
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Longest whitespace run accepted between JSON tokens, so a constrained model
+# cannot spend its token budget on indentation
+MAX_WHITESPACE_RUN = 32
+_WHITESPACE = " \t\n\r"
+_HEX_DIGITS = "0123456789abcdefABCDEF"
+_BYTE_TOKEN = re.compile(r"^<0x([0-9A-Fa-f]{2})>$")
+_CONTROL_TOKEN = re.compile(r"^<[^<>\s]+>$")
+
+
+class OutputSchema:
+    """
+    The JSON shape an agent must produce: an object with string fields in a fixed
+    order (nullable ones may also be `null`), an array of such objects, or an array
+    of plain strings (`fields` None). Built from the Pydantic response models, so
+    the schema and the API types cannot drift.
+    """
+
+    def __init__(self, name: str, fields: Optional[List[Tuple[str, bool]]], array: bool = False):
+        if fields is None and not array:
+            raise ValueError("A schema without fields must be an array of strings")
+        self.name = name
+        self.fields = fields
+        self.array = array
+
+    @classmethod
+    def string_array(cls, name: str) -> "OutputSchema":
+        return cls(name, None, array=True)
+
+    @classmethod
+    def from_model(cls, model_cls, array: bool = False, exclude: Tuple[str, ...] = ()) -> "OutputSchema":
+        """`exclude` names fields the service fills in itself, which the model must not write."""
+        fields = []
+        for field_name, field in model_cls.model_fields.items():
+            if field_name in exclude:
+                continue
+            args = typing.get_args(field.annotation)
+            nullable = type(None) in args
+            base = [a for a in args if a is not type(None)] or [field.annotation]
+            if base != [str]:
+                raise ValueError(f"{model_cls.__name__}.{field_name}: only str fields can be constrained")
+            fields.append((field_name, nullable))
+        return cls(model_cls.__name__, fields, array)
+
+    def json_schema(self) -> dict:
+        """Equivalent JSON Schema, for runtimes with their own grammar support (llama.cpp)."""
+        if self.fields is None:
+            return {"type": "array", "items": {"type": "string"}}
+        item = {
+            "type": "object",
+            "properties": {
+                name: {"type": ["string", "null"]} if nullable else {"type": "string"}
+                for name, nullable in self.fields
+            },
+            "required": [name for name, _ in self.fields],
+            "additionalProperties": False,
+        }
+        return {"type": "array", "items": item} if self.array else item
+
+    def matcher(self) -> "JSONMatcher":
+        return JSONMatcher(self)
+
+    def constraint(self, tokenizer) -> "TokenConstraint":
+        return TokenConstraint(self.matcher(), token_strings(tokenizer))
+
+
+class JSONMatcher:
+    """
+    Character-level pushdown automaton accepting exactly the JSON values of an
+    `OutputSchema`. `feed` returns False, and leaves the state untouched, for a
+    character that cannot continue a valid document; `complete` turns True the
+    moment the top-level value closes.
+    """
+
+    def __init__(self, schema: OutputSchema, stack: list = None, whitespace_run: int = 0):
+        self.schema = schema
+        # Frames are tuples so cloning is a shallow list copy
+        self.stack = stack if stack is not None else [("value", "array" if schema.array else "object", False)]
+        self.whitespace_run = whitespace_run
+
+    @property
+    def complete(self) -> bool:
+        return not self.stack
+
+    def clone(self) -> "JSONMatcher":
+        return JSONMatcher(self.schema, list(self.stack), self.whitespace_run)
+
+    def feed_text(self, text: str) -> bool:
+        """Feed several characters; on the first rejected one the matcher is left unchanged."""
+        trial = self.clone()
+        for ch in text:
+            if not trial._feed(ch):
+                return False
+        self.stack, self.whitespace_run = trial.stack, trial.whitespace_run
+        return True
+
+    def feed(self, ch: str) -> bool:
+        return self.feed_text(ch)
+
+    def _whitespace(self, ch: str) -> bool:
+        if ch not in _WHITESPACE or self.whitespace_run >= MAX_WHITESPACE_RUN:
+            return False
+        self.whitespace_run += 1
+        return True
+
+    def _feed(self, ch: str) -> bool:
+        if not self.stack:
+            return self._whitespace(ch)
+        frame = self.stack[-1]
+        kind = frame[0]
+        if kind in ("string", "literal", "key"):
+            self.whitespace_run = 0
+
+        if kind == "string":
+            return self._feed_string(ch, frame[1])
+
+        if kind == "literal":
+            if ch != frame[1][0]:
+                return False
+            if len(frame[1]) == 1:
+                self.stack.pop()
+            else:
+                self.stack[-1] = ("literal", frame[1][1:])
+            return True
+
+        if kind == "key":
+            _, key, pos = frame
+            if pos < len(key):
+                if ch != key[pos]:
+                    return False
+                self.stack[-1] = ("key", key, pos + 1)
+            elif ch == '"':
+                self.stack[-1] = ("colon",)
+            else:
+                return False
+            return True
+
+        if ch in _WHITESPACE:
+            return self._whitespace(ch)
+        self.whitespace_run = 0
+
+        if kind == "value":
+            _, node, nullable = frame
+            if nullable and ch == "n":
+                self.stack[-1] = ("literal", "ull")
+            elif node == "string" and ch == '"':
+                self.stack[-1] = ("string", 0)
+            elif node == "object" and ch == "{":
+                self.stack[-1] = ("object", 0, "open")
+            elif node == "array" and ch == "[":
+                self.stack[-1] = ("array", "first")
+            else:
+                return False
+            return True
+
+        if kind == "colon":
+            if ch != ":":
+                return False
+            # The enclosing object frame already points at this field
+            _, index, _ = self.stack[-2]
+            self.stack[-1] = ("value", "string", self.schema.fields[index][1])
+            return True
+
+        if kind == "object":
+            _, index, phase = frame
+            last = len(self.schema.fields) - 1
+            if phase == "open" and last < 0:
+                if ch != "}":
+                    return False
+                self.stack.pop()
+            elif phase in ("open", "comma"):
+                if ch != '"':
+                    return False
+                self.stack[-1] = ("object", index, "after_value")
+                self.stack.append(("key", self.schema.fields[index][0], 0))
+            elif ch == "," and index < last:
+                self.stack[-1] = ("object", index + 1, "comma")
+            elif ch == "}" and index == last:
+                self.stack.pop()
+            else:
+                return False
+            return True
+
+        if kind == "array":
+            phase = frame[1]
+            if ch == "]" and phase in ("first", "after_item"):
+                self.stack.pop()
+                return True
+            if phase == "after_item":
+                if ch != ",":
+                    return False
+                self.stack[-1] = ("array", "next")
+                return True
+            self.stack[-1] = ("array", "after_item")
+            self.stack.append(("value", "string" if self.schema.fields is None else "object", False))
+            return self._feed(ch)
+
+        return False
+
+    def _feed_string(self, ch: str, escape: int) -> bool:
+        if escape == 0:
+            if ch == '"':
+                self.stack.pop()
+            elif ch == "\\":
+                self.stack[-1] = ("string", 1)
+            elif ord(ch) < 0x20:
+                return False
+            return True
+        if escape == 1:
+            if ch == "u":
+                self.stack[-1] = ("string", 2)
+            elif ch in '"\\/bfnrt':
+                self.stack[-1] = ("string", 0)
+            else:
+                return False
+            return True
+        # escape 2..5: the four hex digits of \uXXXX
+        if ch not in _HEX_DIGITS:
+            return False
+        self.stack[-1] = ("string", 0 if escape == 5 else escape + 1)
+        return True
+
+
+_token_strings: Dict[int, "TokenStrings"] = {}
+
+
+class TokenStrings:
+    """Lazily decoded text of each vocabulary entry; None for special/control tokens."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.special_ids = set(getattr(tokenizer, "all_special_ids", []) or [])
+        self._cache: Dict[int, Optional[str]] = {}
+
+    def __getitem__(self, token_id: int) -> Optional[str]:
+        if token_id not in self._cache:
+            self._cache[token_id] = self._decode(token_id)
+        return self._cache[token_id]
+
+    def _decode(self, token_id: int) -> Optional[str]:
+        if token_id in self.special_ids:
+            return None
+        piece = self.tokenizer.convert_ids_to_tokens(token_id)
+        if piece is None:
+            return None
+        byte = _BYTE_TOKEN.match(piece)
+        if byte:
+            value = int(byte.group(1), 16)
+            # A lone byte of a multi-byte character only makes sense inside a string
+            return chr(value) if value < 0x80 else "�"
+        if _CONTROL_TOKEN.match(piece):
+            return None
+        return piece.replace("▁", " ")
+
+
+def token_strings(tokenizer) -> TokenStrings:
+    key = id(tokenizer)
+    if key not in _token_strings:
+        _token_strings[key] = TokenStrings(tokenizer)
+    return _token_strings[key]
+
+
+class TokenConstraint:
+    """
+    Greedy constrained token selection. Instead of building a full-vocabulary mask
+    every step, the candidates are checked in logit order, starting with the top
+    `top_k`, and the first one whose text keeps the document valid is taken; the
+    whole vocabulary is only scanned when none of those fits.
+    """
+
+    def __init__(self, matcher: JSONMatcher, strings: TokenStrings, top_k: int = 32):
+        self.matcher = matcher
+        self.strings = strings
+        self.top_k = top_k
+        self.full_scans = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.matcher.complete
+
+    def _accept(self, token_id: int) -> bool:
+        text = self.strings[token_id]
+        return bool(text) and self.matcher.feed_text(text)
+
+    def select(self, logits) -> Optional[int]:
+        """
+        Pick the most likely valid token from a 1-D logits array (mlx) and advance
+        the matcher past it. Returns None when no token can continue the document.
+        """
+        import mlx.core as mx
+
+        k = min(self.top_k, logits.shape[-1])
+        top = mx.argpartition(-logits, kth=k - 1)[:k]
+        order = mx.argsort(-logits[top])
+        for token_id in top[order].tolist():
+            if self._accept(token_id):
+                return token_id
+
+        self.full_scans += 1
+        for token_id in mx.argsort(-logits).tolist()[k:]:
+            if self._accept(token_id):
+                return token_id
+        return None
+
+
+class JSONStopper:
+    """
+    Watches free-running output (e.g. a vision generation that cannot be masked)
+    and reports where the first complete value of `schema` ends, so generation can
+    stop there. Text before the value starts, such as a markdown fence, is skipped;
+    once the output stops matching the schema it never reports an end.
+    """
+
+    def __init__(self, schema: OutputSchema):
+        self.schema = schema
+        self.matcher: Optional[JSONMatcher] = None
+        self.failed = False
+
+    def feed(self, chunk: str) -> Optional[int]:
+        """Returns the offset in `chunk` just past the end of the value, if it closed in this chunk."""
+        for offset, ch in enumerate(chunk):
+            if self.failed:
+                return None
+            if self.matcher is None:
+                if ch not in "[{":
+                    continue
+                self.matcher = self.schema.matcher()
+            if not self.matcher.feed(ch):
+                self.failed = True
+                return None
+            if self.matcher.complete:
+                return offset + 1
+        return None
@@ -0,0 +1,119 @@
+"""
+Model lifecycle: load the inference backend and build the agents in the background,
+warm them up, then report ready.
+
+The server starts answering as soon as it is imported; importing the graph, agent
+and runtime modules, loading the weights and warming up all happen on a background
+thread started from the FastAPI lifespan. `/healthz` only says the process is
+alive, `/readyz` says the model is loaded and warm, and the API answers 503 with
+Retry-After until then.
+"""
+import threading
+import time
+from typing import Optional
+
+from app.config.config import config
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Process start, as close to interpreter startup as this module gets imported (app.main imports it first)
+PROCESS_START = time.monotonic()
+
+
+class NotReadyError(Exception):
+    """Raised when a request needs the model before it is loaded and warm."""
+
+
+class Pipeline:
+    def __init__(self, agents: dict, graph):
+        self.agents = agents
+        self.graph = graph
+
+
+class ModelLifecycle:
+    """starting -> loading -> warming -> ready, or failed (with the error) if loading raised."""
+
+    def __init__(self):
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.pipeline: Optional[Pipeline] = None
+        # Seconds since PROCESS_START at which each phase finished
+        self.milestones = {}
+        self.warmup_s = {}
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Load in the background; returns immediately. Calling it again does nothing."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.milestones["started"] = time.monotonic() - PROCESS_START
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        try:
+            self.state = "loading"
+            start = time.monotonic()
+            # Imported here: the graph, agents and model runtime are the slow imports
+            from app.graph.graph_builder import build_agents, build_graph
+
+            agents = build_agents()
+            graph = build_graph(agents)
+            self.milestones["loaded"] = time.monotonic() - PROCESS_START
+            logger.info(f"Loaded model and agents in {time.monotonic() - start:.1f}s")
+
+            if config.WARMUP_ENABLED:
+                self.state = "warming"
+                self.warmup(agents)
+            self.milestones["ready"] = time.monotonic() - PROCESS_START
+            self.pipeline = Pipeline(agents, graph)
+            self.state = "ready"
+            self._ready.set()
+            logger.info(f"Ready {self.milestones['ready']:.1f}s after process start ({self.milestones})")
+        except Exception as e:
+            self.state = "failed"
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"Model loading failed: {self.error}")
+
+    def warmup(self, agents: dict):
+        """Run each agent once on a tiny canned input, so the first request does not pay for kernel compilation."""
+        for name, agent in agents.items():
+            start = time.monotonic()
+            try:
+                agent.warmup()
+            except Exception as e:
+                # A cold agent is slow on its first request, not broken
+                logger.warning(f"Warmup of {name} failed: {e}")
+            self.warmup_s[name] = time.monotonic() - start
+            logger.info(f"Warmed up {name} in {self.warmup_s[name]:.2f}s")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout_s: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout_s)
+
+    def require(self) -> Pipeline:
+        """The loaded agents and graph; raises NotReadyError while loading or after a failed load."""
+        if self.pipeline is None:
+            if self.state == "failed":
+                raise NotReadyError(f"Model failed to load: {self.error}")
+            raise NotReadyError(f"Model is not ready yet ({self.state}).")
+        return self.pipeline
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "uptime_s": time.monotonic() - PROCESS_START,
+            "milestones_s": dict(self.milestones),
+            "warmup_s": dict(self.warmup_s),
+        }
+
+
+model_lifecycle = ModelLifecycle()
@@ -0,0 +1,151 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from app.backends.base import PromptSession
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class SessionLimitError(Exception):
+    """Raised when a new live session would exceed the concurrent session limit."""
+
+
+class LiveSession:
+    """
+    One live encounter: the backend prompt session holding the transcript so far
+    (and, on backends that support it, its KV cache), plus the last generated SOAP
+    note. `dirty` is set when transcript arrives after that note was generated.
+    Appends and refreshes of one session are serialized through `lock`.
+    """
+
+    def __init__(self, prompt: PromptSession):
+        self.id = uuid.uuid4().hex
+        self.prompt = prompt
+        self.lock = threading.Lock()
+        self.segments = 0
+        self.transcript_chars = 0
+        self.result: Optional[dict] = None
+        self.dirty = False
+        self.refreshes = 0
+        self.created_at = time.time()
+        self.last_used = self.created_at
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.id,
+            "segments": self.segments,
+            "transcript_chars": self.transcript_chars,
+            "kv_bytes": self.prompt.kv_bytes,
+            "refreshes": self.refreshes,
+            "stale": self.dirty or self.result is None,
+            "idle_s": time.time() - self.last_used,
+        }
+
+
+class LiveSessionStore:
+    """
+    Live sessions in least-recently-used order.
+
+    At most `max_sessions` are open at once; creating another raises
+    SessionLimitError. KV caches are bounded separately: when the sessions hold
+    more than `max_kv_bytes` together, the least recently used idle ones release
+    their caches (the transcript and last note are kept, and the cache is rebuilt
+    on their next append or refresh). Sessions idle for `ttl_s` are closed.
+    """
+
+    def __init__(self, max_sessions: int = 16, max_kv_bytes: int = 2 << 30, ttl_s: float = 1800):
+        self.max_sessions = max_sessions
+        self.max_kv_bytes = max_kv_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, LiveSession]" = OrderedDict()
+        self.created = 0
+        self.rejected = 0
+        self.expired = 0
+        self.kv_evictions = 0
+
+    def _expire(self, now: float):
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_used > self.ttl_s:
+                del self._sessions[session_id]
+                session.prompt.release()
+                self.expired += 1
+                logger.info(f"Closed live session {session_id} after {now - session.last_used:.0f}s idle")
+
+    def create(self, prompt: PromptSession) -> LiveSession:
+        session = LiveSession(prompt)
+        with self._lock:
+            self._expire(time.time())
+            if len(self._sessions) >= self.max_sessions:
+                self.rejected += 1
+                raise SessionLimitError(f"Too many live sessions (limit {self.max_sessions}).")
+            self._sessions[session.id] = session
+            self.created += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = now
+                self._sessions.move_to_end(session_id)
+        return session
+
+    def close(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        with session.lock:
+            session.prompt.release()
+        return True
+
+    def kv_bytes(self) -> int:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return sum(s.prompt.kv_bytes for s in sessions)
+
+    def enforce_memory(self):
+        """Release KV caches, least recently used first, until the total fits `max_kv_bytes`."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+        total = sum(s.prompt.kv_bytes for s in sessions)
+        for session in sessions:
+            if total <= self.max_kv_bytes:
+                break
+            size = session.prompt.kv_bytes
+            # Sessions busy appending or generating are skipped rather than waited for
+            if not size or not session.lock.acquire(blocking=False):
+                continue
+            try:
+                session.prompt.release()
+            finally:
+                session.lock.release()
+            total -= size
+            with self._lock:
+                self.kv_evictions += 1
+            logger.info(f"Released KV cache of live session {session.id} ({size} bytes)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            counters = {
+                "created": self.created,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "kv_evictions": self.kv_evictions,
+            }
+        return {
+            "open": len(sessions),
+            "max_sessions": self.max_sessions,
+            "kv_bytes": sum(s.prompt.kv_bytes for s in sessions),
+            "max_kv_bytes": self.max_kv_bytes,
+            **counters,
+            "sessions": [s.info() for s in sessions],
+        }
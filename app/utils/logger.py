@@ -1,11 +1,57 @@
+import atexit
 import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from app.config.config import config
+
+# Records are handed to a listener thread that does the (possibly slow) writing, so a
+# blocked stderr or log file never stalls a request. When the queue is full, records
+# are dropped and counted instead of waiting.
+_handler = None
+_handler_lock = threading.Lock()
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _queue_handler() -> DroppingQueueHandler:
+    global _handler
+    with _handler_lock:
+        if _handler is None:
+            formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(name)s - %(message)s")
+            outputs = [logging.StreamHandler()]
+            if config.LOG_FILE:
+                outputs.append(logging.FileHandler(config.LOG_FILE))
+            for output in outputs:
+                output.setFormatter(formatter)
+            log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+            listener = QueueListener(log_queue, *outputs)
+            listener.start()
+            # Write out whatever is still queued when the process exits
+            atexit.register(listener.stop)
+            _handler = DroppingQueueHandler(log_queue)
+    return _handler
+
 
 def get_logger(name: str = "app"):
     logger = logging.getLogger(name)
     if not logger.handlers:
-        logger.setLevel(logging.INFO)
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter("[%(asctime)s] %(levelname)s - %(name)s - %(message)s")
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-    return logger
\ No newline at end of file
+        logger.setLevel(config.LOG_LEVEL)
+        logger.addHandler(_queue_handler())
+    return logger
+
+
+def logging_stats() -> dict:
+    handler = _queue_handler()
+    return {"level": config.LOG_LEVEL, "queued": handler.queue.qsize(), "dropped": handler.dropped}
@@ -0,0 +1,222 @@
+"""
+Prometheus metrics without a client library.
+
+A small registry of counters, histograms and callback gauges rendered in the
+Prometheus text exposition format (version 0.0.4) by `GET /metrics`. Requests are
+instrumented once, at the end, from the `StageTimings` collected while they ran
+(app/utils/timing.py), so the hot path only appends to a per-request list; the
+registry itself is touched a handful of times per request.
+"""
+import bisect
+import threading
+from typing import Callable, Dict, List, Sequence, Tuple, Union
+
+from app.utils.timing import StageTimings
+
+# Seconds; covers sub-millisecond parsing up to multi-minute generations
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500, 1000)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, value: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _format_value(bound)
+                labels = _format_labels(self.labels + ("le",), label_values + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    A gauge read from a callback at scrape time, e.g. the current queue depth. With
+    labels, the callback returns a dict from label value tuples to values.
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Union[float, Dict[tuple, float]]],
+                 labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.labels = tuple(labels)
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if not self.labels:
+            return lines + [f"{self.name} {_format_value(value)}"]
+        for label_values, sample in sorted(value.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(sample)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Re-registering (e.g. on module reload) keeps the first instance
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, fn: Callable, labels: Sequence[str] = ()) -> Gauge:
+        with self._lock:
+            self._metrics[name] = Gauge(name, help, fn, labels)
+            return self._metrics[name]
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status")
+)
+http_request_seconds = registry.histogram(
+    "http_request_duration_seconds", "End-to-end HTTP request latency.", ("route",)
+)
+stage_seconds = registry.histogram(
+    "medgemma_stage_duration_seconds", "Time spent per pipeline stage and request.", ("stage",)
+)
+tokens = registry.counter("medgemma_tokens_total", "Prompt, generated and cache-served tokens.", ("agent", "kind"))
+generation_tps = registry.histogram(
+    "medgemma_generation_tokens_per_second", "Decode throughput per request.", ("agent",), THROUGHPUT_BUCKETS
+)
+agent_errors = registry.counter("medgemma_agent_errors_total", "Requests that ended in an error, by agent.", ("agent",))
+
+# StageTimings counters exported as token totals, and their `kind` label
+TOKEN_COUNTERS = {"prompt_tokens": "prompt", "generation_tokens": "generation", "cached_tokens": "cached"}
+
+
+jobs_finished = registry.counter(
+    "medgemma_jobs_total", "Jobs run to completion, by priority and final status.", ("priority", "status")
+)
+job_attempts = registry.counter(
+    "medgemma_job_attempts_total", "Job attempts, by priority and outcome (succeeded, failed, retried).",
+    ("priority", "outcome")
+)
+job_queue_wait_seconds = registry.histogram(
+    "medgemma_job_queue_wait_seconds", "Time from job submission to its first attempt.", ("priority",)
+)
+job_run_seconds = registry.histogram(
+    "medgemma_job_run_seconds", "Duration of one job attempt on a worker.", ("priority",)
+)
+
+
+def observe_request(route: str, method: str, status: int, elapsed_s: float, timings: StageTimings):
+    """Fold one finished request's timings into the registry."""
+    http_requests.inc(route, method, str(status))
+    http_request_seconds.observe(elapsed_s, route)
+    observe_stages(timings, failed=status >= 500)
+
+
+def observe_job(priority: str, outcome: str, attempt: int, queue_wait_s: float, elapsed_s: float,
+                timings: StageTimings):
+    """Fold one finished job attempt into the registry; `outcome` is succeeded, failed or retried."""
+    job_attempts.inc(priority, outcome)
+    if attempt == 1:
+        job_queue_wait_seconds.observe(queue_wait_s, priority)
+    job_run_seconds.observe(elapsed_s, priority)
+    if outcome != "retried":
+        jobs_finished.inc(priority, outcome)
+    observe_stages(timings, failed=outcome != "succeeded")
+
+
+def observe_stages(timings: StageTimings, failed: bool = False):
+    """Stage latencies, token counts and errors of one request or job attempt."""
+    for name, samples in timings.stages.items():
+        stage_seconds.observe(sum(samples), name)
+
+    agent = timings.tags.get("agent")
+    if agent is None:
+        return
+    for counter, kind in TOKEN_COUNTERS.items():
+        if timings.counters.get(counter):
+            tokens.inc(agent, kind, value=timings.counters[counter])
+    decode_s = timings.total("decode")
+    if decode_s > 0 and timings.counters.get("generation_tokens"):
+        generation_tps.observe(timings.counters["generation_tokens"] / decode_s, agent)
+    if timings.tags.get("outcome") == "error" or failed:
+        agent_errors.inc(agent)
+
+
+def server_timing_header(timings: StageTimings, elapsed_s: float) -> str:
+    """`Server-Timing` value with the per-stage totals collected so far, in milliseconds."""
+    parts = [f"{name};dur={1000 * sum(samples):.1f}" for name, samples in timings.stages.items()]
+    parts.append(f"total;dur={1000 * elapsed_s:.1f}")
+    return ", ".join(parts)
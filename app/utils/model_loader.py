@@ -1,3 +1,5 @@
+import time
+
 from mlx_vlm import load
 from mlx_vlm.utils import load_config
 from app.config.config import config
@@ -13,8 +15,11 @@ def load_medgemma_model():
     global _model, _processor, _config
 
     if _model is None or _processor is None:
-        logger.info("[INFO] Loading {config.MODEL_ID}...")
+        logger.info(f"Loading {config.MODEL_ID}...")
+        start = time.monotonic()
+        # mlx_vlm maps the safetensors lazily; weights are paged in as they are first used
         _model, _processor = load(config.MODEL_ID)
         _config = load_config(config.MODEL_ID)
+        logger.info(f"Loaded {config.MODEL_ID} in {time.monotonic() - start:.1f}s")
 
     return _model, _processor, _config
@@ -1,24 +1,442 @@
-from mlx_lm import generate
+import time
+from typing import Iterator, List, Optional
+from PIL import Image
+import mlx.core as mx
+from mlx_vlm import generate, stream_generate
+from mlx_vlm.models.cache import make_prompt_cache
+from mlx_vlm.prompt_utils import apply_chat_template
+from app.backends.base import DEFAULT_MAX_TOKENS, GenerationOutput, PromptSession
+from app.config.config import config as app_config
 from app.utils.logger import get_logger
+from app.utils.helper import image_pixel_hash
+from app.utils.image_ingest import as_pil_image
+from app.utils.json_constraint import JSONStopper, OutputSchema, TokenConstraint
+from app.utils.prefix_cache import clone_prompt_cache, prefix_cache, PREFIX_MARKER
+from app.utils.prompt_builder import PROMPT_PREFIXES
+from app.utils.timing import stage, record_stage, record_count
+from app.utils.vision_cache import image_keys
 
 logger = get_logger(__name__)
 
-def generate_response(model, processor, formatted_prompt, image):
+PREFILL_STEP_SIZE = 2048
+
+
+def format_prompt(processor, config, prompt: str, num_images: int = 0) -> str:
+    """
+    Apply the model's chat template to a prompt.
+
+    Args:
+        processor: The processor for the model.
+        config: The model config returned by `load_medgemma_model`.
+        prompt (str): The prompt text.
+        num_images (int): Number of images that accompany the prompt. With 0 no
+            image tokens are inserted and the request stays text-only.
+
+    Returns:
+        str: The formatted prompt.
+    """
+    with stage("template"):
+        return apply_chat_template(processor, config, prompt, num_images=num_images)
+
+
+def _tokenizer(processor):
+    return processor.tokenizer if hasattr(processor, "tokenizer") else processor
+
+
+def encode_prompt(processor, formatted_prompt: str) -> List[int]:
+    # The chat template already starts with <bos>
+    return _tokenizer(processor).encode(formatted_prompt, add_special_tokens=False)
+
+
+def _stop_token_ids(processor) -> set:
+    tokenizer = _tokenizer(processor)
+    stop_ids = set()
+    eos = getattr(tokenizer, "eos_token_id", None)
+    if isinstance(eos, (list, tuple, set)):
+        stop_ids.update(eos)
+    elif eos is not None:
+        stop_ids.add(eos)
+    end_of_turn = tokenizer.convert_tokens_to_ids("<end_of_turn>")
+    if end_of_turn is not None and end_of_turn != getattr(tokenizer, "unk_token_id", None):
+        stop_ids.add(end_of_turn)
+    return stop_ids
+
+
+def _logits(output):
+    return getattr(output, "logits", output)
+
+
+def _select_token(logits, constraint: Optional[TokenConstraint]) -> Optional[int]:
+    """Greedy choice for a (1, vocab) logits row, restricted to valid JSON when constrained."""
+    if constraint is None:
+        return mx.argmax(logits, axis=-1).item()
+    return constraint.select(logits[0])
+
+
+def make_constraint(processor, schema: Optional[OutputSchema]) -> Optional[TokenConstraint]:
+    if schema is None:
+        return None
+    constraint = schema.constraint(_tokenizer(processor))
+    constraint.top_k = app_config.CONSTRAINED_TOP_K
+    return constraint
+
+
+def warm_prefix(model, processor, config, name: str):
+    """
+    Precompute the KV cache of the fixed instruction block of prompt `name`
+    (a key of `PROMPT_PREFIXES`), as it appears after the chat template.
+    """
+    if not app_config.PREFIX_CACHE_ENABLED or name in prefix_cache:
+        return
+    formatted = format_prompt(processor, config, PROMPT_PREFIXES[name] + PREFIX_MARKER)
+    prefix_text = formatted[: formatted.index(PREFIX_MARKER)]
+    prefix_cache.warm(name, model, encode_prompt(processor, prefix_text))
+
+
+def _prefill(language_model, prompt_cache, token_ids: List[int]):
+    """Extend `prompt_cache` by `token_ids`, in steps of PREFILL_STEP_SIZE, discarding the logits."""
+    for start in range(0, len(token_ids), PREFILL_STEP_SIZE):
+        language_model(mx.array([token_ids[start:start + PREFILL_STEP_SIZE]]), cache=prompt_cache)
+        mx.eval([c.state for c in prompt_cache])
+
+
+def _generate_tokens(model, processor, input_ids: List[int], prompt_cache, cached_tokens: int,
+                     max_tokens: int, timings: dict, constraint: Optional[TokenConstraint] = None) -> Iterator[int]:
+    """
+    Greedy decode loop shared by `generate_text` and `stream_text`. Yields token ids
+    until a stop token or `max_tokens`, recording prefill/decode seconds in `timings`.
+    With a `constraint`, only tokens that keep the output valid JSON for its schema
+    are chosen and decoding stops as soon as the top-level value closes.
+    """
+    language_model = model.language_model
+    if prompt_cache is None:
+        prompt_cache, cached_tokens = make_prompt_cache(language_model), 0
+
+    start = time.perf_counter()
+    remaining = input_ids[cached_tokens:]
+    split = len(remaining) - 1 - (len(remaining) - 1) % PREFILL_STEP_SIZE
+    _prefill(language_model, prompt_cache, remaining[:split])
+    remaining = remaining[split:]
+    logits = _logits(language_model(mx.array([remaining]), cache=prompt_cache))[:, -1, :]
+    token_id = _select_token(logits, constraint)
+    timings["prefill_s"] = time.perf_counter() - start
+    record_stage("prefill", timings["prefill_s"])
+
+    stop_ids = _stop_token_ids(processor)
+    generated = 0
+    start = time.perf_counter()
+    while generated < max_tokens:
+        if token_id is None or token_id in stop_ids:
+            break
+        generated += 1
+        yield token_id
+        if constraint is not None and constraint.complete:
+            break
+        logits = _logits(language_model(mx.array([[token_id]]), cache=prompt_cache))[:, -1, :]
+        token_id = _select_token(logits, constraint)
+    timings["decode_s"] = time.perf_counter() - start
+    record_stage("decode", timings["decode_s"])
+
+
+def generate_text(model, processor, input_ids: List[int], prompt_cache=None, cached_tokens: int = 0,
+                  max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> GenerationOutput:
+    """
+    Greedy text-only generation that can start from an existing prompt cache.
+
+    Args:
+        model: The loaded MedGemma model.
+        processor: The processor for the model.
+        input_ids (List[int]): Token ids of the full formatted prompt.
+        prompt_cache: KV cache already holding the first `cached_tokens` prompt tokens.
+        cached_tokens (int): How many prompt tokens `prompt_cache` covers.
+        max_tokens (int): Maximum number of tokens to generate.
+        schema (Optional[OutputSchema]): Constrain the output to JSON of this shape.
+
+    Returns:
+        GenerationOutput: The generated text along with token counts and throughput.
+    """
+    if prompt_cache is None:
+        cached_tokens = 0
+    timings = {}
+    constraint = make_constraint(processor, schema)
+    tokens = list(_generate_tokens(
+        model, processor, input_ids, prompt_cache, cached_tokens, max_tokens, timings, constraint
+    ))
+
+    prefilled = len(input_ids) - cached_tokens
+    return GenerationOutput(
+        text=_tokenizer(processor).decode(tokens),
+        prompt_tokens=len(input_ids),
+        generation_tokens=len(tokens),
+        prompt_tps=prefilled / timings["prefill_s"] if timings.get("prefill_s") else 0.0,
+        generation_tps=len(tokens) / timings["decode_s"] if timings.get("decode_s") else 0.0,
+        cached_tokens=cached_tokens,
+    )
+
+
+def stream_text(model, processor, input_ids: List[int], prompt_cache=None, cached_tokens: int = 0,
+                max_tokens: int = DEFAULT_MAX_TOKENS, schema: Optional[OutputSchema] = None) -> Iterator[str]:
+    """
+    Like `generate_text`, but yields decoded text segments as tokens are produced.
+    """
+    if prompt_cache is None:
+        cached_tokens = 0
+    tokenizer = _tokenizer(processor)
+    tokens, emitted = [], ""
+    constraint = make_constraint(processor, schema)
+    for token_id in _generate_tokens(
+        model, processor, input_ids, prompt_cache, cached_tokens, max_tokens, {}, constraint
+    ):
+        tokens.append(token_id)
+        text = tokenizer.decode(tokens)
+        # Hold back partial multi-byte characters until the next token completes them
+        if text.endswith("\ufffd"):
+            continue
+        if len(text) > len(emitted):
+            yield text[len(emitted):]
+            emitted = text
+
+
+def _generate_with_images(model, processor, formatted_prompt: str, images: List[Image.Image],
+                          schema: Optional[OutputSchema], **kwargs):
+    """
+    mlx_vlm generation for prompts with images. The vision path cannot be masked
+    token by token, so with a `schema` the output is watched instead and generation
+    stops as soon as the JSON value closes.
+    """
+    if schema is None:
+        return generate(model, processor, formatted_prompt, images, **kwargs)
+
+    stopper, text, last = JSONStopper(schema), "", None
+    for chunk in stream_generate(model, processor, formatted_prompt, images, **kwargs):
+        last = chunk
+        end = stopper.feed(chunk.text)
+        if end is not None:
+            text += chunk.text[:end]
+            break
+        text += chunk.text
+    if last is None:
+        # Nothing was generated (e.g. max_tokens=0)
+        return GenerationOutput(text="", prompt_tokens=0, generation_tokens=0, prompt_tps=0.0, generation_tps=0.0)
+    last.text = text
+    return last
+
+
+def generate_response(model, processor, config, prompt: str, images: Optional[List[Image.Image]] = None,
+                      prefix_key: Optional[str] = None, schema: Optional[OutputSchema] = None,
+                      **kwargs) -> GenerationOutput:
     """
     Generate response using the MedGemma model.
+
+    Text-only requests (no images) skip the vision tower entirely: no placeholder
+    image is created and the chat template carries no image tokens. When
+    `prefix_key` names a warmed prompt prefix, its KV cache is reused and only the
+    rest of the prompt is prefilled.
     
     Args:
         model: The loaded MedGemma model.
         processor: The processor for the model.
-        messages: The input messages for the model.
+        config: The model config returned by `load_medgemma_model`.
+        prompt (str): The prompt text, before the chat template is applied.
+        images (Optional[List[Image.Image]]): Images to condition on, if any.
+        prefix_key (Optional[str]): Key of the prompt's fixed prefix in `PROMPT_PREFIXES`.
+        schema (Optional[OutputSchema]): JSON shape the output must follow. Text-only
+            generation is constrained to it and stops once the value closes.
+        **kwargs: Extra generation arguments such as `max_tokens`.
     
     Returns:
-        str: The generated response.
+        GenerationOutput: The generated text along with token counts and throughput.
     """
-    logger.info("Generating response with prompt: %s", formatted_prompt)
-    response = generate(model, processor, formatted_prompt, image)
-    logger.info("Model outputs: %s", response)
+    images = [img for img in (images or []) if img is not None]
+    # Pixel hashes let the vision tower reuse cached embeddings of images it has seen
+    keys = [image_pixel_hash(img) for img in images] if app_config.VISION_CACHE_ENABLED else []
+    images = [as_pil_image(img) for img in images]
+    formatted_prompt = format_prompt(processor, config, prompt, num_images=len(images))
+
+    if not images and app_config.GENERATION_BATCHING:
+        # Imported here because the scheduler builds on the helpers in this module
+        from app.utils.generation_scheduler import get_generation_scheduler
+
+        scheduler = get_generation_scheduler(
+            model, processor, app_config.BATCH_MAX_SIZE, app_config.BATCH_MAX_WAIT_MS
+        )
+        input_ids = encode_prompt(processor, formatted_prompt)
+        response = scheduler.submit(
+            input_ids, kwargs.get("max_tokens", DEFAULT_MAX_TOKENS), prefix_key, schema
+        )
+    elif not images and (app_config.PREFIX_CACHE_ENABLED or schema is not None):
+        input_ids = encode_prompt(processor, formatted_prompt)
+        prompt_cache, cached_tokens = (
+            prefix_cache.lookup(prefix_key, input_ids) if app_config.PREFIX_CACHE_ENABLED else (None, 0)
+        )
+        response = generate_text(model, processor, input_ids, prompt_cache, cached_tokens, schema=schema, **kwargs)
+    else:
+        # Image prompts place the image tokens before the text, so there is no shared prefix to reuse
+        with image_keys(keys):
+            result = _generate_with_images(model, processor, formatted_prompt, images or None, schema, **kwargs)
+        response = GenerationOutput(
+            text=result.text,
+            prompt_tokens=result.prompt_tokens,
+            generation_tokens=result.generation_tokens,
+            prompt_tps=result.prompt_tps,
+            generation_tps=result.generation_tps,
+        )
+        # mlx_vlm only reports throughput, so derive the stage durations from it
+        if result.prompt_tps:
+            record_stage("prefill", result.prompt_tokens / result.prompt_tps)
+        if result.generation_tps:
+            record_stage("decode", result.generation_tokens / result.generation_tps)
+
+    record_count("prompt_tokens", response.prompt_tokens)
+    record_count("generation_tokens", response.generation_tokens)
+    record_count("cached_tokens", response.cached_tokens)
+    logger.info(
+        "Generated %d tokens from %d prompt tokens (%d cached, %d images)",
+        response.generation_tokens, response.prompt_tokens, response.cached_tokens, len(images),
+    )
     return response
 
 
+def generate_responses(model, processor, config, prompts: List[str], prefix_key: Optional[str] = None,
+                       schema: Optional[OutputSchema] = None,
+                       max_tokens: int = DEFAULT_MAX_TOKENS) -> List[GenerationOutput]:
+    """
+    Generate several text-only prompts together, e.g. the chunks of one long note.
+
+    With GENERATION_BATCHING the prompts are handed to the scheduler as one group,
+    so they are collected into the same batches. Otherwise they run as batches of
+    up to BATCH_MAX_SIZE on the calling thread, the inference worker that admitted
+    the request. Prompts too long to batch (see `split_batch`) fall back to the
+    single-sequence path either way.
+
+    Returns:
+        List[GenerationOutput]: One result per prompt, in order.
+    """
+    # Imported here because the scheduler builds on the helpers in this module
+    from app.utils.generation_scheduler import GenerationRequest, generate_together, get_generation_scheduler
+
+    requests = [
+        GenerationRequest(input_ids=encode_prompt(processor, format_prompt(processor, config, prompt)),
+                          max_tokens=max_tokens, prefix_key=prefix_key, schema=schema)
+        for prompt in prompts
+    ]
+    if app_config.GENERATION_BATCHING:
+        scheduler = get_generation_scheduler(
+            model, processor, app_config.BATCH_MAX_SIZE, app_config.BATCH_MAX_WAIT_MS
+        )
+        responses = scheduler.submit_many(requests)
+    else:
+        responses = generate_together(model, processor, requests, app_config.BATCH_MAX_SIZE)
+
+    for response in responses:
+        record_count("prompt_tokens", response.prompt_tokens)
+        record_count("generation_tokens", response.generation_tokens)
+        record_count("cached_tokens", response.cached_tokens)
+    logger.info(
+        "Generated %d tokens from %d prompts of %d tokens in total",
+        sum(r.generation_tokens for r in responses), len(responses), sum(r.prompt_tokens for r in responses),
+    )
+    return responses
+
+
+def stream_response(model, processor, config, prompt: str, images: Optional[List[Image.Image]] = None,
+                    prefix_key: Optional[str] = None, max_tokens: int = DEFAULT_MAX_TOKENS,
+                    schema: Optional[OutputSchema] = None) -> Iterator[str]:
+    """
+    Streaming counterpart of `generate_response`: yields text segments as they are
+    decoded. Streams always run as a single sequence, outside the batching scheduler.
+    """
+    images = [img for img in (images or []) if img is not None]
+    # Pixel hashes let the vision tower reuse cached embeddings of images it has seen
+    keys = [image_pixel_hash(img) for img in images] if app_config.VISION_CACHE_ENABLED else []
+    images = [as_pil_image(img) for img in images]
+    formatted_prompt = format_prompt(processor, config, prompt, num_images=len(images))
+
+    if images:
+        stopper = JSONStopper(schema) if schema is not None else None
+        with image_keys(keys):
+            for chunk in stream_generate(model, processor, formatted_prompt, images, max_tokens=max_tokens):
+                end = stopper.feed(chunk.text) if stopper is not None else None
+                if end is not None:
+                    yield chunk.text[:end]
+                    return
+                yield chunk.text
+        return
+
+    input_ids = encode_prompt(processor, formatted_prompt)
+    prompt_cache, cached_tokens = (
+        prefix_cache.lookup(prefix_key, input_ids) if app_config.PREFIX_CACHE_ENABLED else (None, 0)
+    )
+    yield from stream_text(model, processor, input_ids, prompt_cache, cached_tokens, max_tokens, schema)
+
+
+class KVPromptSession(PromptSession):
+    """
+    Appendable prompt backed by its own KV cache. The cache covers the chat
+    template's opening, the prompt and everything appended so far; `append`
+    prefills only the new text, and `generate` runs on a copy of the cache so the
+    suffix, the end-of-turn markers and the reply are the only tokens prefilled per
+    call. After `release` the cache is rebuilt from the text on next use.
+    """
+
+    def __init__(self, model, processor, config, prompt: str, prefix_key: Optional[str] = None):
+        super().__init__(None, prompt, prefix_key)
+        self.model = model
+        self.processor = processor
+        # The chat template wraps the prompt; the part after it is added back on every generate
+        formatted = format_prompt(processor, config, PREFIX_MARKER)
+        self._template_head, self._template_tail = formatted.split(PREFIX_MARKER)
+        self.input_ids: List[int] = []
+        self.prompt_cache = None
+        self.rebuilds = 0
+
+    def _encode(self, text: str) -> List[int]:
+        return encode_prompt(self.processor, text)
+
+    def _ensure_cache(self):
+        if self.prompt_cache is not None:
+            return
+        input_ids = self._encode(self._template_head + self.prompt)
+        prompt_cache, cached_tokens = (
+            prefix_cache.lookup(self.prefix_key, input_ids) if app_config.PREFIX_CACHE_ENABLED else (None, 0)
+        )
+        if prompt_cache is None:
+            prompt_cache, cached_tokens = make_prompt_cache(self.model.language_model), 0
+        start = time.perf_counter()
+        _prefill(self.model.language_model, prompt_cache, input_ids[cached_tokens:])
+        record_stage("prefill", time.perf_counter() - start)
+        if self.input_ids:
+            self.rebuilds += 1
+        self.input_ids, self.prompt_cache = input_ids, prompt_cache
+
+    def append(self, text: str):
+        self._ensure_cache()
+        # Encoded on its own: appended text starts a new line, which the tokenizer never merges across
+        new_ids = self._encode(text)
+        start = time.perf_counter()
+        _prefill(self.model.language_model, self.prompt_cache, new_ids)
+        record_stage("prefill", time.perf_counter() - start)
+        self.input_ids.extend(new_ids)
+        self.prompt += text
+
+    def generate(self, suffix: str, max_tokens: int = DEFAULT_MAX_TOKENS,
+                 schema: Optional[OutputSchema] = None) -> GenerationOutput:
+        self._ensure_cache()
+        input_ids = self.input_ids + self._encode(suffix + self._template_tail)
+        response = generate_text(
+            self.model, self.processor, input_ids, clone_prompt_cache(self.prompt_cache), len(self.input_ids),
+            max_tokens=max_tokens, schema=schema,
+        )
+        record_count("prompt_tokens", response.prompt_tokens)
+        record_count("generation_tokens", response.generation_tokens)
+        record_count("cached_tokens", response.cached_tokens)
+        return response
+
+    @property
+    def kv_bytes(self) -> int:
+        if self.prompt_cache is None:
+            return 0
+        return sum(a.nbytes for c in self.prompt_cache for a in c.state)
 
+    def release(self):
+        self.prompt_cache = None
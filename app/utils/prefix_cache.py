@@ -0,0 +1,119 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import mlx.core as mx
+from mlx_vlm.models.cache import make_prompt_cache
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Splits a formatted prompt at the end of the instruction block. Never reaches the model.
+PREFIX_MARKER = "<<PREFIX_END>>"
+
+
+def clone_prompt_cache(prompt_cache: List) -> List:
+    """
+    Copy a prompt cache so generation can extend it without touching the original.
+
+    MLX arrays are immutable buffers, so the copy only creates new array handles;
+    the prefix keys/values are shared until a layer writes past them.
+    """
+    cloned = []
+    for layer_cache in prompt_cache:
+        new_cache = layer_cache.__class__.__new__(layer_cache.__class__)
+        new_cache.state = tuple(mx.array(a) for a in layer_cache.state)
+        new_cache.meta_state = layer_cache.meta_state
+        cloned.append(new_cache)
+    return cloned
+
+
+def common_prefix_length(a: List[int], b: List[int]) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PrefixCache:
+    """
+    KV caches for the fixed instruction block at the start of each agent prompt.
+
+    Each agent warms its prefix once at startup. At request time the prompt's
+    token ids are matched against the stored prefix ids; on a hit the request
+    starts from a copy of the stored cache and only the variable suffix is
+    prefilled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[List[int], List]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.prefill_tokens_saved = 0
+        self.prefill_tokens_total = 0
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def warm(self, name: str, model, prefix_ids: List[int]):
+        """Prefill `prefix_ids` once and store the resulting KV cache under `name`."""
+        with self._lock:
+            if name in self._entries:
+                return
+        prompt_cache = make_prompt_cache(model.language_model)
+        model.language_model(mx.array([prefix_ids]), cache=prompt_cache)
+        mx.eval([c.state for c in prompt_cache])
+        with self._lock:
+            self._entries.setdefault(name, (list(prefix_ids), prompt_cache))
+        logger.info(f"Warmed prompt prefix cache '{name}' with {len(prefix_ids)} tokens")
+
+    def lookup(self, name: Optional[str], input_ids: List[int]) -> Tuple[Optional[List], int]:
+        """
+        Find a reusable cache for a prompt.
+
+        Returns:
+            Tuple[Optional[List], int]: A private copy of the prefix cache and the number
+            of leading prompt tokens it already covers, or (None, 0) on a miss.
+        """
+        entry = self._entries.get(name) if name else None
+        reused = 0
+        prompt_cache = None
+        if entry is not None:
+            prefix_ids, stored = entry
+            # Tokenization can merge across the prefix boundary; reuse what still matches
+            # and always leave at least one token to prefill so there are logits to sample.
+            reused = min(common_prefix_length(prefix_ids, input_ids), len(input_ids) - 1)
+            if reused > 0:
+                prompt_cache = clone_prompt_cache(stored)
+                trim = len(prefix_ids) - reused
+                if trim and not all(c.is_trimmable() for c in prompt_cache):
+                    prompt_cache, reused = None, 0
+                elif trim:
+                    for c in prompt_cache:
+                        c.trim(trim)
+
+        with self._lock:
+            self.prefill_tokens_total += len(input_ids)
+            if prompt_cache is not None:
+                self.hits += 1
+                self.prefill_tokens_saved += reused
+            else:
+                self.misses += 1
+        return prompt_cache, reused
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": {name: len(ids) for name, (ids, _) in self._entries.items()},
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "prefill_tokens_saved": self.prefill_tokens_saved,
+                "prefill_tokens_total": self.prefill_tokens_total,
+            }
+
+
+prefix_cache = PrefixCache()
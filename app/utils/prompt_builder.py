@@ -1,25 +1,18 @@
-from PIL import Image
-import numpy as np
-from typing import Optional, List, Any
-from mlx_vlm.prompt_utils import apply_chat_template
+import hashlib
+from pathlib import Path
+from typing import Optional, List, Any, Tuple
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
-def build_router_prompt(note: Optional[str], image: Optional[Image]) -> List:
-    """
-    Builds the prompt for the RouterAgent based on the provided note and image.
-    
-    Args:
-        note (Optional[str]): The clinical note to analyze.
-        image (Optional[Image]): The image to analyze.
-    
-    Returns:
-        List: A list of messages formatted for the model input.
-    """
-    logger.info(f"Building router prompt with note: {note} and image: {image}")
-    image = Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8)) if image is None else image
-    prompt = f"""
+# Changes whenever anything in this module changes, so cached results produced
+# with older prompts are never served.
+PROMPT_VERSION = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
+# Fixed instruction blocks. Each prompt starts with its block and ends with the
+# per-request input, so the block's KV cache can be computed once and reused
+# (see app/utils/prefix_cache.py). Keep anything request-specific out of them.
+ROUTER_INSTRUCTIONS = """
         You are a medical routing agent. Your task is to analyze the provided imputs
         and determine the appropriate next step for processing the input. 
         If there is a textual input, it can be a clinical note or a transcript.
@@ -35,25 +28,9 @@ def build_router_prompt(note: Optional[str], image: Optional[Image]) -> List:
         ONLY respond with one of: "icd10", "soap", "image_analysis.
         
         Here is the input you need to analyze:
-        text: {note}
-        image: {image if image else "No image provided"}"""
-
-    return prompt
-
+"""
 
-
-def build_icd10_prompt(clinical_note: str, image: Optional[Image]) -> list:
-    """
-    Builds the prompt for the ICD-10 coding agent based on the clinical note.
-    
-    Args:
-        clinical_note (str): The clinical note to analyze.
-    
-    Returns:
-        list: A list of messages formatted for the model input.
-    """
-    image = Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8)) if image is None else image
-    prompt = f"""
+ICD10_INSTRUCTIONS = """
     You are an expert clinical coder. Extract ICD-10 codes from the note below.
 
     Instructions:
@@ -67,28 +44,34 @@ def build_icd10_prompt(clinical_note: str, image: Optional[Image]) -> list:
 
     Example:
     [
-    {{"code": "K35.80", "description": "Acute appendicitis, unspecified"}},
-    {{"code": "R10.9", "description": "Abdominal pain, unspecified"}},
-    {{"code": "R11.0", "description": "Nausea"}}
+    {"code": "K35.80", "description": "Acute appendicitis, unspecified"},
+    {"code": "R10.9", "description": "Abdominal pain, unspecified"},
+    {"code": "R11.0", "description": "Nausea"}
     ]
 
     Clinical note:
-    {clinical_note}
-    Image: {image if image else "No image provided"}
-    """
-    return prompt
+"""
 
-def build_image_analyzer_prompt(image: Image, question: str = None) -> list:
-    """
-    Builds the prompt for the image analyzer agent based on the provided image.
-    
-    Args:
-        image (Image): The image to analyze.
-    
-    Returns:
-        list: A list of messages formatted for the model input.
-    """
-    prompt = f"""
+# Compact variant (ICD10_COMPACT_OUTPUT): codes only, descriptions are filled in
+# from the local ICD-10-CM table, which saves most of the decode tokens.
+ICD10_COMPACT_INSTRUCTIONS = """
+    You are an expert clinical coder. Extract ICD-10-CM codes from the note below.
+
+    Instructions:
+    - Focus on disease, symptom, and condition codes (A00–R99)
+    - Avoid administrative or encounter codes (Z00–Z99) unless clinically significant
+    - Extract codes from "Diagnosis" and "History & Symptoms" sections
+    - Use the most specific valid code and include each code only once
+    - Return ONLY a JSON array of code strings, without descriptions
+    - If unsure, omit rather than guessing
+
+    Example:
+    ["K35.80", "R10.9", "R11.0"]
+
+    Clinical note:
+"""
+
+IMAGE_ANALYZER_INSTRUCTIONS = """
         You are an expert radiologist and you are provided with an image of a medical condition.
         Analyze the image and provide a detailed description of the findings,
         including any abnormalities or notable features. If the user provides any question about the image,
@@ -113,25 +96,10 @@ def build_image_analyzer_prompt(image: Image, question: str = None) -> list:
         "recommendations": "Clinical correlation recommended.",
         "answer_to_user_question": "The image shows no signs of acute stroke."
     
-    Here is the image you need to analyze:
-        {image if image else "No image provided."}
-        Question: {question if question else "No specific question provided."}
+    Analyze the attached image.
+"""
 
-    """
-    return prompt
-
-def build_soap_generator_prompt(transcript: str, image: Optional[Image]) -> list:
-    """
-    Builds the prompt for the SOAP note generator agent based on the clinical note.
-    
-    Args:
-        transcript (str): The transcript to analyze.
-    
-    Returns:
-        list: A list of messages formatted for the model input.
-    """
-    image = Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8)) if image is None else image
-    prompt = f"""
+SOAP_INSTRUCTIONS = """
     You are a clinical documentation assistant. Your task is to read medical 
     transcripts (dialogues between clinicians and patients) and convert them 
     into structured clinical notes using the SOAP format.
@@ -167,12 +135,12 @@ def build_soap_generator_prompt(transcript: str, image: Optional[Image]) -> list
 
     You shoud return a JSON object with exactly the following fields:
 
-    {{
+    {
     "Subjective": "...",
     "Objective": "...",
     "Assessment": "...",
     "Plan": "..."
-    }}
+    }
 
     Each field should contain a concise summary relevant to that section.
 
@@ -181,8 +149,145 @@ def build_soap_generator_prompt(transcript: str, image: Optional[Image]) -> list
     Here is the transcript from a medical record file from which you will be
     asked to extract relevant SOAP information:
 
-    {transcript}
-    Image: {image if image else "No image provided."}
+"""
+
+# Single-pass routing and generation (FUSED_ROUTING): the label comes first so
+# the router can read it, and the task output follows in the same generation.
+FUSED_INSTRUCTIONS = """
+    You are a clinical documentation assistant. The input below is either a clinical
+    note or a transcript of a conversation between a clinician and a patient.
+
+    On the first line write ONLY one label:
+    - "soap" if the input is a transcript or a dialogue between two parties
+    - "icd10" if the input is a clinical note
+
+    Then, starting on the next line, write the output for that label.
+
+    For "icd10": a JSON array of ICD-10 codes found in the note, each an object with
+    "code" and "description". Focus on disease, symptom and condition codes (A00–R99),
+    avoid Z codes unless clinically significant, include each code once and omit
+    codes you are unsure about.
+
+    For "soap": a JSON object with exactly the fields "Subjective", "Objective",
+    "Assessment" and "Plan", each a concise bullet-point summary of that section.
+    Do not invent information not found in the transcript.
+
+    After the label return ONLY valid JSON with double quotes, no markdown or extra text.
+
+    Example for a clinical note:
+    icd10
+    [{"code": "K35.80", "description": "Acute appendicitis, unspecified"}]
+
+    Input:
+"""
 
+PROMPT_PREFIXES = {
+    "router": ROUTER_INSTRUCTIONS,
+    "icd10": ICD10_INSTRUCTIONS,
+    "icd10_compact": ICD10_COMPACT_INSTRUCTIONS,
+    "image_analysis": IMAGE_ANALYZER_INSTRUCTIONS,
+    "soap": SOAP_INSTRUCTIONS,
+    "fused": FUSED_INSTRUCTIONS,
+}
+
+def build_router_prompt(note: Optional[str], has_image: bool = False) -> str:
+    """
+    Builds the prompt for the RouterAgent based on the provided note and image.
+
+    The image itself is passed to the model separately; the prompt only says
+    whether one is attached.
+    
+    Args:
+        note (Optional[str]): The clinical note to analyze.
+        has_image (bool): Whether an image accompanies the note.
+    
+    Returns:
+        str: The prompt text, before the chat template is applied.
+    """
+    logger.debug("Building router prompt for a note of %d chars, image attached: %s", len(note or ""), has_image)
+    prompt = ROUTER_INSTRUCTIONS + f"""        text: {note}
+        image: {"attached" if has_image else "No image provided"}"""
+
+    return prompt
+
+
+
+def build_icd10_prompt(clinical_note: str, compact: bool = False,
+                       candidates: Optional[List[Tuple[str, str]]] = None) -> str:
+    """
+    Builds the prompt for the ICD-10 coding agent based on the clinical note.
+
+    Retrieved candidate codes go after the note, so the instruction block stays a
+    shared prefix.
+    
+    Args:
+        clinical_note (str): The clinical note to analyze.
+        compact (bool): Ask for code identifiers only, without descriptions.
+        candidates (Optional[List[Tuple[str, str]]]): (code, description) pairs
+            retrieved for this note, listed for the model to choose from.
+    
+    Returns:
+        str: The prompt text, before the chat template is applied.
+    """
+    instructions = ICD10_COMPACT_INSTRUCTIONS if compact else ICD10_INSTRUCTIONS
+    prompt = instructions + f"""    {clinical_note}
+    """
+    if candidates:
+        listed = "\n".join(f"    {i}. {code} {description}" for i, (code, description) in enumerate(candidates, 1))
+        prompt += f"""
+    Candidate codes retrieved for this note (prefer these when they fit, but they may be incomplete):
+{listed}
+    """
+    return prompt
+
+def build_image_analyzer_prompt(question: str = None, num_images: int = 1) -> str:
+    """
+    Builds the prompt for the image analyzer agent. The images are passed to the
+    model separately and referenced through the chat template's image tokens.
+    
+    Args:
+        question (str): Optional question about the image.
+        num_images (int): Number of images in the study; several get one consolidated report.
+    
+    Returns:
+        str: The prompt text, before the chat template is applied.
     """
-    return prompt
\ No newline at end of file
+    prompt = IMAGE_ANALYZER_INSTRUCTIONS
+    if num_images > 1:
+        prompt += f"""        The {num_images} attached images are views or slices of one study, in acquisition order.
+        Write a single consolidated report covering all of them.
+"""
+    prompt += f"""        Question: {question if question else "No specific question provided."}
+
+    """
+    return prompt
+
+def build_soap_generator_prompt(transcript: str) -> str:
+    """
+    Builds the prompt for the SOAP note generator agent based on the clinical note.
+    
+    Args:
+        transcript (str): The transcript to analyze.
+    
+    Returns:
+        str: The prompt text, before the chat template is applied.
+    """
+    prompt = SOAP_INSTRUCTIONS + f"""    {transcript}
+
+    """
+    return prompt
+
+def build_fused_prompt(note: str) -> str:
+    """
+    Builds the single-pass prompt that asks for the task label followed by the task output.
+    
+    Args:
+        note (str): The clinical note or transcript.
+    
+    Returns:
+        str: The prompt text, before the chat template is applied.
+    """
+    prompt = FUSED_INSTRUCTIONS + f"""    {note}
+
+    """
+    return prompt
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def make_cache_key(fingerprint: str, namespace: str) -> str:
+    return hashlib.sha256(f"{namespace}\x00{fingerprint}".encode("utf-8")).hexdigest()
+
+
+def settings_version(settings: dict, paths=()) -> str:
+    """
+    Short hash of settings that change results and of data files they depend on;
+    files are identified by size and modification time, missing ones as such.
+    """
+    files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            files[path] = [stat.st_size, stat.st_mtime_ns]
+        except (OSError, TypeError):
+            files[path] = None
+    payload = json.dumps({"settings": settings, "files": files}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    Two-level cache of analysis responses.
+
+    Level one is an in-process LRU bounded by entry count and TTL. Level two is an
+    optional SQLite file that survives restarts and is shared by workers on the
+    same host. Entries are stored under a namespace built from the model ID and
+    the prompt version; on startup rows from any other namespace are deleted, so
+    changing the model or a prompt invalidates the store without manual cleanup.
+    """
+
+    def __init__(self, namespace: str, max_entries: int = 1024, ttl_s: float = 3600,
+                 sqlite_path: Optional[str] = None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, namespace TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            purged = self._db.execute(
+                "DELETE FROM results WHERE namespace != ? OR expires_at < ?", (namespace, time.time())
+            ).rowcount
+            logger.info(f"Opened result cache at {sqlite_path} (purged {purged} stale entries)")
+
+    def key(self, fingerprint: str) -> str:
+        return make_cache_key(fingerprint, self.namespace)
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM results WHERE key = ? AND namespace = ?",
+                    (key, self.namespace),
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: dict):
+        expires_at = time.time() + self.ttl_s
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, namespace, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, self.namespace, json.dumps(value), expires_at),
+                )
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def invalidate(self) -> int:
+        """Drop every cached result, in memory and on disk. Returns how many were dropped."""
+        with self._lock:
+            dropped = len(self._memory)
+            self._memory.clear()
+            if self._db is not None:
+                dropped = max(dropped, self._db.execute("DELETE FROM results").rowcount)
+        logger.info(f"Invalidated result cache ({dropped} entries)")
+        return dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "namespace": self.namespace,
+                "entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "persistent": self._db is not None,
+            }
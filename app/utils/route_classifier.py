@@ -0,0 +1,106 @@
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+TASKS = ("icd10", "soap", "image_analysis")
+
+# Lines like "Doctor: ...", "Pt: ...", "[Patient] ...", "Speaker 2: ..."
+SPEAKER_TURN_RE = re.compile(
+    r"^\s*\[?(doctor|dr\.?|physician|clinician|provider|nurse|patient|pt|parent|mother|father|"
+    r"speaker\s*\d+|interviewer)\]?\s*[:\]\-]",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Clinical note section headers ("Chief Complaint:", "Diagnosis:", "Assessment/Plan:", ...)
+SECTION_HEADER_RE = re.compile(
+    r"^\s*(chief complaint|history of present illness|hpi|history( & symptoms| and symptoms)?|"
+    r"past medical history|physical exam(ination)?|review of systems|assessment( and plan| & plan|/plan)?|"
+    r"(admission |discharge )?diagnos[ie]s|impression|plan|subjective|objective|(discharge )?medications|labs?|vitals|"
+    r"hospital course|procedures?|discharge (condition|instructions)|follow[- ]up)\s*:",
+    re.IGNORECASE | re.MULTILINE,
+)
+QUESTION_RE = re.compile(r"\?\s*$|^\s*(what|is|are|does|do|can|could|should|how|which|any)\b", re.IGNORECASE)
+
+# An image with at most this much text is treated as an image question, not a note
+SHORT_IMAGE_NOTE_CHARS = 300
+MIN_SPEAKER_TURNS = 2
+MIN_SECTION_HEADERS = 2
+
+
+@dataclass
+class RouteDecision:
+    task: Optional[str]
+    tier: str
+    features: dict = field(default_factory=dict)
+
+
+class RoutingStats:
+    """Counts which tier made each routing decision, to track the LLM fallback rate."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, tier: str):
+        with self._lock:
+            self._counts[tier] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+        return {
+            "decisions": counts,
+            "total": total,
+            # Fused decisions are made by the model too, just without a separate pass
+            "llm_fallback_rate": (counts.get("llm", 0) + counts.get("fused", 0)) / total if total else 0.0,
+        }
+
+
+routing_stats = RoutingStats()
+
+
+def extract_route_features(note: Optional[str], has_image: bool) -> dict:
+    text = note or ""
+    return {
+        "has_image": has_image,
+        "note_chars": len(text.strip()),
+        "speaker_turns": len(SPEAKER_TURN_RE.findall(text)),
+        "section_headers": len(SECTION_HEADER_RE.findall(text)),
+        "is_question": bool(QUESTION_RE.search(text.strip())) if text.strip() else False,
+    }
+
+
+def classify_route(note: Optional[str], has_image: bool) -> RouteDecision:
+    """
+    Cheap rule-based routing that only commits to a task when the input is unambiguous.
+
+    Args:
+        note (Optional[str]): The note, transcript or question sent with the request.
+        has_image (bool): Whether an image was uploaded.
+
+    Returns:
+        RouteDecision: `task` is None when the classifier is not confident and the
+        LLM router should decide.
+    """
+    f = extract_route_features(note, has_image)
+
+    if has_image:
+        if f["note_chars"] <= SHORT_IMAGE_NOTE_CHARS or (f["is_question"] and f["section_headers"] == 0):
+            return RouteDecision("image_analysis", "heuristic", f)
+        return RouteDecision(None, "heuristic", f)
+
+    if f["note_chars"] == 0:
+        return RouteDecision(None, "heuristic", f)
+
+    if f["speaker_turns"] >= MIN_SPEAKER_TURNS and f["speaker_turns"] > f["section_headers"]:
+        return RouteDecision("soap", "heuristic", f)
+    if f["section_headers"] >= MIN_SECTION_HEADERS and f["speaker_turns"] == 0:
+        return RouteDecision("icd10", "heuristic", f)
+
+    return RouteDecision(None, "heuristic", f)
@@ -0,0 +1,120 @@
+import json
+from typing import Any, List, Tuple
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class IncrementalJSONParser:
+    """
+    Pulls complete items out of a JSON document while it is still being generated.
+
+    Feed it text chunks as they arrive. Anything before the first `[` or `{` (such
+    as a markdown fence) is skipped. For a top-level array, every element is
+    emitted as soon as it closes, e.g. each ICD-10 code object, or each code
+    string in compact output. For a top-level
+    object, every `key: value` pair is emitted as soon as its value closes, e.g.
+    each SOAP section or radiology report field.
+
+    `feed` returns a list of `("item", value)` or `("field", (key, value))`
+    tuples. Items that fail to parse are skipped; the full output still goes
+    through `clean_json_response` once generation finishes.
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._root = None          # "[" or "{" once the document starts
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._item_start = None    # buffer index where the current element/pair starts
+        self._finished = False
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        events = []
+        for ch in chunk:
+            if self._finished:
+                break
+            if self._root is None:
+                if ch in "[{":
+                    self._root = ch
+                    self._depth = 1
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        if self._root == "[":
+                            # A string element, e.g. a bare ICD-10 code in compact output
+                            self._emit_item(events)
+                        else:
+                            self._maybe_emit_field(events, closing=False)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._start_item()
+            elif ch in "[{":
+                self._start_item()
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1:
+                    if self._root == "[":
+                        self._emit_item(events)
+                    else:
+                        self._maybe_emit_field(events, closing=False)
+                elif self._depth == 0:
+                    if self._root == "{":
+                        self._maybe_emit_field(events, closing=True)
+                    self._finished = True
+            elif ch == "," and self._depth == 1:
+                if self._root == "{":
+                    self._maybe_emit_field(events, closing=True)
+                self._item_start = None
+            elif not ch.isspace() and ch != ":":
+                # Bare scalars (numbers, true/false/null)
+                self._start_item()
+        return events
+
+    def _start_item(self):
+        if self._depth == 1 and self._item_start is None:
+            self._item_start = len(self._buffer) - 1
+
+    def _text(self) -> str:
+        return "".join(self._buffer[self._item_start:])
+
+    def _emit_item(self, events: list):
+        if self._item_start is None:
+            return
+        try:
+            events.append(("item", json.loads(self._text())))
+        except json.JSONDecodeError:
+            logger.debug("Skipping unparsable streamed item")
+        self._item_start = None
+
+    def _maybe_emit_field(self, events: list, closing: bool):
+        """Emit the current `"key": value` pair once it parses as a complete member."""
+        if self._item_start is None:
+            return
+        text = self._text()
+        if closing:
+            text = text[:-1]
+        try:
+            member = json.loads("{" + text.rstrip().rstrip(",") + "}")
+        except json.JSONDecodeError:
+            return
+        if member:
+            events.append(("field", next(iter(member.items()))))
+            self._item_start = None
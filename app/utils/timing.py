@@ -0,0 +1,71 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+_current: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+
+
+class StageTimings:
+    """Per-request record of how long each pipeline stage took, plus token counters and tags."""
+
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self.counters: Dict[str, float] = {}
+        # Request-level labels such as the agent that answered, for metrics
+        self.tags: Dict[str, str] = {}
+
+    def add(self, name: str, seconds: float):
+        self.stages.setdefault(name, []).append(seconds)
+
+    def count(self, name: str, value: float = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def total(self, name: str) -> float:
+        return sum(self.stages.get(name, ()))
+
+
+def current_timings() -> Optional[StageTimings]:
+    return _current.get()
+
+
+@contextmanager
+def collect_timings():
+    """Collect stage timings for everything run inside this block (on this thread/context)."""
+    timings = StageTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def record_stage(name: str, seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+def record_count(name: str, value: float = 1):
+    timings = _current.get()
+    if timings is not None:
+        timings.count(name, value)
+
+
+def tag(name: str, value: str):
+    timings = _current.get()
+    if timings is not None:
+        timings.tags[name] = value
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage `name`. A no-op when nothing is collecting."""
+    if _current.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
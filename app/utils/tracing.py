@@ -0,0 +1,322 @@
+"""
+Request tracing with a background exporter.
+
+Spans are opened with `trace_span` or the `traced` decorator and nest through a
+contextvar, so they follow work onto the inference and chunking threads. Whether a
+trace is recorded is decided once, when its root span opens (TRACE_SAMPLE_RATE);
+spans of unsampled traces cost a contextvar lookup. Finished spans are summarized
+(note text redacted, long strings truncated, images reduced to their shape) and
+put on a bounded in-memory queue without blocking. A daemon thread drains the
+queue in batches to the configured sink: LangSmith, a JSON-lines file, or stdout.
+If the sink is slow or down, the queue fills up and further spans are dropped and
+counted; requests never wait on it.
+"""
+import atexit
+import contextvars
+import dataclasses
+import functools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from app.config.config import config
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Payload fields holding patient text; only their length is exported when TRACE_REDACT_TEXT is on
+REDACTED_FIELDS = ("note", "clinical_note", "transcript")
+# Longest list exported; the rest is summarized as a count
+MAX_LIST_ITEMS = 20
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+# Set as the current span inside traces that were not sampled, so nested spans skip all work
+_UNSAMPLED = object()
+
+
+def summarize(value, field: Optional[str] = None, depth: int = 0):
+    """A JSON-serializable, size-bounded and redacted rendering of a span input or output."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        if field in REDACTED_FIELDS and config.TRACE_REDACT_TEXT:
+            return f"<redacted {len(value)} chars>"
+        limit = config.TRACE_MAX_FIELD_CHARS
+        return value if len(value) <= limit else value[:limit] + f"... <{len(value) - limit} more chars>"
+    if depth >= 6:
+        return f"<{type(value).__name__}>"
+    if hasattr(value, "shape") and hasattr(value, "dtype"):
+        return f"<array {tuple(value.shape)} {value.dtype}>"
+    if hasattr(value, "size") and hasattr(value, "mode"):
+        return f"<image {value.size[0]}x{value.size[1]} {value.mode}>"
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        # State, its payloads, GenerationOutput; fields are read as they are, not deep-copied like asdict()
+        value = {f.name: getattr(value, f.name) for f in dataclasses.fields(value)}
+    elif hasattr(value, "model_dump"):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        return {str(k): summarize(v, str(k), depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [summarize(v, field, depth + 1) for v in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f"<{len(value) - MAX_LIST_ITEMS} more>")
+        return items
+    return summarize(repr(value), field, depth)
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.span_id = str(uuid.uuid4())
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        # Position in the trace tree as LangSmith orders runs: ancestors' keys joined by "."
+        key = datetime.fromtimestamp(self.start, timezone.utc).strftime("%Y%m%dT%H%M%S%fZ") + self.span_id
+        self.dotted_order = f"{parent.dotted_order}.{key}" if parent is not None else key
+        self.attributes = attributes
+        self.inputs = None
+        self.outputs = None
+        self.error = None
+
+    def record(self, end: float) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "dotted_order": self.dotted_order,
+            "start": self.start,
+            "end": end,
+            "duration_ms": 1000 * (end - self.start),
+            "attributes": self.attributes,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "error": self.error,
+        }
+
+
+class JSONLinesSink:
+    """One JSON object per span, appended to a file, or to stdout for path "-"."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def export(self, records: List[dict]):
+        if self._file is None:
+            self._file = sys.stdout if self.path == "-" else open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(r, default=str) + "\n" for r in records))
+        self._file.flush()
+
+
+class LangSmithSink:
+    """Posts spans as LangSmith runs (project from LANGCHAIN_PROJECT), one batch request per export."""
+
+    def __init__(self):
+        self._client = None
+
+    def export(self, records: List[dict]):
+        if self._client is None:
+            # Created on the exporter thread, so importing the client never delays startup or a request
+            from langsmith import Client
+            self._client = Client()
+        self._client.batch_ingest_runs(create=[self._run(r) for r in records])
+
+    @staticmethod
+    def _run(record: dict) -> dict:
+        return {
+            "id": record["span_id"],
+            "trace_id": record["trace_id"],
+            "parent_run_id": record["parent_id"],
+            "dotted_order": record["dotted_order"],
+            "name": record["name"],
+            "run_type": "chain",
+            "start_time": datetime.fromtimestamp(record["start"], timezone.utc),
+            "end_time": datetime.fromtimestamp(record["end"], timezone.utc),
+            "inputs": record["inputs"] or {},
+            "outputs": record["outputs"] or {},
+            "error": record["error"],
+            "extra": {"metadata": record["attributes"]},
+        }
+
+
+class SpanExporter:
+    """Bounded span queue drained in batches by a daemon thread."""
+
+    def __init__(self, sink, queue_size: int, batch_size: int, flush_interval_s: float):
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self.sampled = 0
+        self.unsampled = 0
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+        self._thread = threading.Thread(target=self._loop, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def count_trace(self, sampled: bool):
+        with self._lock:
+            if sampled:
+                self.sampled += 1
+            else:
+                self.unsampled += 1
+
+    def submit(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _collect(self) -> List[dict]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval_s
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self.sink.export(batch)
+                with self._lock:
+                    self.exported += len(batch)
+            except Exception as e:
+                with self._lock:
+                    self.export_errors += 1
+                    self.dropped += len(batch)
+                    failures = self.export_errors
+                # Once, then every 100th failure, so an unreachable sink does not flood the log
+                if failures == 1 or failures % 100 == 0:
+                    logger.warning(f"Trace export failed ({failures} failed batches so far): {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout_s: float = 5.0):
+        """Wait (up to `timeout_s`) until every queued span has been handed to the sink."""
+        deadline = time.monotonic() + timeout_s
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sink": type(self.sink).__name__,
+                "sample_rate": config.TRACE_SAMPLE_RATE,
+                "sampled_traces": self.sampled,
+                "unsampled_traces": self.unsampled,
+                "exported_spans": self.exported,
+                "dropped_spans": self.dropped,
+                "export_errors": self.export_errors,
+                "queued_spans": self._queue.qsize(),
+            }
+
+
+_exporter: Optional[SpanExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter() -> Optional[SpanExporter]:
+    """The process-wide exporter for TRACE_EXPORTER, started on first use; None when tracing is off."""
+    global _exporter
+    if _exporter is not None or config.TRACE_EXPORTER == "none":
+        return _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            if config.TRACE_EXPORTER == "langsmith":
+                sink = LangSmithSink()
+            elif config.TRACE_EXPORTER == "stdout":
+                sink = JSONLinesSink("-")
+            elif config.TRACE_EXPORTER == "file":
+                sink = JSONLinesSink(config.TRACE_FILE)
+            else:
+                raise ValueError(f"Unknown TRACE_EXPORTER '{config.TRACE_EXPORTER}'. Expected none, langsmith, file or stdout.")
+            _exporter = SpanExporter(
+                sink, config.TRACE_QUEUE_SIZE, config.TRACE_BATCH_SIZE, config.TRACE_FLUSH_INTERVAL_S
+            )
+            atexit.register(_exporter.flush)
+    return _exporter
+
+
+@contextmanager
+def trace_span(name: str, inputs=None, **attributes):
+    """
+    Record the enclosed block as a span named `name`. Yields the span, or None when
+    tracing is off or the trace was not sampled, so callers can attach outputs with
+    `if span: span.outputs = ...`.
+    """
+    parent = _current_span.get()
+    if parent is _UNSAMPLED:
+        yield None
+        return
+    exporter = get_exporter()
+    if exporter is None:
+        yield None
+        return
+    if parent is None and random.random() >= config.TRACE_SAMPLE_RATE:
+        exporter.count_trace(sampled=False)
+        token = _current_span.set(_UNSAMPLED)
+        try:
+            yield None
+        finally:
+            _current_span.reset(token)
+        return
+
+    if parent is None:
+        exporter.count_trace(sampled=True)
+    span = Span(name, parent, attributes)
+    if inputs is not None:
+        span.inputs = summarize(inputs)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        if span.outputs is not None:
+            span.outputs = summarize(span.outputs)
+        exporter.submit(span.record(time.time()))
+
+
+def traced(fn):
+    """Decorator tracing each call of `fn` as a span named after its qualified name, with its arguments and result."""
+    name = fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if config.TRACE_EXPORTER == "none" or _current_span.get() is _UNSAMPLED:
+            return fn(*args, **kwargs)
+        # Methods: the arguments after `self`
+        call_args = args[1:] if args and hasattr(args[0], fn.__name__) else args
+        with trace_span(name, inputs={"args": list(call_args), **kwargs}) as span:
+            result = fn(*args, **kwargs)
+            if span is not None:
+                span.outputs = {"output": result}
+            return result
+
+    return wrapper
+
+
+def tracing_stats() -> dict:
+    return _exporter.stats() if _exporter is not None else {"sink": None}
@@ -0,0 +1,132 @@
+import contextvars
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Sequence
+
+from app.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Pixel hashes of the images of the generation running in this context, in prompt order
+_image_keys: contextvars.ContextVar = contextvars.ContextVar("vision_image_keys", default=None)
+
+
+@contextmanager
+def image_keys(keys: Sequence[str]):
+    """Tell the vision tower which cached images it is about to encode."""
+    token = _image_keys.set(list(keys))
+    try:
+        yield
+    finally:
+        _image_keys.reset(token)
+
+
+class VisionEmbeddingCache:
+    """
+    LRU of vision tower outputs, one entry per image, keyed by the hash of the
+    preprocessed pixels and bounded by the bytes the arrays occupy.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            features = self._entries.get(key)
+            if features is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return features
+
+    def put(self, key: str, features):
+        size = features.nbytes
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = features
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class CachedVisionTower:
+    """
+    Stands in for a model's vision tower. When the running generation has declared
+    its image keys (`image_keys`), images already in the cache are not encoded
+    again: only the misses go through the tower, as one batch, and the outputs are
+    reassembled in order. Without keys it is a plain pass-through.
+
+    Only the first output (the patch embeddings the projector consumes) is cached;
+    the tower's optional extra outputs come back as None.
+    """
+
+    def __init__(self, tower, cache: VisionEmbeddingCache):
+        self.tower = tower
+        self.cache = cache
+        # How many extra outputs the tower returns next to the embeddings (None: not a tuple)
+        self._extras = None
+
+    def __getattr__(self, name):
+        return getattr(self.tower, name)
+
+    def __call__(self, pixel_values, *args, **kwargs):
+        import mlx.core as mx
+
+        keys = _image_keys.get()
+        if not keys or len(keys) != pixel_values.shape[0]:
+            return self.tower(pixel_values, *args, **kwargs)
+
+        features: List[Optional[object]] = [self.cache.get(key) for key in keys]
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            output = self.tower(pixel_values[mx.array(missing)], *args, **kwargs)
+            hidden = output[0] if isinstance(output, tuple) else output
+            self._extras = len(output) - 1 if isinstance(output, tuple) else None
+            encoded = [hidden[j:j + 1] for j in range(len(missing))]
+            mx.eval(encoded)
+            for i, part in zip(missing, encoded):
+                features[i] = part
+                self.cache.put(keys[i], part)
+
+        hidden = mx.concatenate(features, axis=0) if len(features) > 1 else features[0]
+        return hidden if self._extras is None else (hidden,) + (None,) * self._extras
+
+
+def install_vision_cache(model, max_bytes: int) -> Optional[VisionEmbeddingCache]:
+    """Put a `CachedVisionTower` in front of `model.vision_tower`; returns its cache."""
+    tower = getattr(model, "vision_tower", None)
+    if tower is None:
+        logger.warning("Model has no vision_tower; vision embedding cache disabled")
+        return None
+    cache = VisionEmbeddingCache(max_bytes)
+    # Assigned as a plain attribute, so it shadows the tower for calls while the
+    # original stays registered as the model's child module
+    object.__setattr__(model, "vision_tower", CachedVisionTower(tower, cache))
+    logger.info(f"Vision embedding cache enabled ({max_bytes >> 20} MB)")
+    return cache
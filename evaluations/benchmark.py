@@ -0,0 +1,219 @@
+"""
+Accuracy and latency benchmark on the labeled ICD-10 dataset.
+
+Runs every note through a runner and writes a machine-readable JSON report with
+code-level precision/recall/F1, per-stage latency percentiles (routing, prompt
+build, template, prefill, decode, JSON parse, end-to-end), prompt/output token
+counts and peak RSS, so results can be diffed across commits.
+
+Runners:
+    pipeline  the real LangGraph pipeline (router + ICD-10 agent) on the inference
+              backend chosen with --backend (mlx, llamacpp, or stub for a model-free run)
+    fake      no model; simulated stage latencies and gold codes with a configurable
+              miss rate, for exercising the harness and the service plumbing
+
+Usage:
+    python -m evaluations.benchmark --runner pipeline --limit 20 --output bench.json
+    python -m evaluations.benchmark --runner pipeline --backend stub --limit 20
+    python -m evaluations.benchmark --runner fake --fake-stage-ms 5 --fake-miss-rate 0.1
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Set
+
+from app.config.config import config
+from app.utils.timing import collect_timings, record_count, record_stage, stage
+
+DATASET_PATH = "evaluations/synthetic_icd10_dataset.json"
+STAGES = ("routing", "chunking", "retrieval", "prompt_build", "template", "prefill", "decode", "json_parse", "json_repair", "total")
+
+
+def normalize_code(code: str) -> str:
+    return code.strip().upper()
+
+
+def codes_of(result) -> Set[str]:
+    codes = set()
+    for item in result or []:
+        code = item.get("code") if isinstance(item, dict) else getattr(item, "code", None)
+        if code:
+            codes.add(normalize_code(code))
+    return codes
+
+
+class PipelineRunner:
+    """Runs notes through the full graph, as /api/analyze does."""
+
+    def __init__(self, args):
+        from app.graph.graph_builder import build_graph
+
+        if args.backend:
+            config.INFERENCE_BACKEND = args.backend
+        if args.unconstrained:
+            config.CONSTRAINED_DECODING = False
+        if args.no_retrieval:
+            config.ICD10_RETRIEVAL_ENABLED = False
+        from app.graph.types import RequestPayload, State
+
+        self._state_cls = State
+        self._payload_cls = RequestPayload
+        self.graph = build_graph()
+
+    def run(self, note: str) -> Set[str]:
+        output = self.graph.invoke(self._state_cls(payload=self._payload_cls(note=note)))
+        output = output if isinstance(output, dict) else {"result": output.result, "error": output.error}
+        if output.get("error"):
+            raise RuntimeError(output["error"])
+        return codes_of(output.get("result"))
+
+
+class FakeRunner:
+    """Model-free runner: sleeps through each stage and returns (mostly) the gold codes."""
+
+    def __init__(self, args):
+        self.stage_s = args.fake_stage_ms / 1000
+        self.miss_rate = args.fake_miss_rate
+        self.rng = random.Random(args.seed)
+        self.gold: Dict[str, Set[str]] = {}
+
+    def run(self, note: str) -> Set[str]:
+        for name in ("routing", "prompt_build", "template", "prefill", "decode", "json_parse"):
+            time.sleep(self.stage_s)
+            record_stage(name, self.stage_s)
+        record_count("prompt_tokens", len(note.split()))
+        codes = {c for c in self.gold.get(note, set()) if self.rng.random() >= self.miss_rate}
+        record_count("generation_tokens", 12 * len(codes))
+        return codes
+
+
+RUNNERS = {"pipeline": PipelineRunner, "fake": FakeRunner}
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": 1000 * statistics.mean(ordered),
+        "p50_ms": 1000 * pct(50),
+        "p90_ms": 1000 * pct(90),
+        "p99_ms": 1000 * pct(99),
+        "max_ms": 1000 * ordered[-1],
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def run_benchmark(args) -> dict:
+    with open(args.dataset) as f:
+        dataset = json.load(f)[: args.limit]
+
+    runner = RUNNERS[args.runner](args)
+    if isinstance(runner, FakeRunner):
+        runner.gold = {item["note"]: codes_of(item["icd10_codes"]) for item in dataset}
+
+    # Untimed warmup so one-off compilation does not land in the percentiles
+    for item in dataset[: args.warmup]:
+        runner.run(item["note"])
+
+    stage_samples = {name: [] for name in STAGES}
+    counters: Dict[str, List[float]] = {}
+    tp = fp = fn = errors = 0
+    for item in dataset:
+        gold = codes_of(item["icd10_codes"])
+        with collect_timings() as timings:
+            try:
+                with stage("total"):
+                    predicted = runner.run(item["note"])
+            except Exception as e:
+                print(f"error: {e}", file=sys.stderr)
+                errors += 1
+                predicted = set()
+        for name in STAGES:
+            if name in timings.stages:
+                # An agent may hit a stage more than once (e.g. the LLM router and the coder both prefill)
+                stage_samples[name].append(timings.total(name))
+        for name, value in timings.counters.items():
+            counters.setdefault(name, []).append(value)
+        tp += len(predicted & gold)
+        fp += len(predicted - gold)
+        fn += len(gold - predicted)
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "runner": args.runner,
+        "backend": (args.backend or config.INFERENCE_BACKEND) if args.runner == "pipeline" else None,
+        "constrained_decoding": config.CONSTRAINED_DECODING,
+        "retrieval": config.ICD10_RETRIEVAL_ENABLED,
+        "notes": len(dataset),
+        "errors": errors,
+        "accuracy": {
+            "true_positives": tp,
+            "false_positives": fp,
+            "false_negatives": fn,
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        },
+        "latency": {name: percentiles(samples) for name, samples in stage_samples.items() if samples},
+        "tokens": {
+            name: {"total": sum(values), "mean": statistics.mean(values)} for name, values in counters.items()
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--runner", choices=sorted(RUNNERS), default="pipeline")
+    parser.add_argument("--backend", choices=["mlx", "llamacpp", "stub"], default=None,
+                        help="Inference backend for the pipeline runner (default: INFERENCE_BACKEND)")
+    parser.add_argument("--unconstrained", action="store_true",
+                        help="Disable constrained JSON decoding, to compare decode tokens and accuracy")
+    parser.add_argument("--no-retrieval", action="store_true",
+                        help="Leave retrieved candidate codes out of the ICD-10 prompt")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N notes")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed notes run before measuring")
+    parser.add_argument("--fake-stage-ms", type=float, default=2.0, help="Simulated latency per stage (fake runner)")
+    parser.add_argument("--fake-miss-rate", type=float, default=0.0, help="Fraction of gold codes dropped (fake runner)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare single-pass ICD-10 coding of long notes with section-aware chunking
+(CHUNKING_ENABLED).
+
+Long inputs are synthesized by concatenating 1, 4, 8 and 16 notes of the labeled
+dataset, so each input's gold codes are the union of its parts. Every input is
+coded once with the whole note in one prompt and once split into chunks that are
+coded together as one batch (see `InferenceBackend.generate_batch`) and merged,
+reporting latency, prompt tokens and gold-code recall per length. Chunks only
+decode side by side on the mlx backend, and only when their prompts fit the
+sliding attention window (lower `--chunk-tokens` to see it). Recall is what shows whether the single pass loses findings
+deep in the context.
+
+Usage:
+    python -m evaluations.benchmark_chunking --lengths 1 4 8 16 --output bench_chunking.json
+    python -m evaluations.benchmark_chunking --backend stub --chunk-tokens 512
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.config.config import config
+from app.utils.icd10_index import normalize_code
+from evaluations.benchmark import DATASET_PATH
+
+
+def long_notes(dataset, length: int, count: int):
+    """`count` inputs of `length` consecutive notes each, with their combined gold codes."""
+    inputs = []
+    for start in range(0, len(dataset) - length + 1, length):
+        items = dataset[start:start + length]
+        note = "\n\n".join(item["note"] for item in items)
+        gold = {normalize_code(c["code"]) for item in items for c in item["icd10_codes"]}
+        inputs.append((note, gold))
+        if len(inputs) == count:
+            break
+    return inputs
+
+
+def code_note(agent, note: str):
+    from app.graph.types import ICD10Payload, State
+
+    response = agent.respond(State(type="icd10", payload=ICD10Payload(clinical_note=note)))
+    codes = {normalize_code(c["code"] if isinstance(c, dict) else c) for c in agent.parse_result(response.text) or []}
+    return codes, response.prompt_tokens
+
+
+def run_mode(agent, inputs, chunked: bool) -> dict:
+    config.CHUNKING_ENABLED = chunked
+    latency_s, prompt_tokens, chunks, hits, gold_total = [], [], [], 0, 0
+    for note, gold in inputs:
+        chunks.append(len(agent.split_input(note, "note")))
+        start = time.perf_counter()
+        predicted, tokens = code_note(agent, note)
+        latency_s.append(time.perf_counter() - start)
+        prompt_tokens.append(tokens)
+        hits += len(predicted & gold)
+        gold_total += len(gold)
+    return {
+        "mean_latency_ms": 1000 * statistics.mean(latency_s),
+        "p50_latency_ms": 1000 * statistics.median(latency_s),
+        "mean_prompt_tokens": statistics.mean(prompt_tokens),
+        "mean_chunks": statistics.mean(chunks),
+        "recall": hits / gold_total if gold_total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--backend", choices=["mlx", "llamacpp", "stub"], default=None,
+                        help="Inference backend (default: INFERENCE_BACKEND)")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1, 4, 8, 16],
+                        help="Number of dataset notes concatenated into one input")
+    parser.add_argument("--inputs", type=int, default=5, help="Inputs per length")
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="Override CHUNK_MAX_TOKENS")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+    if args.backend:
+        config.INFERENCE_BACKEND = args.backend
+    if args.chunk_tokens:
+        config.CHUNK_MAX_TOKENS = args.chunk_tokens
+
+    from app.agents.icd10_agent import ICD10Agent
+
+    with open(args.dataset) as f:
+        dataset = json.load(f)
+
+    agent = ICD10Agent()
+    # One untimed call so kernel compilation does not skew the first sample
+    code_note(agent, dataset[0]["note"])
+
+    results = {}
+    for length in args.lengths:
+        inputs = long_notes(dataset, length, args.inputs)
+        if not inputs:
+            continue
+        results[str(length)] = {
+            "inputs": len(inputs),
+            "single_pass": run_mode(agent, inputs, chunked=False),
+            "chunked": run_mode(agent, inputs, chunked=True),
+        }
+
+    report = {
+        "backend": config.INFERENCE_BACKEND,
+        "chunk_max_tokens": config.CHUNK_MAX_TOKENS,
+        "chunk_overlap_tokens": config.CHUNK_OVERLAP_TOKENS,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compare the two-pass path (LLM router, then the task agent prefilling the note
+again) with the fused single-pass route-and-generate mode (FUSED_ROUTING).
+
+Both paths are timed on the notes of the ICD-10 dataset with the rule-based
+classifier bypassed, since that is the case the fused mode replaces: requests the
+cheap routing tiers can decide never reach the LLM router.
+
+Usage:
+    python -m evaluations.benchmark_fused --limit 20 --output bench_fused.json
+    python -m evaluations.benchmark_fused --backend stub
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.config.config import config
+
+DATASET_PATH = "evaluations/synthetic_icd10_dataset.json"
+
+
+def _summary(latency_s, prompt_tokens, labels) -> dict:
+    return {
+        "mean_latency_ms": 1000 * statistics.mean(latency_s),
+        "p50_latency_ms": 1000 * statistics.median(latency_s),
+        "mean_prompt_tokens": statistics.mean(prompt_tokens),
+        "labels": {label: labels.count(label) for label in sorted(set(labels))},
+    }
+
+
+def run_two_pass(agents, note: str):
+    from app.graph.types import RequestPayload, State, task_payload
+
+    request = RequestPayload(note=note)
+    routed = agents["router"].respond(State(payload=request))
+    label = routed.text.lower().strip()
+    label = label if label in ("icd10", "soap") else "icd10"
+    answer = agents[label].respond(State(type=label, payload=task_payload(label, request)))
+    return label, routed.prompt_tokens + answer.prompt_tokens
+
+
+def run_fused(agents, note: str):
+    from app.agents.fused_agent import split_fused_output
+    from app.graph.types import RequestPayload, State
+
+    output = agents["fused"].respond(State(payload=RequestPayload(note=note)))
+    label, _ = split_fused_output(output.text)
+    return label, output.prompt_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--backend", choices=["mlx", "llamacpp", "stub"], default=None,
+                        help="Inference backend (default: INFERENCE_BACKEND)")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N notes")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+    if args.backend:
+        config.INFERENCE_BACKEND = args.backend
+
+    from app.graph.graph_builder import build_agents
+
+    with open(args.dataset) as f:
+        notes = [item["note"] for item in json.load(f)][: args.limit]
+
+    agents = build_agents(fused=True)
+    runners = {"two_pass": run_two_pass, "fused": run_fused}
+    # One untimed call per path so kernel compilation does not skew the first sample
+    for run in runners.values():
+        run(agents, notes[0])
+
+    results = {}
+    for name, run in runners.items():
+        latency_s, prompt_tokens, labels = [], [], []
+        for note in notes:
+            start = time.perf_counter()
+            label, tokens = run(agents, note)
+            latency_s.append(time.perf_counter() - start)
+            prompt_tokens.append(tokens)
+            labels.append(label)
+        results[name] = _summary(latency_s, prompt_tokens, labels)
+
+    two_pass, fused = results["two_pass"], results["fused"]
+    saving_ms = two_pass["mean_latency_ms"] - fused["mean_latency_ms"]
+    report = {
+        "backend": config.INFERENCE_BACKEND,
+        "notes": len(notes),
+        "results": results,
+        "mean_saving_ms": saving_ms,
+        "mean_saving_pct": 100 * saving_ms / two_pass["mean_latency_ms"] if two_pass["mean_latency_ms"] else None,
+        "prompt_tokens_saved": two_pass["mean_prompt_tokens"] - fused["mean_prompt_tokens"],
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
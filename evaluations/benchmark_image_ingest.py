@@ -0,0 +1,120 @@
+"""
+Image ingestion latency and memory on multi-megapixel radiographs, without a model.
+
+The legacy path decoded the full upload and converted it to RGB
+(`Image.open(...).convert("RGB")`), kept that image in the request state, and left
+the resize to the vision processor. The fast path (app/utils/image_ingest.py)
+decodes directly at the encoder's input size. Both are timed here up to the same
+encoder-sized result, so the comparison covers the whole preprocessing.
+
+Synthetic radiograph-like images are generated by default: 8-bit grayscale JPEG
+and PNG, and 16-bit PNG, at typical chest/mammography sizes. Real files can be
+used instead with --images.
+
+Usage:
+    python -m evaluations.benchmark_image_ingest --repeats 10 --output bench_ingest.json
+    python -m evaluations.benchmark_image_ingest --images xray1.jpg xray2.png
+"""
+import argparse
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.config.config import config
+from app.utils.image_ingest import preprocess_image
+from evaluations.benchmark import percentiles
+
+# (label, width, height, PIL mode of the pixels, file format)
+SYNTHETIC = [
+    ("chest_pa_jpeg", 2500, 3000, "L", "JPEG"),
+    ("chest_pa_png", 2500, 3000, "L", "PNG"),
+    ("mammo_jpeg", 4000, 5000, "L", "JPEG"),
+    ("chest_16bit_png", 2500, 3000, "I;16", "PNG"),
+]
+
+
+def synthetic_radiograph(width: int, height: int, mode: str, fmt: str, seed: int = 0) -> bytes:
+    """A smooth body-like intensity profile with film-grain noise, encoded as `fmt`."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    body = np.exp(-(((x - width / 2) / (0.35 * width)) ** 2 + ((y - height / 2) / (0.45 * height)) ** 2))
+    pixels = (0.15 + 0.7 * body + rng.normal(0, 0.03, (height, width))).clip(0, 1)
+    array = (pixels * 4095).astype(np.uint16) if mode == "I;16" else (pixels * 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def legacy_preprocess(file_bytes: bytes, size: int) -> tuple:
+    """Full decode and RGB conversion, then the encoder-size resize the processor would do."""
+    image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    resident = len(image.tobytes())
+    return np.asarray(image.resize((size, size), Image.BICUBIC)), resident
+
+
+def time_calls(fn, repeats: int) -> list:
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", nargs="+", default=None, help="Image files to use instead of synthetic ones")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=config.IMAGE_PREPROCESS_WORKERS,
+                        help="Parallel uploads for the throughput measurement")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    if args.images:
+        inputs = []
+        for path in args.images:
+            with open(path, "rb") as f:
+                inputs.append((os.path.basename(path), f.read()))
+    else:
+        inputs = [(label, synthetic_radiograph(w, h, mode, fmt)) for label, w, h, mode, fmt in SYNTHETIC]
+
+    size = config.IMAGE_INPUT_SIZE
+    results = {}
+    for label, data in inputs:
+        with Image.open(io.BytesIO(data)) as header:
+            width, height = header.size
+        legacy_output, legacy_resident = legacy_preprocess(data, size)
+        fast_output = preprocess_image(data, size)
+        legacy = time_calls(lambda: legacy_preprocess(data, size), args.repeats)
+        fast = time_calls(lambda: preprocess_image(data, size), args.repeats)
+
+        # Many uploads at once: the pool keeps several decodes in flight
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            start = time.perf_counter()
+            list(pool.map(lambda _: preprocess_image(data, size), range(args.repeats * args.concurrency)))
+            images_per_s = args.repeats * args.concurrency / (time.perf_counter() - start)
+
+        results[label] = {
+            "megapixels": width * height / 1e6,
+            "file_bytes": len(data),
+            "legacy": {**percentiles(legacy), "state_bytes": legacy_resident},
+            "fast": {**percentiles(fast), "state_bytes": fast_output.nbytes, "images_per_s": images_per_s},
+            "speedup_p50": percentiles(legacy)["p50_ms"] / percentiles(fast)["p50_ms"],
+            # Mean absolute pixel difference of the encoder input the two paths produce
+            "mean_abs_diff": float(np.abs(legacy_output.astype(np.int16) - fast_output.astype(np.int16)).mean()),
+        }
+
+    report = {"input_size": size, "repeats": args.repeats, "concurrency": args.concurrency, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Overhead and scheduling of the asynchronous job queue (/api/jobs), without a model.
+
+Measures, on a temporary SQLite file:
+- submit latency for text jobs and for image jobs (the decoded arrays are stored
+  with the job), and queue throughput (claim + complete per second);
+- queue wait per priority class when interactive jobs arrive behind a backlog of
+  backfill jobs, with a simulated worker that spends `--service-ms` per job. With
+  priorities, an interactive job waits for at most the job in progress; without,
+  it waits for the whole backlog.
+
+Usage:
+    python -m evaluations.benchmark_jobs --jobs 500 --output bench_jobs.json
+    python -m evaluations.benchmark_jobs --backlog 200 --interactive 20 --service-ms 5
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from app.config.config import config
+from app.utils.job_queue import JobQueue
+
+NOTE = "Patient presents with right lower quadrant pain and fever. " * 60
+
+
+def percentiles(samples_s) -> dict:
+    ms = sorted(1000 * s for s in samples_s)
+    return {"p50_ms": statistics.median(ms), "p95_ms": ms[int(0.95 * (len(ms) - 1))], "max_ms": ms[-1]}
+
+
+def open_queue(directory: str, name: str, **kwargs) -> JobQueue:
+    return JobQueue(os.path.join(directory, name), max_queued=1_000_000, **kwargs)
+
+
+def submit_and_drain(queue: JobQueue, jobs: int, images) -> dict:
+    submit_s = []
+    for _ in range(jobs):
+        start = time.perf_counter()
+        queue.submit(None, NOTE, images)
+        submit_s.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    drained = 0
+    while (job := queue.claim()) is not None:
+        queue.complete(job.id, {"agent": "icd10", "result": []})
+        drained += 1
+    elapsed_s = time.perf_counter() - start
+    return {"submit": percentiles(submit_s), "claim_complete_per_s": drained / elapsed_s}
+
+
+def priority_wait(queue: JobQueue, backlog: int, interactive: int, service_s: float, prioritized: bool) -> dict:
+    """Queue wait per class: `backlog` backfill jobs queued up front, interactive ones arriving every few jobs."""
+    interactive_priority = "interactive" if prioritized else "backfill"
+    for _ in range(backlog):
+        queue.submit("icd10", NOTE, priority="backfill")
+    every = max(1, backlog // max(interactive, 1))
+    waits = {"interactive": [], "backfill": []}
+    interactive_ids = set()
+    processed = 0
+    while (job := queue.claim()) is not None:
+        kind = "interactive" if job.id in interactive_ids else "backfill"
+        waits[kind].append(time.time() - job.created_at)
+        time.sleep(service_s)
+        queue.complete(job.id, {})
+        processed += 1
+        if processed % every == 0 and len(interactive_ids) < interactive:
+            interactive_ids.add(queue.submit("icd10", NOTE, priority=interactive_priority))
+    return {kind: percentiles(samples) for kind, samples in waits.items() if samples}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=500, help="Jobs per submit/throughput run")
+    parser.add_argument("--images", type=int, default=1, help="Images per image job")
+    parser.add_argument("--image-size", type=int, default=config.IMAGE_INPUT_SIZE)
+    parser.add_argument("--backlog", type=int, default=100, help="Backfill jobs queued before interactive traffic")
+    parser.add_argument("--interactive", type=int, default=10)
+    parser.add_argument("--service-ms", type=float, default=10.0, help="Simulated run time per job")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    images = [np.zeros((args.image_size, args.image_size, 3), np.uint8) for _ in range(args.images)]
+    with tempfile.TemporaryDirectory() as directory:
+        report = {
+            "jobs": args.jobs,
+            "text": submit_and_drain(open_queue(directory, "text.db"), args.jobs, None),
+            "image": submit_and_drain(open_queue(directory, "image.db"), max(args.jobs // 10, 1), images),
+            "queue_wait": {
+                "prioritized": priority_wait(open_queue(directory, "prio.db"), args.backlog, args.interactive,
+                                             args.service_ms / 1000, prioritized=True),
+                "fifo": priority_wait(open_queue(directory, "fifo.db"), args.backlog, args.interactive,
+                                      args.service_ms / 1000, prioritized=False),
+            },
+        }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
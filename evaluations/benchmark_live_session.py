@@ -0,0 +1,112 @@
+"""
+Cost of keeping a SOAP note current while the transcript grows, as an ambient
+scribe does: regenerating from the full transcript after every segment versus a
+live session (/api/sessions) that keeps the transcript's KV cache and prefills
+only what was appended.
+
+A synthetic encounter is made from the lines of the dataset notes, read out as
+alternating doctor/patient turns and appended a few turns at a time. After each
+append the note is refreshed, and the latency and prefill time of each step are
+recorded. With a full regeneration prefill grows with the transcript; with a
+session on the mlx backend it stays flat. Other backends keep only the text, so
+there the two modes should match (llama.cpp still reuses its own prompt cache).
+
+Usage:
+    python -m evaluations.benchmark_live_session --segments 20 --turns-per-segment 3
+    python -m evaluations.benchmark_live_session --backend stub
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.config.config import config
+from app.utils.timing import collect_timings
+from evaluations.benchmark import DATASET_PATH
+
+
+def encounter_segments(dataset, segments: int, turns_per_segment: int):
+    lines = [line.strip() for item in dataset for line in item["note"].splitlines() if line.strip()]
+    turns = [f"{'Doctor' if i % 2 == 0 else 'Patient'}: {line}" for i, line in enumerate(lines)]
+    return ["\n".join(turns[i:i + turns_per_segment]) for i in range(0, segments * turns_per_segment, turns_per_segment)]
+
+
+def run_full(agent, transcript: str):
+    from app.graph.types import SOAPPayload, State
+
+    output = agent.respond(State(type="soap", payload=SOAPPayload(transcript=transcript)))
+    agent.parse_result(output.text)
+
+
+def measure(step, segments) -> dict:
+    """Run `step(i, segment)` per segment, timing each and the prefill inside it."""
+    latency_s, prefill_s = [], []
+    for i, segment in enumerate(segments):
+        with collect_timings() as timings:
+            start = time.perf_counter()
+            step(i, segment)
+            latency_s.append(time.perf_counter() - start)
+        prefill_s.append(timings.total("prefill"))
+    return {
+        "mean_latency_ms": 1000 * statistics.mean(latency_s),
+        "first_latency_ms": 1000 * latency_s[0],
+        "last_latency_ms": 1000 * latency_s[-1],
+        "total_latency_ms": 1000 * sum(latency_s),
+        "first_prefill_ms": 1000 * prefill_s[0],
+        "last_prefill_ms": 1000 * prefill_s[-1],
+        "total_prefill_ms": 1000 * sum(prefill_s),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--backend", choices=["mlx", "llamacpp", "stub"], default=None,
+                        help="Inference backend (default: INFERENCE_BACKEND)")
+    parser.add_argument("--segments", type=int, default=20, help="Transcript appends in the encounter")
+    parser.add_argument("--turns-per-segment", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+    if args.backend:
+        config.INFERENCE_BACKEND = args.backend
+    # Measure one long prompt against the session, not map/reduce over chunks
+    config.CHUNKING_ENABLED = False
+
+    from app.agents.soap_generator_agent import SoapGeneratorAgent
+    from app.utils.live_sessions import LiveSession
+
+    with open(args.dataset) as f:
+        segments = encounter_segments(json.load(f), args.segments, args.turns_per_segment)
+    segments = [s for s in segments if s]
+
+    agent = SoapGeneratorAgent()
+    # One untimed call so kernel compilation does not skew the first sample
+    run_full(agent, segments[0])
+
+    full = measure(lambda i, _: run_full(agent, "\n".join(segments[:i + 1])), segments)
+
+    session = LiveSession(agent.open_session())
+
+    def session_step(_, segment):
+        agent.append_transcript(session, segment)
+        agent.refresh(session)
+
+    live = measure(session_step, segments)
+    live["kv_bytes"] = session.prompt.kv_bytes
+
+    report = {
+        "backend": config.INFERENCE_BACKEND,
+        "segments": len(segments),
+        "transcript_tokens": agent.backend.count_tokens("\n".join(segments)),
+        "full_regeneration": full,
+        "live_session": live,
+        "total_saving_ms": full["total_latency_ms"] - live["total_latency_ms"],
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
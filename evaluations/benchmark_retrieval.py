@@ -0,0 +1,65 @@
+"""
+Retrieval quality and latency of the BM25 ICD-10 candidate index, without a model.
+
+For every note of the labeled dataset the top-k candidates are retrieved and
+compared with the gold codes, giving recall@k (the share of gold codes the model
+gets to see in its candidate list) and per-query latency percentiles. End-to-end
+accuracy and latency with and without candidates come from the main benchmark:
+
+    python -m evaluations.benchmark --runner pipeline --output with_retrieval.json
+    python -m evaluations.benchmark --runner pipeline --no-retrieval --output without_retrieval.json
+
+Usage:
+    python -m evaluations.benchmark_retrieval --k 5 10 20 50 --output bench_retrieval.json
+"""
+import argparse
+import json
+import time
+
+from app.utils.icd10_index import normalize_code
+from app.utils.icd10_retrieval import get_icd10_retriever
+from evaluations.benchmark import DATASET_PATH, percentiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 10, 20, 50], help="Cut-offs for recall@k")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N notes")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    retriever = get_icd10_retriever()
+    load_ms = 1000 * (time.perf_counter() - start)
+    if retriever is None:
+        parser.error("No retrieval index; build it with `python -m app.utils.icd10_retrieval`")
+
+    with open(args.dataset) as f:
+        dataset = json.load(f)[: args.limit]
+
+    max_k = max(args.k)
+    latencies, hits, gold_total = [], {k: 0 for k in args.k}, 0
+    for item in dataset:
+        gold = {normalize_code(c["code"]) for c in item["icd10_codes"]}
+        start = time.perf_counter()
+        ranked = [normalize_code(code) for code, _ in retriever.search(item["note"], max_k)]
+        latencies.append(time.perf_counter() - start)
+        gold_total += len(gold)
+        for k in args.k:
+            hits[k] += len(gold & set(ranked[:k]))
+
+    report = {
+        "notes": len(dataset),
+        "load_ms": load_ms,
+        "retrieval_latency": percentiles(latencies),
+        "recall_at_k": {str(k): hits[k] / gold_total if gold_total else 0.0 for k in args.k},
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
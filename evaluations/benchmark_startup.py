@@ -0,0 +1,104 @@
+"""
+Cold start of the API server: time from launching the process until `/healthz`
+answers (the server accepts connections) and until `/readyz` answers 200 (the model
+is loaded and warmed up), plus the latency of the first request after ready.
+
+Each run starts a fresh `uvicorn app.main:app` process with the chosen backend, polls
+both endpoints, sends one `/api/analyze` request once ready and stops the server.
+Run once with warmup and once with `--no-warmup` to see what warming up moves out of
+the first request.
+
+Usage:
+    python -m evaluations.benchmark_startup --runs 3 --output bench_startup.json
+    python -m evaluations.benchmark_startup --backend stub --no-warmup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+NOTE = "Patient presents with right lower quadrant pain, fever and nausea since yesterday."
+
+
+def status_of(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def first_request_s(base_url: str) -> float:
+    body = urllib.parse.urlencode({"note": NOTE, "task": "icd10"}).encode()
+    start = time.monotonic()
+    with urllib.request.urlopen(f"{base_url}/api/analyze", data=body, timeout=600) as response:
+        response.read()
+    return time.monotonic() - start
+
+
+def cold_start(backend: str, warmup: bool, port: int, timeout_s: float) -> dict:
+    env = dict(os.environ, INFERENCE_BACKEND=backend, WARMUP_ENABLED=str(warmup).lower(),
+               RESULT_CACHE_ENABLED="false", RESULT_CACHE_DB="")
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.monotonic()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {"healthy_s": None, "ready_s": None, "first_request_s": None}
+    try:
+        while time.monotonic() - start < timeout_s:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            if result["healthy_s"] is None and status_of(f"{base_url}/healthz") == 200:
+                result["healthy_s"] = time.monotonic() - start
+            if result["healthy_s"] is not None and status_of(f"{base_url}/readyz") == 200:
+                result["ready_s"] = time.monotonic() - start
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError(f"Server not ready after {timeout_s}s")
+        with urllib.request.urlopen(f"{base_url}/readyz", timeout=2) as response:
+            result["lifecycle"] = json.load(response)
+        result["first_request_s"] = first_request_s(base_url)
+    finally:
+        server.terminate()
+        server.wait()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--backend", choices=["mlx", "llamacpp", "stub"], default=None,
+                        help="Inference backend of the server (default: INFERENCE_BACKEND)")
+    parser.add_argument("--no-warmup", action="store_true", help="Start with WARMUP_ENABLED=false")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=600.0, help="Seconds to wait for ready")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    backend = args.backend or os.getenv("INFERENCE_BACKEND", "mlx")
+    runs = [cold_start(backend, not args.no_warmup, args.port, args.timeout) for _ in range(args.runs)]
+    report = {
+        "backend": backend,
+        "warmup": not args.no_warmup,
+        "runs": runs,
+        "median_healthy_s": statistics.median(r["healthy_s"] for r in runs),
+        "median_ready_s": statistics.median(r["ready_s"] for r in runs),
+        "median_first_request_s": statistics.median(r["first_request_s"] for r in runs),
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Per-request memory of the graph state: the Pydantic `State` with a free-form payload
+dict versus the slotted dataclass state with typed per-task payloads.
+
+Both flows replay what a request does to its state, without a model: the handler
+builds the initial state (the note, and for image requests the ingested arrays),
+the router and task nodes each receive a state rebuilt from the graph's channels and
+return their update, and the response is built from the final values. The legacy
+flow reconstructs (and so re-validates) a Pydantic model at every step, copies the
+note into `clinical_note`/`transcript`, and holds the images until the response;
+the current flow references the note, swaps payloads on routing, and drops the
+images once they are handed to the encoder.
+
+Reported per flow: peak traced memory per request, memory and allocated blocks
+still held by the request when its response is built, and time per request.
+
+Usage:
+    python -m evaluations.benchmark_state --requests 200 --output bench_state.json
+    python -m evaluations.benchmark_state --images 4 --note-chars 20000
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import List, Optional, Union
+
+import numpy as np
+from pydantic import BaseModel
+
+from app.api.schemas import ICD10Code
+from app.config.config import config
+from app.graph.types import RequestPayload, State, task_payload
+
+# What the ICD-10 agent returns for a note, parsed
+CODES = [{"code": "K35.80", "description": "Unspecified acute appendicitis"},
+         {"code": "R50.9", "description": "Fever, unspecified"}]
+REPORT = {"technique": "PA view", "findings": "No focal consolidation.", "impression": "Normal.",
+          "recommendations": "None."}
+
+
+class LegacyState(BaseModel):
+    """`State` as it was: validated on every construction, with an untyped payload."""
+    type: Optional[str]
+    payload: dict
+    result: Optional[Union[str, List[ICD10Code], dict]]
+    error: Optional[str]
+
+
+def legacy_channels(state: LegacyState) -> dict:
+    return {"type": state.type, "payload": state.payload, "result": state.result, "error": state.error}
+
+
+def legacy_flow(note: str, num_images: int, size: int):
+    """Returns what the handler holds when the response is built: its state and the graph output."""
+    task = "image_analysis" if num_images else "icd10"
+    state = LegacyState(type=None, payload={}, result=None, error=None)
+    state.payload["note"] = note
+    if num_images:
+        state.payload["images"] = [np.zeros((size, size, 3), np.uint8) for _ in range(num_images)]
+
+    # Router node: input rebuilt from the channels, output a new State
+    routed = LegacyState(**legacy_channels(state))
+    routed.payload["routing_tier"] = "heuristic"
+    routed.payload["clinical_note"] = routed.payload.get("note", "")
+    if task == "image_analysis":
+        routed.payload["images"] = routed.payload.get("images") or []
+    routed = LegacyState(type=task, payload=routed.payload, result=task, error=None)
+
+    # Task node
+    node_input = LegacyState(**legacy_channels(routed))
+    result = dict(REPORT) if task == "image_analysis" else [dict(c) for c in CODES]
+    output = LegacyState(type=task, payload=node_input.payload, result=result, error=None)
+
+    # Response: the graph's output values are turned back into a State
+    final = LegacyState(**legacy_channels(output))
+    return state, final
+
+
+def current_channels(state: State) -> dict:
+    return {"type": state.type, "payload": state.payload, "result": state.result, "error": state.error,
+            "routing_tier": state.routing_tier}
+
+
+def current_flow(note: str, num_images: int, size: int):
+    task = "image_analysis" if num_images else "icd10"
+    state = State(payload=RequestPayload(note=note))
+    if num_images:
+        state.payload.images = [np.zeros((size, size, 3), np.uint8) for _ in range(num_images)]
+
+    # Router node (RouterAgent.apply_route)
+    routed = State(**current_channels(state))
+    payload = task_payload(task, routed.payload)
+    routed.payload.images = None
+    routed.routing_tier, routed.type, routed.payload, routed.result = "heuristic", task, payload, task
+
+    # Task node; the image agent takes the images out of the payload for the encoder
+    node_input = State(**current_channels(routed))
+    if task == "image_analysis":
+        node_input.payload.images = None
+    node_input.result = dict(REPORT) if task == "image_analysis" else [dict(c) for c in CODES]
+
+    final = State(**current_channels(node_input))
+    return state, final
+
+
+def measure(flow, note: str, num_images: int, size: int, requests: int) -> dict:
+    flow(note, num_images, size)  # warm up caches (Pydantic validators, numpy)
+    gc.collect()
+    peaks, held, blocks, times = [], [], [], []
+    tracemalloc.start()
+    for i in range(requests):
+        gc.collect()
+        before_snapshot = tracemalloc.take_snapshot() if i == 0 else None
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        kept = flow(note, num_images, size)
+        times.append(time.perf_counter() - start)
+        current, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+        held.append(current - base)
+        if before_snapshot is not None:
+            diff = tracemalloc.take_snapshot().compare_to(before_snapshot, "filename")
+            blocks.append(sum(stat.count_diff for stat in diff if stat.count_diff > 0))
+        del kept
+    tracemalloc.stop()
+    return {
+        "peak_bytes": int(np.median(peaks)),
+        "held_at_response_bytes": int(np.median(held)),
+        "blocks_held_at_response": blocks[0],
+        "mean_us": 1e6 * sum(times) / len(times),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--note-chars", type=int, default=4000)
+    parser.add_argument("--images", type=int, default=1, help="Images per image request")
+    parser.add_argument("--image-size", type=int, default=config.IMAGE_INPUT_SIZE)
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    note = ("Patient presents with right lower quadrant pain and fever. " * (args.note_chars // 60 + 1))[:args.note_chars]
+    report = {"requests": args.requests, "note_chars": args.note_chars, "results": {}}
+    for label, num_images in (("text", 0), ("image", args.images)):
+        legacy = measure(legacy_flow, note, num_images, args.image_size, args.requests)
+        current = measure(current_flow, note, num_images, args.image_size, args.requests)
+        report["results"][label] = {
+            "legacy": legacy,
+            "current": current,
+            "peak_reduction": 1 - current["peak_bytes"] / legacy["peak_bytes"],
+            "held_reduction": 1 - current["held_at_response_bytes"] / max(legacy["held_at_response_bytes"], 1),
+        }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
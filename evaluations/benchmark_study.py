@@ -0,0 +1,125 @@
+"""
+Multi-image study latency: one consolidated request versus one request per image.
+
+A synthetic CT-like series is generated (slices of slowly changing anatomy, with
+runs of near-identical neighbours) and put through the same steps as
+/api/analyze with an `images` series:
+
+    preprocess   decode every slice, sequentially and in parallel on the image pool
+    select       near-duplicate subsampling (STUDY_DEDUP_THRESHOLD, STUDY_MAX_IMAGES)
+    analyze      the image agent, once with all selected slices (one vision batch,
+                 one report) and once per slice, as separate single-image requests
+
+Per-image and per-study latencies are reported for each step.
+
+Usage:
+    python -m evaluations.benchmark_study --slices 24 --output bench_study.json
+    python -m evaluations.benchmark_study --backend stub --slices 48 --max-images 8
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.config.config import config
+
+
+def synthetic_series(slices: int, size: int, repeat: int, seed: int = 0) -> list:
+    """PNG slices of an ellipsoid phantom; each distinct slice is repeated `repeat` times with noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size - 0.5
+    series = []
+    for i in range(slices):
+        depth = (i // repeat) / max(slices // repeat, 1) - 0.5
+        body = ((x / 0.4) ** 2 + (y / 0.3) ** 2 + (depth / 0.6) ** 2) < 1
+        organ = (((x - 0.1) / 0.1) ** 2 + (y / 0.08) ** 2 + ((depth - 0.1) / 0.3) ** 2) < 1
+        pixels = 0.1 + 0.5 * body + 0.3 * organ + rng.normal(0, 0.005, (size, size))
+        buffer = io.BytesIO()
+        Image.fromarray((pixels.clip(0, 1) * 255).astype(np.uint8)).save(buffer, "PNG")
+        series.append(buffer.getvalue())
+    return series
+
+
+def analyze(agent, images, note: str):
+    from app.graph.types import ImageAnalysisPayload, State
+
+    state = State(type="image_analysis", payload=ImageAnalysisPayload(images=list(images), clinical_note=note))
+    start = time.perf_counter()
+    output = agent.respond(state)
+    agent.parse_result(output.text)
+    return time.perf_counter() - start, output.prompt_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["mlx", "llamacpp", "stub"], default=None,
+                        help="Inference backend (default: INFERENCE_BACKEND)")
+    parser.add_argument("--slices", type=int, default=24)
+    parser.add_argument("--slice-size", type=int, default=512, help="Side of the generated slices in pixels")
+    parser.add_argument("--repeat", type=int, default=3, help="Near-identical copies of each distinct slice")
+    parser.add_argument("--max-images", type=int, default=config.STUDY_MAX_IMAGES)
+    parser.add_argument("--dedup-threshold", type=float, default=config.STUDY_DEDUP_THRESHOLD)
+    parser.add_argument("--note", default="Any focal lesion?")
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+    if args.backend:
+        config.INFERENCE_BACKEND = args.backend
+
+    from app.agents.image_analyzer_agent import ImageAnalyzerAgent
+    from app.utils.image_ingest import ingest_images, preprocess_image, select_study_images
+
+    series = synthetic_series(args.slices, args.slice_size, args.repeat)
+
+    start = time.perf_counter()
+    per_image_s = []
+    for data in series:
+        t = time.perf_counter()
+        preprocess_image(data)
+        per_image_s.append(time.perf_counter() - t)
+    sequential_s = time.perf_counter() - start
+    start = time.perf_counter()
+    images = asyncio.run(ingest_images(series))
+    parallel_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    kept = select_study_images(images, args.dedup_threshold, args.max_images)
+    select_s = time.perf_counter() - start
+    selected = [images[i] for i in kept]
+
+    agent = ImageAnalyzerAgent()
+    # One untimed call so kernel compilation does not skew the first sample
+    analyze(agent, selected[:1], args.note)
+    study_s, study_tokens = analyze(agent, selected, args.note)
+    separate = [analyze(agent, [image], args.note) for image in selected]
+
+    report = {
+        "backend": config.INFERENCE_BACKEND,
+        "slices": len(series),
+        "preprocess": {
+            "per_image_ms": 1000 * sum(per_image_s) / len(per_image_s),
+            "study_sequential_ms": 1000 * sequential_s,
+            "study_parallel_ms": 1000 * parallel_s,
+            "workers": config.IMAGE_PREPROCESS_WORKERS,
+        },
+        "select": {"kept": len(kept), "indices": kept, "ms": 1000 * select_s},
+        "analyze": {
+            "study_ms": 1000 * study_s,
+            "study_per_image_ms": 1000 * study_s / len(selected),
+            "study_prompt_tokens": study_tokens,
+            "separate_total_ms": 1000 * sum(s for s, _ in separate),
+            "separate_per_image_ms": 1000 * sum(s for s, _ in separate) / len(separate),
+            "separate_prompt_tokens": sum(t for _, t in separate),
+        },
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
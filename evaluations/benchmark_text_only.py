@@ -0,0 +1,87 @@
+"""
+Compare the legacy "dummy image" inference path with the text-only path on the
+ICD-10 evaluation dataset.
+
+The legacy path is reproduced here as it was before text-only generation existed:
+a 224x224 black placeholder image pushed through the vision tower, one image token
+block in the chat template and the image repr in the prompt text.
+
+Usage:
+    python -m evaluations.benchmark_text_only --limit 20 --max-tokens 256 --output bench_text_only.json
+"""
+import argparse
+import json
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from app.backends import get_backend
+from app.utils.prompt_builder import build_icd10_prompt
+
+DATASET_PATH = "evaluations/synthetic_icd10_dataset.json"
+
+
+def _legacy_prompt(note: str, image: Image.Image) -> str:
+    return build_icd10_prompt(note) + f"    Image: {image}\n    "
+
+
+def _run(backend, notes, mode: str, max_tokens: int) -> dict:
+    prompt_tokens, prefill_s, latency_s = [], [], []
+    for note in notes:
+        if mode == "legacy":
+            dummy = Image.fromarray(np.zeros((224, 224, 3), dtype=np.uint8))
+            prompt, images = _legacy_prompt(note, dummy), [dummy]
+        else:
+            prompt, images = build_icd10_prompt(note), None
+
+        start = time.perf_counter()
+        result = backend.generate(prompt, images, max_tokens=max_tokens)
+        latency_s.append(time.perf_counter() - start)
+        prompt_tokens.append(result.prompt_tokens)
+        prefill_s.append(result.prompt_tokens / result.prompt_tps if result.prompt_tps else 0.0)
+
+    return {
+        "mode": mode,
+        "notes": len(notes),
+        "mean_prompt_tokens": statistics.mean(prompt_tokens),
+        "mean_prefill_ms": 1000 * statistics.mean(prefill_s),
+        "p50_latency_ms": 1000 * statistics.median(latency_s),
+        "mean_latency_ms": 1000 * statistics.mean(latency_s),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N notes")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--output", default=None, help="Write the report as JSON to this path")
+    args = parser.parse_args()
+
+    with open(args.dataset) as f:
+        notes = [item["note"] for item in json.load(f)][: args.limit]
+
+    backend = get_backend()
+    # One untimed call per path so kernel compilation does not skew the first sample
+    for mode in ("legacy", "text_only"):
+        _run(backend, notes[:1], mode, max_tokens=8)
+
+    report = [_run(backend, notes, mode, args.max_tokens) for mode in ("legacy", "text_only")]
+    legacy, text_only = report
+    summary = {
+        "results": report,
+        "prompt_tokens_saved": legacy["mean_prompt_tokens"] - text_only["mean_prompt_tokens"],
+        "prefill_speedup": legacy["mean_prefill_ms"] / text_only["mean_prefill_ms"] if text_only["mean_prefill_ms"] else None,
+        "latency_speedup": legacy["mean_latency_ms"] / text_only["mean_latency_ms"] if text_only["mean_latency_ms"] else None,
+    }
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from app.utils.icd10_index import ICD10Index, build_index
+
+CODES = [
+    ("K3580", "Unspecified acute appendicitis"),
+    ("K352", "Acute appendicitis with generalized peritonitis"),
+    ("R109", "Unspecified abdominal pain"),
+    ("R509", "Fever, unspecified"),
+    ("J189", "Pneumonia, unspecified organism"),
+    ("I10", "Essential (primary) hypertension"),
+    ("E119", "Type 2 diabetes mellitus without complications"),
+]
+
+
+@pytest.fixture
+def icd10_table(tmp_path) -> ICD10Index:
+    path = str(tmp_path / "icd10cm.idx")
+    build_index(CODES, path)
+    return ICD10Index(path)
+
+
+class Clock:
+    """Stands in for `time.time`, so expiry can be tested without sleeping."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
@@ -0,0 +1,139 @@
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import app.batch as batch
+from app.batch import Checkpoint, iter_json_array, iter_records, run_batch
+
+NOTES = [{"id": f"n{i}", "note": f"note {i}"} for i in range(4)]
+
+
+class ScriptedAgent:
+    """Codes every note as R10.9; raises `interrupt` on the notes listed in `stop_at`."""
+
+    stop_at = set()
+    interrupt = KeyboardInterrupt
+    seen = []
+
+    def respond(self, state):
+        note = state.payload.clinical_note
+        if note in self.stop_at:
+            raise self.interrupt(note)
+        self.seen.append(note)
+        return SimpleNamespace(text="R10.9", prompt_tokens=10, generation_tokens=2)
+
+    def parse_result(self, text):
+        return [{"code": text, "description": "Unspecified abdominal pain"}]
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    monkeypatch.setattr(batch, "ICD10Agent", ScriptedAgent)
+    monkeypatch.setattr(ScriptedAgent, "stop_at", set())
+    monkeypatch.setattr(ScriptedAgent, "interrupt", KeyboardInterrupt)
+    monkeypatch.setattr(ScriptedAgent, "seen", [])
+    return ScriptedAgent
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+    return str(path)
+
+
+def read_rows(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_json_array_elements_split_across_reads(monkeypatch):
+    monkeypatch.setattr(batch, "READ_CHUNK_SIZE", 7)
+    text = ' [ {"note": "a, [b]"}, "plain note" ,{"id": 3, "note": "c"} ] '
+    assert list(iter_json_array(io.StringIO(text))) == [{"note": "a, [b]"}, "plain note", {"id": 3, "note": "c"}]
+
+
+def test_json_array_rejects_other_documents():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"note": "a"}')))
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO('[{"note": "a"')))
+
+
+def test_records_from_jsonl_and_array(tmp_path):
+    jsonl = write_jsonl(tmp_path / "notes.jsonl", NOTES[:2])
+    array = tmp_path / "notes.json"
+    array.write_text("\n  " + json.dumps(NOTES[:2]))
+    assert list(iter_records(jsonl)) == NOTES[:2]
+    assert list(iter_records(str(array))) == NOTES[:2]
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "run.checkpoint")
+    checkpoint = Checkpoint(path, "/data/notes.jsonl")
+    checkpoint.next_index, checkpoint.output_offset, checkpoint.prompt_tokens = 3, 120, 30
+    checkpoint.save()
+    loaded = Checkpoint(path, "/data/notes.jsonl")
+    loaded.load()
+    assert (loaded.next_index, loaded.output_offset, loaded.prompt_tokens) == (3, 120, 30)
+    with pytest.raises(ValueError):
+        Checkpoint(path, "/data/other.jsonl").load()
+
+
+def test_run_writes_one_row_per_note(tmp_path, agent):
+    output = str(tmp_path / "codes.jsonl")
+    report = run_batch(write_jsonl(tmp_path / "notes.jsonl", NOTES), output, output + ".checkpoint")
+    rows = read_rows(output)
+    assert [r["id"] for r in rows] == ["n0", "n1", "n2", "n3"]
+    assert rows[0]["codes"] == [{"code": "R10.9", "description": "Unspecified abdominal pain"}]
+    assert (report["processed"], report["total_done"]) == (4, 4)
+
+
+def test_fresh_run_appends_to_existing_output(tmp_path, agent):
+    notes = write_jsonl(tmp_path / "notes.jsonl", NOTES)
+    output = tmp_path / "codes.jsonl"
+    previous = '{"index": 0, "id": "earlier-run"}\n'
+    output.write_text(previous)
+
+    agent.stop_at = {"note 2"}
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(notes, str(output), str(output) + ".checkpoint")
+    agent.stop_at = set()
+    run_batch(notes, str(output), str(output) + ".checkpoint")
+
+    assert output.read_text().startswith(previous)
+    assert [r["id"] for r in read_rows(output)] == ["earlier-run", "n0", "n1", "n2", "n3"]
+
+
+def test_failed_note_is_recorded_and_run_continues(tmp_path, agent):
+    agent.stop_at, agent.interrupt = {"note 1"}, RuntimeError
+    output = str(tmp_path / "codes.jsonl")
+    run_batch(write_jsonl(tmp_path / "notes.jsonl", NOTES), output, output + ".checkpoint")
+    rows = read_rows(output)
+    assert len(rows) == 4
+    assert (rows[1]["codes"], rows[1]["error"]) == ([], "note 1")
+
+
+def test_resume_after_crash_skips_done_notes_and_torn_output(tmp_path, agent):
+    notes = write_jsonl(tmp_path / "notes.jsonl", NOTES)
+    output = str(tmp_path / "codes.jsonl")
+    agent.stop_at = {"note 2"}
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(notes, output, output + ".checkpoint")
+    # A row written after the last checkpoint landed, cut short by the crash
+    with open(output, "a") as f:
+        f.write('{"index": 2, "id": "n2", "co')
+
+    agent.stop_at = set()
+    report = run_batch(notes, output, output + ".checkpoint")
+    assert agent.seen == ["note 0", "note 1", "note 2", "note 3"]
+    assert [r["index"] for r in read_rows(output)] == [0, 1, 2, 3]
+    assert (report["processed"], report["total_done"]) == (2, 4)
+
+
+def test_limit_stops_early_and_rerun_continues(tmp_path, agent):
+    notes = write_jsonl(tmp_path / "notes.jsonl", NOTES)
+    output = str(tmp_path / "codes.jsonl")
+    assert run_batch(notes, output, output + ".checkpoint", limit=2)["total_done"] == 2
+    assert run_batch(notes, output, output + ".checkpoint")["processed"] == 2
+    assert len(read_rows(output)) == 4
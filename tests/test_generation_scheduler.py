@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("mlx.core")
+pytest.importorskip("mlx_vlm")
+
+import app.utils.generation_scheduler as generation_scheduler
+from app.utils.generation_scheduler import GenerationRequest, GenerationScheduler, generate_together, split_batch
+
+
+def request(prompt_tokens: int, max_tokens: int = 64) -> GenerationRequest:
+    return GenerationRequest(input_ids=[1] * prompt_tokens, max_tokens=max_tokens)
+
+
+def test_short_prompts_are_batched():
+    batch = [request(100), request(200), request(300)]
+    batchable, singles = split_batch(batch, max_prompt_tokens=2048, window=1024)
+    assert len(batchable) == 3 and singles == []
+
+
+def test_prompt_longer_than_window_runs_alone():
+    long = request(1500)
+    batch = [request(100), request(200), long]
+    batchable, singles = split_batch(batch, max_prompt_tokens=2048, window=1024)
+    assert singles == [long]
+    assert long not in batchable and len(batchable) == 2
+
+
+def test_generation_that_would_outgrow_window_runs_alone():
+    # The prompt fits, but the decode steps would push the keys past the window
+    wide = request(900, max_tokens=512)
+    batchable, singles = split_batch([request(100), request(100), wide], max_prompt_tokens=2048, window=1024)
+    assert singles == [wide] and len(batchable) == 2
+
+
+def test_lone_batchable_request_uses_single_path():
+    short, long = request(100), request(1500)
+    batchable, singles = split_batch([short, long], max_prompt_tokens=2048, window=1024)
+    assert batchable == [] and set(map(id, singles)) == {id(short), id(long)}
+
+
+def test_no_window_only_applies_prompt_limit():
+    batch = [request(1500), request(1800), request(3000)]
+    batchable, singles = split_batch(batch, max_prompt_tokens=2048, window=None)
+    assert len(batchable) == 2 and len(singles) == 1
+
+
+def fake_single(model, processor, request):
+    return f"single {len(request.input_ids)}"
+
+
+def fake_batch(model, processor, requests):
+    return [f"batch {len(r.input_ids)}" for r in requests]
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(generation_scheduler, "sliding_window", lambda language_model: None)
+    monkeypatch.setattr(generation_scheduler, "generate_single", fake_single)
+    return lambda **kwargs: GenerationScheduler(SimpleNamespace(language_model=None), None, **kwargs)
+
+
+def test_scheduler_keeps_running_after_a_failed_iteration(monkeypatch, scheduler):
+    calls = []
+
+    def flaky_split(batch, max_prompt_tokens, window=None):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("split failed")
+        return [], list(batch)
+
+    monkeypatch.setattr(generation_scheduler, "split_batch", flaky_split)
+    scheduler = scheduler(max_batch_size=1)
+    failed = GenerationRequest([1, 2], 8)
+    scheduler._queue.put(failed)
+    with pytest.raises(RuntimeError, match="split failed"):
+        failed.future.result(timeout=5)
+    assert scheduler.submit([1, 2, 3], 8) == "single 3"
+
+
+def test_partially_delivered_batch_fails_only_the_rest(monkeypatch, scheduler):
+    def failing_batch(model, processor, requests):
+        yield "first"
+        raise RuntimeError("decode failed")
+
+    monkeypatch.setattr(generation_scheduler, "split_batch", lambda batch, *args: (list(batch), []))
+    monkeypatch.setattr(generation_scheduler, "generate_batch", failing_batch)
+    scheduler = scheduler(max_batch_size=2, max_wait_ms=10_000)
+    first, second = GenerationRequest([1], 8), GenerationRequest([2], 8)
+    scheduler._queue.put(first)
+    scheduler._queue.put(second)
+    assert first.future.result(timeout=5) == "first"
+    with pytest.raises(RuntimeError, match="decode failed"):
+        second.future.result(timeout=5)
+    assert scheduler._thread.is_alive()
+
+
+def test_related_requests_are_batched_together(monkeypatch, scheduler):
+    monkeypatch.setattr(generation_scheduler, "generate_batch", fake_batch)
+    scheduler = scheduler(max_batch_size=4, max_wait_ms=50)
+    requests = [GenerationRequest([1] * n, 8) for n in (30, 10, 20)]
+    assert scheduler.submit_many(requests) == ["batch 30", "batch 10", "batch 20"]
+    assert scheduler.stats()["batch_sizes"] == {3: 1}
+
+
+def test_generate_together_runs_on_the_calling_thread_in_groups(monkeypatch):
+    batches = []
+
+    def recording_batch(model, processor, requests):
+        batches.append(len(requests))
+        return fake_batch(model, processor, requests)
+
+    monkeypatch.setattr(generation_scheduler, "sliding_window", lambda language_model: 1024)
+    monkeypatch.setattr(generation_scheduler, "generate_batch", recording_batch)
+    monkeypatch.setattr(generation_scheduler, "generate_single", fake_single)
+    requests = [GenerationRequest([1] * n, 8) for n in (10, 20, 30, 2000, 40)]
+    outputs = generate_together(SimpleNamespace(language_model=None), None, requests, max_batch_size=2)
+    # The second group pairs a prompt too long to batch with one that would be alone: both run singly
+    assert outputs == ["batch 10", "batch 20", "single 30", "single 2000", "single 40"]
+    assert batches == [2]
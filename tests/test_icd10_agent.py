@@ -0,0 +1,79 @@
+import pytest
+
+from app.agents.base_agent import BaseAgent
+from app.agents.icd10_agent import FULL_SCHEMA, ICD10Agent
+from app.backends.stub_backend import StubBackend
+from app.config.config import config
+from app.graph.types import ICD10Payload, State
+
+
+@pytest.fixture
+def agent(icd10_table) -> ICD10Agent:
+    # Only the parsing path is exercised, so no backend is loaded
+    agent = ICD10Agent.__new__(ICD10Agent)
+    BaseAgent.__init__(agent, "ICD10Agent")
+    agent.index = icd10_table
+    return agent
+
+
+def codes(result):
+    return [entry["code"] for entry in result]
+
+
+def test_strict_compact_output(agent):
+    result = agent.parse_result('["K35.80", "R10.9"]')
+    assert result == [
+        {"code": "K35.80", "description": "Unspecified acute appendicitis"},
+        {"code": "R10.9", "description": "Unspecified abdominal pain"},
+    ]
+
+
+def test_fenced_compact_output(agent):
+    assert codes(agent.parse_result('```json\n["K35.80", "R10.9"]\n```')) == ["K35.80", "R10.9"]
+
+
+def test_compact_output_cut_off_at_token_cap(agent):
+    # The last code never closed; the complete ones are kept
+    assert codes(agent.parse_result('["K35.80", "R10.9", "R5')) == ["K35.80", "R10.9"]
+
+
+def test_compact_output_without_dots_is_canonicalized(agent):
+    assert codes(agent.parse_result('["k3580", "R509"]')) == ["K35.80", "R50.9"]
+
+
+def test_unknown_code_is_flagged(agent):
+    result = agent.parse_result('["Z99.999"]')
+    assert result == [{"code": "Z99.999", "description": "", "flag": "not_in_code_table"}]
+
+
+def test_full_output_cut_off_recovers_complete_objects(agent):
+    raw = '[{"code": "K35.80", "description": "Appendicitis"}, {"code": "R10.9", "descr'
+    assert agent.parse_result(raw) == [{"code": "K35.80", "description": "Unspecified acute appendicitis"}]
+
+
+def test_duplicates_are_dropped(agent):
+    assert codes(agent.parse_result('["K35.80", "K3580", "R10.9"]')) == ["K35.80", "R10.9"]
+
+
+class RecordingBackend(StubBackend):
+    def __init__(self):
+        self.batches = []
+
+    def generate_batch(self, prompts, **kwargs):
+        self.batches.append(len(prompts))
+        return super().generate_batch(prompts, **kwargs)
+
+
+def test_long_note_chunks_are_generated_as_one_batch(agent, monkeypatch):
+    for name, value in (("CHUNKING_ENABLED", True), ("CHUNK_MAX_TOKENS", 64), ("CHUNK_OVERLAP_TOKENS", 0),
+                        ("STUB_PREFILL_MS_PER_TOKEN", 0.0), ("STUB_DECODE_MS_PER_TOKEN", 0.0)):
+        monkeypatch.setattr(config, name, value)
+    agent.backend, agent.retriever, agent.compact = RecordingBackend(), None, False
+    agent.prefix_key, agent.output_schema = "icd10", FULL_SCHEMA
+    note = "\n\n".join(f"Assessment {i}: right lower quadrant pain with fever and nausea for two days." * 2
+                        for i in range(6))
+
+    response = agent.respond(State(type="icd10", payload=ICD10Payload(clinical_note=note)))
+    assert len(agent.backend.batches) == 1 and agent.backend.batches[0] > 1
+    # Every chunk returned the same code, which is kept once
+    assert codes(agent.parse_result(response.text)) == ["R69"]
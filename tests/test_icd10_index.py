@@ -0,0 +1,62 @@
+import pytest
+
+from app.utils.icd10_index import ICD10Index, build_index, display_code, normalize_code, read_cms_codes
+
+
+def test_code_forms():
+    assert normalize_code(" k35.80 ") == "K3580"
+    assert display_code("K3580") == "K35.80"
+    assert display_code("i10") == "I10"
+
+
+def test_lookup_dotted_and_dotless(icd10_table):
+    assert len(icd10_table) == 7
+    assert icd10_table.lookup("K35.80") == "Unspecified acute appendicitis"
+    assert icd10_table.lookup("k3580") == "Unspecified acute appendicitis"
+    assert icd10_table.lookup("I10") == "Essential (primary) hypertension"
+    assert "R50.9" in icd10_table
+    assert "K35.8" not in icd10_table
+    assert icd10_table.lookup("Z99.99") is None
+
+
+@pytest.mark.parametrize("code", ["", "K35.800000000", "K35.8é"])
+def test_lookup_of_invalid_code_misses(icd10_table, code):
+    assert icd10_table.lookup(code) is None
+
+
+def test_search_prefix_in_code_order(icd10_table):
+    assert icd10_table.search_prefix("K35") == [
+        ("K35.2", "Acute appendicitis with generalized peritonitis"),
+        ("K35.80", "Unspecified acute appendicitis"),
+    ]
+    assert icd10_table.search_prefix("k35.8") == [("K35.80", "Unspecified acute appendicitis")]
+    assert icd10_table.search_prefix("R", limit=1) == [("R10.9", "Unspecified abdominal pain")]
+    assert icd10_table.search_prefix("Z") == []
+
+
+def test_later_duplicate_wins_and_entries_are_sorted(tmp_path):
+    path = str(tmp_path / "dup.idx")
+    assert build_index([("R10.9", "old"), ("A00.0", "Cholera"), ("R109", "new ")], path) == 2
+    table = ICD10Index(path)
+    assert [table.entry(i) for i in range(len(table))] == [("A00.0", "Cholera"), ("R10.9", "new")]
+
+
+def test_build_rejects_invalid_code(tmp_path):
+    with pytest.raises(ValueError):
+        build_index([("TOOLONGCODE", "x")], str(tmp_path / "bad.idx"))
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "other.idx"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        ICD10Index(str(path))
+
+
+def test_read_cms_codes(tmp_path):
+    path = tmp_path / "icd10cm_codes.txt"
+    path.write_text("A000    Cholera due to Vibrio cholerae 01, biovar cholerae\nbroken\nI10     Essential hypertension\n")
+    assert read_cms_codes(str(path)) == [
+        ("A000", "Cholera due to Vibrio cholerae 01, biovar cholerae"),
+        ("I10", "Essential hypertension"),
+    ]
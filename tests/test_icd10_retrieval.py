@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+import app.utils.icd10_retrieval as icd10_retrieval
+from app.config.config import config
+from app.utils.icd10_index import ICD10Index, build_index
+from app.utils.icd10_retrieval import (
+    ICD10Retriever, build_retrieval_index, get_icd10_retriever, read_synonyms, tokenize
+)
+
+
+@pytest.fixture
+def retriever(icd10_table, tmp_path) -> ICD10Retriever:
+    path = str(tmp_path / "icd10_bm25.npz")
+    build_retrieval_index(icd10_table, path, synonyms={"I10": ["high blood pressure"]})
+    return ICD10Retriever(path, icd10_table)
+
+
+@pytest.fixture
+def load_retriever(icd10_table, monkeypatch):
+    """Load the process-wide retriever from `path` as if for the first time."""
+    def load(path):
+        monkeypatch.setattr(config, "ICD10_RETRIEVAL_INDEX_PATH", str(path))
+        monkeypatch.setattr(icd10_retrieval, "get_icd10_index", lambda: icd10_table)
+        monkeypatch.setattr(icd10_retrieval, "_retriever", None)
+        monkeypatch.setattr(icd10_retrieval, "_retriever_loaded", False)
+        return get_icd10_retriever()
+    return load
+
+
+def test_tokenize_drops_stopwords_and_short_tokens():
+    assert tokenize("Patient presents with RLQ pain, x 2 days and T2 diabetes.") == [
+        "rlq", "pain", "days", "t2", "diabetes"]
+
+
+def test_best_match_ranks_first(retriever):
+    codes = [code for code, _ in retriever.search("Acute appendicitis with peritonitis")]
+    assert codes[0] == "K35.2"
+    assert set(codes) == {"K35.2", "K35.80"}
+
+
+def test_only_matching_codes_are_returned(retriever):
+    assert retriever.search("fever") == [("R50.9", "Fever, unspecified")]
+    assert retriever.search("unrelated words only") == []
+    assert retriever.search("") == []
+
+
+def test_k_limits_results(retriever):
+    assert len(retriever.search("unspecified", k=2)) == 2
+    assert len(retriever.search("unspecified")) == 4
+
+
+def test_synonyms_are_searchable(retriever):
+    assert retriever.search("history of high blood pressure")[0][0] == "I10"
+
+
+def test_index_built_for_another_table_is_rejected(icd10_table, tmp_path):
+    path = str(tmp_path / "icd10_bm25.npz")
+    build_retrieval_index(icd10_table, path)
+    other_path = str(tmp_path / "other.idx")
+    build_index([("I10", "Essential (primary) hypertension")], other_path)
+    with pytest.raises(ValueError):
+        ICD10Retriever(path, ICD10Index(other_path))
+
+
+def test_read_synonyms(tmp_path):
+    path = tmp_path / "synonyms.tsv"
+    path.write_text("I10\thigh blood pressure\ni10\tHTN\nbroken line\n")
+    assert read_synonyms(str(path)) == {"I10": ["high blood pressure", "HTN"]}
+
+
+def test_shared_retriever_loads_once(load_retriever, icd10_table, tmp_path):
+    path = tmp_path / "icd10_bm25.npz"
+    build_retrieval_index(icd10_table, str(path))
+    retriever = load_retriever(path)
+    assert retriever is not None and get_icd10_retriever() is retriever
+
+
+def test_stale_index_is_skipped(load_retriever, tmp_path):
+    other_table = str(tmp_path / "other.idx")
+    build_index([("I10", "Essential (primary) hypertension")], other_table)
+    path = tmp_path / "icd10_bm25.npz"
+    build_retrieval_index(ICD10Index(other_table), str(path))
+    assert load_retriever(path) is None
+
+
+@pytest.mark.parametrize("content", [b"", b"not an archive", b"PK\x03\x04truncated"])
+def test_corrupt_index_is_skipped(load_retriever, tmp_path, content):
+    path = tmp_path / "icd10_bm25.npz"
+    path.write_bytes(content)
+    assert load_retriever(path) is None
+
+
+def test_index_missing_arrays_is_skipped(load_retriever, tmp_path):
+    path = tmp_path / "icd10_bm25.npz"
+    np.savez(path, vocab=np.array(["fever"]))
+    assert load_retriever(path) is None
+
+
+def test_missing_index_is_skipped(load_retriever, tmp_path):
+    assert load_retriever(tmp_path / "absent.npz") is None
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from app.utils.job_queue import JobQueue, JobQueueFullError, decode_images, encode_images
+
+
+@pytest.fixture
+def queue(tmp_path, clock) -> JobQueue:
+    return JobQueue(str(tmp_path / "jobs.db"), max_queued=10, max_attempts=3, retry_backoff_s=5.0,
+                    lease_s=60.0, result_ttl_s=100.0)
+
+
+def test_images_round_trip():
+    images = [np.arange(12, dtype=np.uint8).reshape(2, 2, 3), np.ones((4, 4, 3), np.uint8)]
+    decoded = decode_images(encode_images(images))
+    assert len(decoded) == 2
+    assert all(np.array_equal(a, b) for a, b in zip(images, decoded))
+    assert encode_images(None) is None and encode_images([]) is None
+    assert decode_images(None) is None
+
+
+def test_claim_returns_stored_inputs(queue):
+    image = np.zeros((2, 2, 3), np.uint8)
+    job_id = queue.submit("image_analysis", "note", [image], {"modality": "CR"})
+    job = queue.claim()
+    assert (job.id, job.task, job.note, job.study, job.attempts) == (job_id, "image_analysis", "note",
+                                                                     {"modality": "CR"}, 1)
+    assert np.array_equal(job.images[0], image)
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.claim() is None
+
+
+def test_interactive_jobs_are_claimed_before_backfill(queue, clock):
+    backfill = queue.submit("icd10", "a", priority="backfill")
+    clock.now += 1
+    first = queue.submit("icd10", "b")
+    clock.now += 1
+    second = queue.submit("icd10", "c")
+    assert [queue.claim().id for _ in range(3)] == [first, second, backfill]
+
+
+def test_full_queue_rejects_submissions(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_queued=2)
+    queue.submit("icd10", "a")
+    queue.submit("icd10", "b")
+    with pytest.raises(JobQueueFullError):
+        queue.submit("icd10", "c")
+    # Running jobs do not count against the limit
+    queue.claim()
+    queue.submit("icd10", "c")
+    assert queue.stats()["rejected"] == 1
+
+
+def test_complete_stores_result(queue):
+    job_id = queue.submit("icd10", "note")
+    queue.complete(queue.claim().id, {"agent": "icd10", "result": []})
+    job = queue.get(job_id)
+    assert (job["status"], job["result"], job["error"]) == ("succeeded", {"agent": "icd10", "result": []}, None)
+
+
+def test_retries_back_off_exponentially_then_fail(queue, clock):
+    job_id = queue.submit("icd10", "note")
+    for attempt, backoff_s in ((1, 5.0), (2, 10.0)):
+        job = queue.claim()
+        assert job.attempts == attempt
+        assert queue.fail(job_id, "boom", retry=True) == "queued"
+        clock.now += backoff_s - 0.5
+        assert queue.claim() is None
+        clock.now += 0.5
+    queue.claim()
+    assert queue.fail(job_id, "boom", retry=True) == "failed"
+    job = queue.get(job_id)
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", 3, "boom")
+    assert queue.stats()["retried"] == 2
+
+
+def test_non_retryable_failure_fails_at_once(queue):
+    job_id = queue.submit("icd10", "note")
+    queue.claim()
+    assert queue.fail(job_id, "unparseable output", retry=False) == "failed"
+    assert queue.fail(job_id, "again", retry=True) == "unknown"
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    job_id = queue.submit("icd10", "note")
+    queue.claim()
+    clock.now += 59
+    assert queue.claim() is None
+    clock.now += 2
+    # Requeued with backoff like a failed attempt
+    assert queue.claim() is None
+    assert queue.get(job_id)["error"] == "Worker stopped before finishing the job."
+    clock.now += 5
+    job = queue.claim()
+    assert (job.id, job.attempts) == (job_id, 2)
+    assert queue.stats()["lease_expired"] == 1
+
+
+def test_lease_expiring_on_last_attempt_fails_the_job(tmp_path, clock):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_attempts=1, lease_s=60.0)
+    job_id = queue.submit("icd10", "note")
+    queue.claim()
+    clock.now += 61
+    assert queue.claim() is None
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_release_does_not_count_an_attempt(queue, clock):
+    job_id = queue.submit("icd10", "note")
+    queue.claim()
+    queue.release(job_id, delay_s=1.0)
+    assert queue.claim() is None
+    clock.now += 1
+    assert queue.claim().attempts == 1
+
+
+def test_only_queued_jobs_can_be_cancelled(queue):
+    waiting = queue.submit("icd10", "a")
+    running = queue.submit("icd10", "b")
+    assert queue.cancel(waiting)
+    assert queue.claim().id == running
+    assert not queue.cancel(running)
+    assert queue.get(waiting)["status"] == "cancelled"
+
+
+def test_finished_jobs_expire_and_are_purged(queue, clock):
+    job_id = queue.submit("icd10", "note")
+    pending = queue.submit("icd10", "other")
+    queue.complete(queue.claim().id, {})
+    clock.now += 101
+    assert queue.get(job_id) is None
+    assert queue.purge() == 1
+    assert queue.get(pending)["status"] == "queued"
+
+
+def test_jobs_survive_reopening(tmp_path, clock):
+    path = str(tmp_path / "jobs.db")
+    job_id = JobQueue(path).submit("soap", "transcript", priority="backfill")
+    job = JobQueue(path).claim()
+    assert (job.id, job.priority, job.note) == (job_id, "backfill", "transcript")
+
+
+def test_depth_per_priority(queue, clock):
+    queue.submit("icd10", "a", priority="backfill")
+    queue.submit("icd10", "b", priority="backfill")
+    queue.submit("icd10", "c")
+    queue.claim()
+    clock.now += 3
+    depth = queue.depth()
+    assert depth["interactive"] == {"queued": 0, "running": 1, "oldest_queued_age_s": 0.0}
+    assert depth["backfill"]["queued"] == 2
+    assert depth["backfill"]["oldest_queued_age_s"] == pytest.approx(3)
@@ -0,0 +1,116 @@
+import pytest
+from pydantic import BaseModel
+
+from app.agents.icd10_agent import COMPACT_SCHEMA, FULL_SCHEMA
+from app.api.schemas import RadiologyReport
+from app.utils.json_constraint import MAX_WHITESPACE_RUN, JSONStopper, OutputSchema
+
+REPORT_SCHEMA = OutputSchema.from_model(RadiologyReport)
+REPORT = ('{"technique": "PA chest", "findings": "Clear lungs", "impression": "Normal", '
+          '"recommendations": "None", "answer_to_user_question": null}')
+
+
+def accepts(schema: OutputSchema, text: str) -> bool:
+    matcher = schema.matcher()
+    return matcher.feed_text(text) and matcher.complete
+
+
+def test_schema_from_model():
+    assert FULL_SCHEMA.fields == [("code", False), ("description", False)]
+    assert REPORT_SCHEMA.fields[-1] == ("answer_to_user_question", True)
+    assert FULL_SCHEMA.json_schema()["items"]["required"] == ["code", "description"]
+    assert COMPACT_SCHEMA.json_schema() == {"type": "array", "items": {"type": "string"}}
+
+
+def test_schema_rejects_non_string_fields():
+    class Scored(BaseModel):
+        score: int
+
+    with pytest.raises(ValueError):
+        OutputSchema.from_model(Scored)
+
+
+@pytest.mark.parametrize("text", [
+    '[{"code": "K35.80", "description": "Acute appendicitis"}]',
+    '[ {"code":"K35.80","description":"A"} , {"code":"R10.9","description":"B \\"quoted\\" \\u00e9"} ]',
+    "[]",
+])
+def test_full_schema_accepts(text):
+    assert accepts(FULL_SCHEMA, text)
+
+
+@pytest.mark.parametrize("text", [
+    '[{"description": "A", "code": "K35.80"}]',  # fields out of order
+    '[{"code": "K35.80"}]',  # missing field
+    '[{"code": "K35.80", "description": "A", "flag": "x"}]',  # extra field
+    '[{"code": null, "description": "A"}]',  # null in a required field
+    '["K35.80"]',  # string instead of object
+    '{"code": "K35.80", "description": "A"}',  # object instead of array
+])
+def test_full_schema_rejects(text):
+    assert not accepts(FULL_SCHEMA, text)
+
+
+def test_nullable_field_accepts_null_or_string():
+    assert accepts(REPORT_SCHEMA, REPORT)
+    assert accepts(REPORT_SCHEMA, REPORT.replace("null", '"Yes"'))
+    assert not accepts(REPORT_SCHEMA, REPORT.replace("null", "nul!"))
+
+
+def test_compact_schema():
+    assert accepts(COMPACT_SCHEMA, '["K35.80", "R10.9"]')
+    assert not accepts(COMPACT_SCHEMA, '["K35.80", ]')
+    assert not accepts(COMPACT_SCHEMA, '[{"code": "K35.80"}]')
+
+
+def test_rejected_character_leaves_state_unchanged():
+    matcher = COMPACT_SCHEMA.matcher()
+    assert matcher.feed_text('["K35')
+    assert not matcher.feed_text('.80" x')
+    assert not matcher.feed("\n")  # control characters are not allowed inside strings
+    assert matcher.feed_text('.80"]')
+    assert matcher.complete
+
+
+def test_invalid_escape_is_rejected():
+    matcher = COMPACT_SCHEMA.matcher()
+    assert not matcher.feed_text('["\\x"]')
+    assert not matcher.feed_text('["\\u12g4"]')
+    assert matcher.feed_text('["\\u12aF"]')
+
+
+def test_whitespace_runs_are_bounded():
+    matcher = COMPACT_SCHEMA.matcher()
+    assert matcher.feed_text("[" + " " * MAX_WHITESPACE_RUN)
+    assert not matcher.feed(" ")
+    assert matcher.feed_text('"K35.80"' + " " * MAX_WHITESPACE_RUN)
+    assert not matcher.feed(" ")
+    # Spaces inside a string do not count as whitespace between tokens
+    assert matcher.feed_text(', "' + " " * (2 * MAX_WHITESPACE_RUN) + '"]')
+    assert matcher.complete
+
+
+def test_clone_is_independent():
+    matcher = COMPACT_SCHEMA.matcher()
+    matcher.feed_text('["K35.80"')
+    clone = matcher.clone()
+    assert clone.feed("]") and clone.complete
+    assert not matcher.complete
+
+
+def test_stopper_reports_end_offset_after_fence():
+    stopper = JSONStopper(COMPACT_SCHEMA)
+    assert stopper.feed("```json\n[\"K35") is None
+    assert stopper.feed('.80"]\n```') == 5
+
+
+def test_stopper_value_closing_in_first_chunk():
+    stopper = JSONStopper(REPORT_SCHEMA)
+    assert stopper.feed("Here it is: " + REPORT + " trailing") == len("Here it is: " + REPORT)
+
+
+def test_stopper_gives_up_after_invalid_output():
+    stopper = JSONStopper(FULL_SCHEMA)
+    assert stopper.feed('[{"cod": ') is None
+    assert stopper.failed
+    assert stopper.feed('"K35.80"}]') is None
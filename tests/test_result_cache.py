@@ -0,0 +1,97 @@
+import os
+
+from app.utils.result_cache import ResultCache, make_cache_key, settings_version
+
+
+def test_key_depends_on_namespace():
+    assert make_cache_key("abc", "model-a:v1") != make_cache_key("abc", "model-a:v2")
+    assert ResultCache("model-a:v1").key("abc") == make_cache_key("abc", "model-a:v1")
+
+
+def test_hit_and_miss():
+    cache = ResultCache("ns")
+    assert cache.get("k") is None
+    cache.put("k", {"agent": "icd10", "result": []})
+    assert cache.get("k") == {"agent": "icd10", "result": []}
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResultCache("ns", ttl_s=10)
+    cache.put("k", {"v": 1})
+    clock.now += 9
+    assert cache.get("k") == {"v": 1}
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache("ns", max_entries=2)
+    cache.put("a", {"v": "a"})
+    cache.put("b", {"v": "b"})
+    cache.get("a")
+    cache.put("c", {"v": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": "a"}
+    assert cache.get("c") == {"v": "c"}
+
+
+def test_results_survive_restart(tmp_path):
+    path = str(tmp_path / "results.db")
+    ResultCache("ns", sqlite_path=path).put("k", {"v": 1})
+    cache = ResultCache("ns", sqlite_path=path)
+    assert cache.get("k") == {"v": 1}
+    assert cache.get("k") == {"v": 1}
+    assert (cache.stats()["disk_hits"], cache.stats()["memory_hits"]) == (1, 1)
+
+
+def test_evicted_entry_is_reloaded_from_disk(tmp_path):
+    cache = ResultCache("ns", max_entries=1, sqlite_path=str(tmp_path / "results.db"))
+    cache.put("a", {"v": "a"})
+    cache.put("b", {"v": "b"})
+    assert cache.get("a") == {"v": "a"}
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_other_namespaces_and_expired_rows_are_purged_on_open(tmp_path, clock):
+    path = str(tmp_path / "results.db")
+    old_model = ResultCache("model-a:v1", sqlite_path=path)
+    old_model.put("k", {"v": 1})
+    short_lived = ResultCache("model-b:v1", ttl_s=5, sqlite_path=path)
+    short_lived.put("expiring", {"v": 2})
+    short_lived.put("kept", {"v": 3})
+    clock.now += 1
+    short_lived.put("kept", {"v": 3})
+    clock.now += 5
+
+    cache = ResultCache("model-b:v1", sqlite_path=path)
+    rows = cache._db.execute("SELECT key FROM results").fetchall()
+    assert rows == [("kept",)]
+    assert ResultCache("model-a:v1", sqlite_path=path).get("k") is None
+
+
+def test_invalidate_drops_memory_and_disk(tmp_path):
+    path = str(tmp_path / "results.db")
+    cache = ResultCache("ns", sqlite_path=path)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.invalidate() == 2
+    assert cache.get("a") is None
+    assert ResultCache("ns", sqlite_path=path).get("b") is None
+
+
+def test_settings_version_tracks_settings_and_files(tmp_path):
+    table = tmp_path / "icd10cm.idx"
+    missing = str(tmp_path / "icd10cm_bm25.npz")
+    table.write_bytes(b"v1")
+    version = settings_version({"ICD10_COMPACT_OUTPUT": False}, (str(table), missing))
+    assert version == settings_version({"ICD10_COMPACT_OUTPUT": False}, (str(table), missing))
+    assert version != settings_version({"ICD10_COMPACT_OUTPUT": True}, (str(table), missing))
+
+    table.write_bytes(b"v2 rebuilt")
+    rebuilt = settings_version({"ICD10_COMPACT_OUTPUT": False}, (str(table), missing))
+    assert rebuilt != version
+    os.remove(table)
+    assert settings_version({"ICD10_COMPACT_OUTPUT": False}, (str(table), missing)) not in (version, rebuilt)
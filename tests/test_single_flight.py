@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from app.utils.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+        release = asyncio.Event()
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return {"calls": calls}
+
+        waiters = [asyncio.create_task(flight.do("key", work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert flight.stats() == {"in_flight": 1, "leaders": 1, "coalesced": 2}
+        release.set()
+        results = await asyncio.gather(*waiters)
+        return calls, results, flight.stats()
+
+    calls, results, stats = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [{"calls": 1}] * 3
+    assert stats["in_flight"] == 0
+
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work(value):
+            await asyncio.sleep(0)
+            return value
+
+        results = await asyncio.gather(flight.do("a", lambda: work(1)), flight.do("b", lambda: work(2)))
+        return results, flight.stats()
+
+    results, stats = asyncio.run(scenario())
+    assert results == [1, 2]
+    assert (stats["leaders"], stats["coalesced"]) == (2, 0)
+
+
+def test_exception_is_shared_and_nothing_is_remembered():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def failing():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0)
+            raise RuntimeError("model crashed")
+
+        outcomes = await asyncio.gather(flight.do("key", failing), flight.do("key", failing),
+                                        return_exceptions=True)
+        assert calls == 1
+        assert all(isinstance(o, RuntimeError) for o in outcomes)
+        # Once finished, the next call starts fresh work
+        with pytest.raises(RuntimeError):
+            await flight.do("key", failing)
+        return calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "done"
+
+        leader = asyncio.create_task(flight.do("key", work))
+        follower = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return leader.cancelled(), await follower
+
+    assert asyncio.run(scenario()) == (True, "done")
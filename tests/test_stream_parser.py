@@ -0,0 +1,55 @@
+from app.utils.stream_parser import IncrementalJSONParser
+
+
+def feed_all(text: str, step: int = 3):
+    """Feed `text` a few characters at a time, as tokens arrive, and collect the events."""
+    parser = IncrementalJSONParser()
+    events = []
+    for i in range(0, len(text), step):
+        events.extend(parser.feed(text[i:i + step]))
+    return parser, events
+
+
+def test_code_objects_are_emitted_as_they_close():
+    parser = IncrementalJSONParser()
+    assert parser.feed('[{"code": "K35.80", "description": "Appendicitis"}, {"code": "R1') == [
+        ("item", {"code": "K35.80", "description": "Appendicitis"})
+    ]
+    assert parser.feed('0.9", "description": "Abdominal pain"}]') == [
+        ("item", {"code": "R10.9", "description": "Abdominal pain"})
+    ]
+    assert parser.finished
+
+
+def test_string_elements_are_emitted():
+    assert IncrementalJSONParser().feed('["K35.80", "R10.9"]') == [("item", "K35.80"), ("item", "R10.9")]
+
+
+def test_string_element_split_across_chunks():
+    parser, events = feed_all('["K35.80", "R10.9", "E11.9"]', step=2)
+    assert events == [("item", "K35.80"), ("item", "R10.9"), ("item", "E11.9")]
+    assert parser.finished
+
+
+def test_escaped_quote_does_not_close_string():
+    assert IncrementalJSONParser().feed(r'["a\"b", "c"]') == [("item", 'a"b'), ("item", "c")]
+
+
+def test_object_fields_are_emitted_as_they_close():
+    text = '{"Subjective": "Headache.", "Objective": {"bp": "120/80"}, "Plan": "Rest."}'
+    parser, events = feed_all(text)
+    assert events == [
+        ("field", ("Subjective", "Headache.")),
+        ("field", ("Objective", {"bp": "120/80"})),
+        ("field", ("Plan", "Rest.")),
+    ]
+    assert parser.finished
+
+
+def test_leading_fence_is_skipped_and_trailing_text_ignored():
+    _, events = feed_all('```json\n["I10"]\n```\nDone [extra]')
+    assert events == [("item", "I10")]
+
+
+def test_unterminated_item_is_not_emitted():
+    assert IncrementalJSONParser().feed('["K35.80", "R1') == [("item", "K35.80")]